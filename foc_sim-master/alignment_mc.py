@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Monte-Carlo robustness analysis of FOC incremental angle-offset alignment.
+
+FOC_Controller estimates the offset between measured rotor position and
+the real electrical angle from the d-axis voltage error while the motor
+spins.  alignmentRatio() gives a rough idea of how well this converges,
+this module measures it instead : random scenarios are drawn for the
+initial angle offset, supply voltage, load inertia and sensor noise, every
+scenario is simulated with the batch simulator, and the estimated offset
+is checked against the real one.
+
+A scenario has converged when the offset error stays inside tolerance
+until the end of the simulation, time-to-converge is the time it entered
+the tolerance band for the last time.
+
+Scenarios are split into chunks that run on all CPU cores, each chunk is a
+single batch simulation.  Every chunk gets its own seed derived from the
+main seed, so results do not depend on the number of workers.
+
+Example:
+  ./alignment_mc.py --samples 4000 --runtime 0.06 -o alignment.npz
+"""
+
+import math
+import os
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+
+from batch_sim import run_batch
+from foc_cleaned import alignmentRatio
+from motor_sim_cleaned import Maxon_339283, Maxon_339283_Controller_Gains, SimConfig
+from trace_recorder import sized_trace_options
+
+
+# default (low, high) ranges of uniformly sampled scenario parameters
+DEFAULT_RANGES = dict(
+    el_angle_offset=(-math.pi, math.pi),                    # electrical radians
+    supply_voltage=(18.0, 30.0),                            # Volts
+    load_inertia=(0.0, 2e-5),                               # kg*m^2
+    current_noise=(0.0, 0.02),                              # Amps (standard deviation)
+    position_noise=(0.0, 0.5*math.pi/180),                  # mechanical radians (standard deviation)
+)
+
+SAMPLE_FIELDS = tuple(sorted(DEFAULT_RANGES)) + ('converged', 'time_to_converge', 'final_error')
+
+
+def sample_scenarios(count, rng, ranges=None):
+    """ Returns {parameter : array of count uniformly sampled values} """
+    ranges = dict(DEFAULT_RANGES, **(ranges or {}))
+    return dict((name, rng.uniform(low, high, count)) for name, (low, high) in sorted(ranges.items()))
+
+
+def wrap_angle(angle):
+    """ Wraps angle into range [-pi, pi) """
+    return (angle + math.pi) % (2*math.pi) - math.pi
+
+
+def convergence(t, offset_error, tolerance):
+    """ Returns (converged, time_to_converge, final_error) arrays for offset error traces.
+    t has shape (samples,), offset_error has shape (samples, N)
+    """
+    outside = abs(offset_error) > tolerance
+    samples = len(t)
+    # index of last sample outside tolerance band, -1 if always inside
+    last_outside = numpy.where(outside.any(axis=0), samples - 1 - numpy.argmax(outside[::-1], axis=0), -1)
+    converged = last_outside < samples - 1
+    entered = numpy.minimum(last_outside + 1, samples - 1)
+    time_to_converge = numpy.where(converged, t[entered], numpy.nan)
+    return converged, time_to_converge, offset_error[-1]
+
+
+def run_chunk(args):
+    """ Simulates one chunk of scenarios in worker process, returns dict of result arrays """
+    motor, gains, scenarios, runtime, tolerance, seed = args
+    # PWM and FOC rates of default SimConfig, FOC trace sized for every 4th update
+    config = SimConfig(runtime=runtime)
+    motor_sim, foc = run_batch(motor, gains.d_gains, gains.q_gains, runtime=runtime,
+                               pwm_dt=config.pwm_dt, foc_update_cycles=config.foc_update_cycles,
+                               motor_trace_options=dict(decimation=0),
+                               foc_trace_options=sized_trace_options(runtime, config.foc_dt, decimation=4),
+                               seed=seed, **scenarios)
+    trace = foc.trace
+    offset_error = wrap_angle(scenarios['el_angle_offset'] - trace.el_angle_offset)
+    converged, time_to_converge, final_error = convergence(trace.t[:, 0], offset_error, tolerance)
+    result = dict(scenarios)
+    result.update(converged=converged, time_to_converge=time_to_converge, final_error=final_error)
+    return result
+
+
+def run_monte_carlo(samples=2000, runtime=60e-3, tolerance=2.0*math.pi/180, ranges=None,
+                    motor=None, gains=None, chunk=250, workers=None, seed=0):
+    """ Runs Monte-Carlo alignment analysis, returns dict of per-sample result arrays (see SAMPLE_FIELDS) """
+    motor = motor or Maxon_339283()
+    gains = gains or Maxon_339283_Controller_Gains()
+    seeds = numpy.random.SeedSequence(seed).spawn((samples + chunk - 1) // chunk)
+    jobs = []
+    for n, chunk_seed in enumerate(seeds):
+        count = min(chunk, samples - n*chunk)
+        rng = numpy.random.default_rng(chunk_seed)
+        jobs.append((motor, gains, sample_scenarios(count, rng, ranges), runtime, tolerance, rng.integers(2**63)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = list(pool.map(run_chunk, jobs))
+    return dict((name, numpy.concatenate([c[name] for c in chunks])) for name in SAMPLE_FIELDS)
+
+
+def summarize(results):
+    """ Returns dict with convergence probability and time-to-converge percentiles """
+    converged = results['converged']
+    times = results['time_to_converge'][converged]
+    summary = dict(samples=len(converged), convergence_probability=converged.mean())
+    for p in (10, 50, 90, 99):
+        summary['time_p%d' % p] = numpy.percentile(times, p) if len(times) else math.nan
+    summary['time_max'] = times.max() if len(times) else math.nan
+    return summary
+
+
+def convergence_by(results, name, bins=8):
+    """ Returns list of (low, high, samples, convergence probability) for bins of one parameter """
+    values = results[name]
+    edges = numpy.linspace(values.min(), values.max(), bins + 1)
+    index = numpy.clip(numpy.searchsorted(edges, values, side='right') - 1, 0, bins - 1)
+    rows = []
+    for b in range(bins):
+        selected = index == b
+        count = int(selected.sum())
+        rows.append((edges[b], edges[b+1], count, results['converged'][selected].mean() if count else math.nan))
+    return rows
+
+
+def write_samples(results, path):
+    """ Writes per-sample results to .npz or .csv file """
+    if path.lower().endswith('.npz'):
+        numpy.savez_compressed(path, **results)
+    else:
+        table = numpy.column_stack([results[name].astype(float) for name in SAMPLE_FIELDS])
+        numpy.savetxt(path, table, delimiter=',', header=','.join(SAMPLE_FIELDS), comments='')
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Monte-Carlo analysis of FOC angle offset alignment")
+    parser.add_argument('--samples', type=int, default=2000, help="number of random scenarios")
+    parser.add_argument('--runtime', type=float, default=60e-3, help="simulation time per scenario (seconds)")
+    parser.add_argument('--tolerance', type=float, default=2.0, help="converged offset tolerance (electrical degrees)")
+    parser.add_argument('--chunk', type=int, default=250, help="scenarios per batch simulation")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help="per-sample results (.npz or .csv)")
+    args = parser.parse_args()
+
+    motor = Maxon_339283()
+    alignmentRatio(motor)
+    start = time.time()
+    results = run_monte_carlo(args.samples, args.runtime, args.tolerance*math.pi/180,
+                              chunk=args.chunk, workers=args.workers, seed=args.seed)
+    print("%d scenarios in %.1f seconds" % (args.samples, time.time() - start))
+
+    summary = summarize(results)
+    print("convergence probability %.3f" % summary['convergence_probability'])
+    print("time to converge (ms) : p10 %.2f  p50 %.2f  p90 %.2f  p99 %.2f  max %.2f" %
+          tuple(summary[k] * 1e3 for k in ('time_p10', 'time_p50', 'time_p90', 'time_p99', 'time_max')))
+    for name, scale, unit in (('el_angle_offset', 180/math.pi, 'deg'), ('supply_voltage', 1.0, 'V'),
+                              ('load_inertia', 1e7, 'gcm2'), ('current_noise', 1e3, 'mA'),
+                              ('position_noise', 180/math.pi, 'deg')):
+        print("convergence vs %s (%s)" % (name, unit))
+        for low, high, count, probability in convergence_by(results, name):
+            print("  %9.3f .. %9.3f : %5d samples  %.3f" % (low*scale, high*scale, count, probability))
+
+    if args.output:
+        write_samples(results, args.output)
+        print("per-sample results written to %s" % args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Sine lookup table with linear interpolation for electrical angle transforms.
+
+Embedded FOC implementations rarely call a full sin()/cos(), instead they
+look up the angle in a table and interpolate between neighbouring entries.
+AngleLUT does the same so MotorSim and FOC_Controller can be run with the
+same angle resolution as the target.
+
+The table covers one electrical cycle in `size` steps.  With linear
+interpolation the error of sin() and cos() is bounded by
+    |error| <= h**2 / 8    where h = 2*pi/size
+since |d2/dA2 sin(A)| <= 1.  size is a multiple of 12 so the 120 degree phase
+offsets and the 90 degree cos() offset fall exactly on table entries, which
+lets sin3() and sincos() share one index calculation for all their values.
+
+Run this file to print the measured error and speed compared to math.sin().
+Note that in CPython a table lookup is not faster than math.sin(), both are
+dominated by interpreter overhead, so the main reason to use a table is to
+see how angle resolution of the target affects the controller.
+"""
+
+from math import sin, cos, pi, floor, ceil, sqrt
+
+
+def error_bound(size):
+    """ Returns maximum interpolation error of table with size entries per cycle """
+    h = 2*pi / size
+    return h*h / 8.0
+
+
+class AngleLUT:
+    """ Interpolated sin/cos lookup table.
+    sin3(angle) returns sines of the three phase angles (A, A-120, A+120),
+    sincos(angle) returns (sin(A), cos(A)) like a Park transform needs
+    """
+    def __init__(self, size=3072):
+        size = int(size)
+        if size <= 0 or size % 12:
+            raise ValueError("table size must be a positive multiple of 12, got %d" % size)
+        self.size = size
+        self.scale = size / (2*pi)
+        self.max_error = error_bound(size)
+        # offsets in table entries
+        self.third = size // 3
+        self.quarter = size // 4
+        # table holds two cycles (+1 entry for interpolation), so adding a phase
+        # offset to a wrapped index never needs to wrap again
+        self.table = [sin(2*pi*i / size) for i in range(2*size + 1)]
+
+    @classmethod
+    def for_max_error(cls, max_error):
+        """ Returns smallest table that guarantees error below max_error """
+        size = int(ceil(2*pi / sqrt(8.0*max_error)))
+        size = (size + 11) // 12 * 12
+        return cls(size)
+
+    def sin(self, angle):
+        x = angle * self.scale
+        i = floor(x)
+        f = x - i
+        i %= self.size
+        table = self.table
+        s = table[i]
+        return s + (table[i+1] - s)*f
+
+    def cos(self, angle):
+        return self.sin(angle + 0.5*pi)
+
+    def sincos(self, angle):
+        """ Returns (sin(angle), cos(angle)) """
+        x = angle * self.scale
+        i = floor(x)
+        f = x - i
+        i %= self.size
+        table = self.table
+        s = table[i]
+        j = i + self.quarter
+        c = table[j]
+        return (s + (table[i+1] - s)*f,
+                c + (table[j+1] - c)*f)
+
+    def sin3(self, angle):
+        """ Returns (sin(angle), sin(angle-2*pi/3), sin(angle+2*pi/3)) """
+        x = angle * self.scale
+        i = floor(x)
+        f = x - i
+        i %= self.size
+        table = self.table
+        third = self.third
+        sa = table[i]
+        j = i + third + third   # -120 degrees == +240 degrees
+        sb = table[j]
+        k = i + third
+        sc = table[k]
+        return (sa + (table[i+1] - sa)*f,
+                sb + (table[j+1] - sb)*f,
+                sc + (table[k+1] - sc)*f)
+
+
+def measure_error(lut, samples=200000, max_angle=1000.0):
+    """ Returns largest sin/cos error of lut over evenly spread angles in +/- max_angle """
+    worst = 0.0
+    for n in range(samples):
+        angle = -max_angle + 2.0*max_angle*n/samples
+        sa, sb, sc = lut.sin3(angle)
+        s, c = lut.sincos(angle)
+        worst = max(worst,
+                    abs(sa - sin(angle)), abs(sb - sin(angle-pi*2/3)), abs(sc - sin(angle+pi*2/3)),
+                    abs(s - sin(angle)), abs(c - cos(angle)))
+    return worst
+
+
+def benchmark(sizes=(384, 3072, 24576), runtime=50e-3):
+    """ Prints interpolation error and speed of lookup tables compared to math.sin """
+    import time
+    from motor_sim_cleaned import SimConfig, run_simulation
+
+    def exact_sin3(angle):
+        return (sin(angle), sin(angle-pi*2/3), sin(angle+pi*2/3))
+
+    def time_calls(fn, count=200000):
+        start = time.perf_counter()
+        for n in range(count):
+            fn(n * 0.001)
+        return (time.perf_counter() - start) / count
+
+    exact_time = time_calls(exact_sin3)
+    print("math.sin x3 : %.0f ns per call" % (exact_time * 1e9))
+    for size in sizes:
+        lut = AngleLUT(size)
+        lut_time = time_calls(lut.sin3)
+        print("table size %6d : bound %.2e, measured max error %.2e, sin3 %.0f ns per call (%.2fx)" %
+              (size, lut.max_error, measure_error(lut), lut_time * 1e9, exact_time / lut_time))
+
+    lut = AngleLUT()
+    base_config = SimConfig(runtime=runtime, el_angle_offset=-0.3)
+    lut_config = base_config.copy(motor_angle_lut=lut, foc_angle_lut=lut)
+    results = []
+    for name, config in (("math.sin", base_config), ("AngleLUT(%d)" % lut.size, lut_config)):
+        start = time.perf_counter()
+        results.append(run_simulation(config))
+        print("%s : %.3f seconds for %gms simulation" % (name, time.perf_counter() - start, runtime * 1e3))
+    exact, approx = results
+    print("largest phase current difference %.3g A, final Iq difference %.3g A" %
+          (abs(exact.motor.ia - approx.motor.ia).max(),
+           abs(exact.foc.measured_iq[-1] - approx.foc.measured_iq[-1])))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Batch version of motor simulator and FOC controller.
+
+BatchMotorSim and BatchFOC_Controller implement exactly the same equations as
+MotorSim and FOC_Controller, but every state variable is a NumPy array of
+shape (N,) with one entry per simulated scenario.  One call to update()
+advances all N scenarios by one step, so a parameter sweep over gains, load
+inertia, angle offset, etc.. costs about the same number of Python operations
+as a single simulation.
+
+Any parameter that differs between scenarios can be given as an array of
+shape (N,), parameters that are the same for all scenarios can be scalars.
+All scenarios share the same motor parameters and time-step.
+"""
+
+import numpy
+from numpy import sin, cos, sqrt, pi
+from trace_recorder import TraceRecorder
+from motor_catalog import as_motor_params
+
+
+class BatchMotorSim:
+    """ Simulates N motors in lock-step, see MotorSim for description of motor model """
+    trace_fields = ('t', 'ia', 'ib', 'ic', 'torque', 'velocity', 'position')
+
+    def __init__(self, motor, load_inertia, count, start_position=0.0, trace_options=None):
+        self.motor = as_motor_params(motor)
+        self.count = count
+        self.load_inertia = numpy.broadcast_to(numpy.asarray(load_inertia, dtype=float), (count,))
+        zeros = numpy.zeros(count)
+        self.t = 0.0
+        self.ia = zeros.copy()
+        self.ib = zeros.copy()
+        self.ic = zeros.copy()
+        self.backemf_a = zeros.copy()
+        self.backemf_b = zeros.copy()
+        self.backemf_c = zeros.copy()
+        self.velocity = zeros.copy()
+        self.position = zeros + start_position
+        self.trace = TraceRecorder(self.trace_fields, shape=(count,), **(trace_options or {}))
+        self.trace.record(0.0, zeros, zeros, zeros, zeros, zeros, self.position)
+
+    def update(self, t, dt, vxa, vxb, vxc):
+        """ Updates state of all motors given excited voltages on each phase,
+        voltages can be arrays of shape (N,)
+        t is the current time
+        dt is the timestep
+        """
+        motor = self.motor
+
+        vcenter = (vxa + vxb + vxc) / 3.0
+        va = vxa - vcenter
+        vb = vxb - vcenter
+        vc = vxc - vcenter
+
+        R = motor.phase_resistance
+        L = motor.phase_inductance
+
+        ia = self.ia + (va - self.backemf_a - self.ia * R) / L * dt
+        ib = self.ib + (vb - self.backemf_b - self.ib * R) / L * dt
+        ic = self.ic + (vc - self.backemf_c - self.ic * R) / L * dt
+
+        iavg = (ia + ib + ic) / 3.0
+        ia -= iavg
+        ib -= iavg
+        ic -= iavg
+
+        el_angle = self.position * motor.pole_pairs
+        sa = sin(el_angle)
+        sb = sin(el_angle - pi*2/3)
+        sc = sin(el_angle + pi*2/3)
+
+        torque_constant = motor.phase_torque_constant  # motor.torque_constant * pi/3 / sqrt(3)
+        torque = (ia*sa + ib*sb + ic*sc) * torque_constant
+
+        velocity = self.velocity
+        velocity = velocity + (torque - velocity*motor.friction)/(motor.rotor_inertia + self.load_inertia)*dt
+        position = self.position + velocity*dt
+
+        voltage_constant = torque_constant
+        self.backemf_a = sa * velocity * voltage_constant
+        self.backemf_b = sb * velocity * voltage_constant
+        self.backemf_c = sc * velocity * voltage_constant
+
+        self.t = t
+        self.ia = ia
+        self.ib = ib
+        self.ic = ic
+        self.velocity = velocity
+        self.position = position
+
+        self.trace.record(t, ia, ib, ic, torque, velocity, position)
+
+        return (position, velocity, ia, ib, ic)
+
+
+class BatchPI_Controller:
+    """ N independent copies of PI_Controller, gains can be arrays of shape (N,) """
+    def __init__(self, gains, count):
+        p_gain, i_gain = gains
+        self.p_gain = numpy.broadcast_to(numpy.asarray(p_gain, dtype=float), (count,))
+        self.i_gain = numpy.broadcast_to(numpy.asarray(i_gain, dtype=float), (count,))
+        self.i_term = numpy.zeros(count)
+
+    def update(self, t, dt, error):
+        i_term = numpy.clip(self.i_term + error*self.i_gain*dt, -1.0, 1.0)
+        output = numpy.clip(error*self.p_gain + i_term, -1.0, 1.0)
+        self.i_term = i_term
+        return output
+
+
+class BatchFOC_Controller:
+    """ N independent copies of FOC_Controller, see FOC_Controller for description of algorithm.
+    d_gains and q_gains are (p_gain, i_gain) pairs where each gain can be an array of shape (N,)
+    """
+    trace_fields = ('t', 'measured_torque', 'measured_id', 'measured_iq', 'target_torque',
+                    'target_iq', 'cmd_d', 'cmd_q', 'el_angle_offset', 'torque_limit')
+
+    def __init__(self, dt, motor, d_gains, q_gains, supply_current_limit, count, trace_options=None):
+        self.name = "Batch Python FOC"
+        self.dt = dt
+        self.motor = as_motor_params(motor)
+        self.count = count
+        self.supply_current_limit = numpy.broadcast_to(numpy.asarray(supply_current_limit, dtype=float), (count,))
+
+        self.d_ctrl = BatchPI_Controller(d_gains, count)
+        self.q_ctrl = BatchPI_Controller(q_gains, count)
+
+        zeros = numpy.zeros(count)
+        self.cmd_d = zeros.copy()
+        self.cmd_q_filt = zeros.copy()
+        self.el_angle_offset = zeros.copy()
+
+        self.trace = TraceRecorder(self.trace_fields, shape=(count,), **(trace_options or {}))
+        self.trace.record(*((zeros,) * len(self.trace_fields)))
+
+    def reset(self, velocity, supply_voltage):
+        self.d_ctrl.i_term = numpy.zeros(self.count)
+        self.q_ctrl.i_term = numpy.zeros(self.count) - velocity * self.motor.torque_constant / supply_voltage * pi/3.0
+        self.cmd_q_filt = numpy.zeros(self.count)
+
+    def update(self, t, target_torque, position, velocity, ia, ib, ic, supply_voltage):
+        dt = self.dt
+        motor = self.motor
+        target_torque = numpy.broadcast_to(numpy.asarray(target_torque, dtype=float), (self.count,))
+
+        torque_constant = motor.foc_torque_constant # motor.torque_constant * sqrt(2)*3/pi
+
+        # dynamic torque limit based on supply current limit,
+        # only active for scenarios with positive limit and non-zero filtered cmd_q
+        cmd_q_filt = self.cmd_q_filt
+        sqrt2 = 1.4142135623730951 # sqrt(2)
+        limited = (self.supply_current_limit > 0.0) & (abs(cmd_q_filt) > 1e-3)
+        safe_cmd_q_filt = numpy.where(limited, cmd_q_filt, 1.0)
+        torque_limit = numpy.where(limited, -torque_constant*self.supply_current_limit*sqrt2/safe_cmd_q_filt, 0.0)
+        target_torque = numpy.where(limited & (torque_limit > 0.0), numpy.minimum(target_torque, torque_limit),
+                                    numpy.where(limited, numpy.maximum(target_torque, torque_limit), target_torque))
+        target_torque = numpy.clip(target_torque, -motor.max_torque, motor.max_torque)
+
+        # Clarke Transform
+        s30 = 0.5  # sin(30)
+        c30 = 0.8660254037844387 # cos(30)
+        sqrt2d3 = 0.816496580927726 # sqrt(2/3)
+        i_alpha = sqrt2d3 * (ia  - s30*ib - s30*ic)
+        i_beta  = sqrt2d3 * (      c30*ib - c30*ic)
+
+        el_angle = position * motor.pole_pairs - self.el_angle_offset
+
+        # Park Transform
+        s1 = sin(el_angle)
+        c1 = cos(el_angle)
+        measured_id =   c1*i_alpha + s1*i_beta
+        measured_iq =  -s1*i_alpha + c1*i_beta
+        measured_torque = -measured_iq * torque_constant
+
+        target_id = 0.0
+        target_iq = -target_torque / torque_constant
+
+        cmd_d = self.d_ctrl.update(t, dt, target_id - measured_id)
+        cmd_q = self.q_ctrl.update(t, dt, target_iq - measured_iq)
+
+        # circle limit on d/q commands
+        mag = numpy.maximum(sqrt(cmd_d*cmd_d + cmd_q*cmd_q), 1.0)
+        cmd_d = cmd_d / mag
+        cmd_q = cmd_q / mag
+
+        cmd_q_filt = cmd_q_filt + (cmd_q - cmd_q_filt) * 0.25
+
+        el_velocity = velocity * motor.pole_pairs
+        el_angle2 = el_angle + (el_velocity * dt) * 1.32
+
+        # inverse Park transform
+        s2 = sin(el_angle2)
+        c2 = cos(el_angle2)
+        cmd_alpha =  c2*cmd_d - s2*cmd_q
+        cmd_beta  =  s2*cmd_d + c2*cmd_q
+
+        # inverse Clarke transform
+        inv_sqrt3 = 0.5773502691896258 # 1/sqrt(3)
+        cmd_a = inv_sqrt3 * (      cmd_alpha                )
+        cmd_b = inv_sqrt3 * ( -s30*cmd_alpha + c30*cmd_beta )
+        cmd_c = inv_sqrt3 * ( -s30*cmd_alpha - c30*cmd_beta )
+
+        # quasi-SVM
+        cmd_min = numpy.minimum(numpy.minimum(cmd_a, cmd_b), cmd_c)
+        cmd_a = cmd_a - cmd_min
+        cmd_b = cmd_b - cmd_min
+        cmd_c = cmd_c - cmd_min
+
+        # el_angle_offset estimator
+        cmd_vd = supply_voltage*self.cmd_d
+        L = motor.foc_inductance # motor.terminal_inductance / sqrt(2)
+        est_vd = - el_velocity * measured_iq * L
+        error_vd = cmd_vd - est_vd
+        backemf_voltage = velocity * motor.torque_constant
+        estimating = abs(backemf_voltage) > 1.0
+        safe_backemf_voltage = numpy.where(estimating, backemf_voltage, 1.0)
+        est_el_angle_offset = numpy.where(estimating, -error_vd / safe_backemf_voltage, 0.0)
+        alpha = 0.01
+        el_angle_offset = self.el_angle_offset + alpha * est_el_angle_offset
+
+        self.cmd_d = cmd_d
+        self.cmd_q_filt = cmd_q_filt
+        self.el_angle_offset = el_angle_offset
+
+        self.trace.record(t, measured_torque, measured_id, measured_iq, target_torque,
+                          target_iq, cmd_d, cmd_q, el_angle_offset, torque_limit)
+
+        return (cmd_a, cmd_b, cmd_c)
+
+
+def scenario_count(*params):
+    """ Returns number of scenarios N from broadcast shape of per-scenario parameters """
+    shape = numpy.broadcast(*[numpy.asarray(p) for p in params]).shape
+    if len(shape) > 1:
+        raise ValueError("per-scenario parameters must be scalars or 1-d arrays")
+    return shape[0] if shape else 1
+
+
+def run_batch(motor, d_gains, q_gains, load_inertia=0.0, el_angle_offset=0.0,
+              supply_voltage=24.0, target_torque=None, supply_current_limit=1.2,
+              pwm_dt=1.0/35e3, foc_update_cycles=1, motor_sim_substeps=8, runtime=15e-3,
+              motor_trace_options=None, foc_trace_options=None,
+              current_noise=0.0, position_noise=0.0, seed=None):
+    """ Runs same simulation loop as sim() for N scenarios at once.
+    Per-scenario parameters can be arrays of shape (N,).
+    current_noise (Amps) and position_noise (mechanical radians) are standard deviations of
+    gaussian noise added to phase currents and rotor position measured by the controller,
+    seed makes the noise repeatable.
+    Returns (motor_sim, foc) batch objects; their traces have shape (samples, N)
+    """
+    if target_torque is None:
+        target_torque = 0.65 * motor.max_torque
+    count = scenario_count(d_gains[0], d_gains[1], q_gains[0], q_gains[1], load_inertia,
+                           el_angle_offset, supply_voltage, target_torque, supply_current_limit,
+                           current_noise, position_noise)
+    current_noise = numpy.asarray(current_noise, dtype=float)
+    position_noise = numpy.asarray(position_noise, dtype=float)
+    add_current_noise = bool(current_noise.any())
+    add_position_noise = bool(position_noise.any())
+    rng = numpy.random.default_rng(seed)
+
+    angle_offset = numpy.asarray(el_angle_offset, dtype=float) / motor.pole_pairs
+    foc_dt = pwm_dt * foc_update_cycles
+    motor_sim_dt = pwm_dt / motor_sim_substeps
+
+    motor_sim = BatchMotorSim(motor, load_inertia, count, trace_options=motor_trace_options)
+    foc = BatchFOC_Controller(foc_dt, motor, d_gains, q_gains, supply_current_limit, count, foc_trace_options)
+    foc.reset(motor_sim.velocity, supply_voltage)
+
+    t = 0.0
+    zeros = numpy.zeros(count)
+    cmd_a, cmd_b, cmd_c = foc.update(t, 0.0, motor_sim.position, motor_sim.velocity, zeros, zeros, zeros, supply_voltage)
+    vxa = supply_voltage*cmd_a
+    vxb = supply_voltage*cmd_b
+    vxc = supply_voltage*cmd_c
+
+    while t < runtime:
+        for j in range(foc_update_cycles):
+            for i in range(motor_sim_substeps):
+                position, velocity, ia, ib, ic = motor_sim.update(t, motor_sim_dt, vxa, vxb, vxc)
+                t += motor_sim_dt
+            vxa = supply_voltage*cmd_a
+            vxb = supply_voltage*cmd_b
+            vxc = supply_voltage*cmd_c
+        measured_position = position + angle_offset
+        if add_position_noise:
+            measured_position = measured_position + position_noise*rng.standard_normal(count)
+        if add_current_noise:
+            ia = ia + current_noise*rng.standard_normal(count)
+            ib = ib + current_noise*rng.standard_normal(count)
+            ic = ic + current_noise*rng.standard_normal(count)
+        cmd_a, cmd_b, cmd_c = foc.update(t, target_torque, measured_position, velocity, ia, ib, ic, supply_voltage)
+
+    return motor_sim, foc
+
+
+if __name__ == "__main__":
+    import time
+    from motor_sim_cleaned import Maxon_339283, Maxon_339283_Controller_Gains
+
+    motor = Maxon_339283()
+    gains = Maxon_339283_Controller_Gains()
+
+    # sweep q-axis proportional gain, keep everything else at default values
+    q_p_gains = numpy.linspace(0.1, 1.0, 1000)
+    start = time.time()
+    motor_sim, foc = run_batch(motor, gains.d_gains, (q_p_gains, gains.q_gains[1]),
+                               foc_trace_options=dict(decimation=0), motor_trace_options=dict(decimation=0))
+    print("simulated %d scenarios in %.2f seconds" % (len(q_p_gains), time.time() - start))
+    print("final velocity range %.1f - %.1f rad/s" % (motor_sim.velocity.min(), motor_sim.velocity.max()))
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Benchmarks simulator speed and memory use on a set of standard scenarios.
+
+Every scenario is run for every FOC implementation in a fresh worker
+process, so peak RSS of one case does not leak into the next.  For each
+case the benchmark reports
+  steps_per_second : simulated motor steps per wall-clock second (best of --repeat runs)
+  peak_rss_mb : peak resident memory of worker process
+  traced_bytes_per_step : peak Python heap use (tracemalloc) divided by simulated steps
+
+Results are compared against a baseline JSON file.  A case whose speed dropped,
+or whose memory use grew, by more than --tolerance is reported as a regression
+and the script exits with status 1.  Baselines are machine specific, record
+one with --save-baseline before changing code.
+
+Scenarios:
+  stall : huge load inertia, rotor barely moves
+  spin_up : unloaded motor accelerating from rest
+  voltage_limited : low supply voltage, back-emf saturates controller output
+      (the FOC controller has no field weakening, this is the region where it would act)
+  current_limited : supply current limit clamps torque
+
+The C++ controller (FOC_CWrapper) is skipped if foc_py module is not built,
+the native C controller (foc_native.FOC_Native) if there is no C compiler.
+"""
+
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+from foc_cleaned import FOC_Controller, FOC_CWrapper
+from foc_native import FOC_Native, native_available
+from motor_sim_cleaned import SimConfig, run_simulation
+
+
+SCENARIOS = {
+    'stall': dict(load_inertia=1.0),
+    'spin_up': dict(),
+    'voltage_limited': dict(supply_voltage=6.0, supply_current_limit=-1.0),
+    'current_limited': dict(supply_current_limit=0.2),
+}
+
+CONTROLLERS = {
+    'python': FOC_Controller,
+    'cpp': FOC_CWrapper,
+    'native': FOC_Native,
+}
+
+# (metric, True if larger value is better)
+METRICS = (('steps_per_second', True), ('peak_rss_mb', False), ('traced_bytes_per_step', False))
+
+
+def controller_available(name):
+    if name == 'cpp':
+        try:
+            import foc_py
+        except ImportError:
+            return False
+    if name == 'native':
+        return native_available()
+    return True
+
+
+def run_case(args):
+    """ Runs one scenario/controller case in worker process, returns dict of metrics """
+    scenario, controller, runtime, repeat = args
+    config = SimConfig(runtime=runtime, controller=CONTROLLERS[controller], **SCENARIOS[scenario])
+
+    best = None
+    for n in range(repeat):
+        start = time.perf_counter()
+        result = run_simulation(config)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # first motor sample is initial state, not a simulated step
+    steps = len(result.motor) - 1
+    del result
+
+    tracemalloc.start()
+    run_simulation(config)
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_scale = 1.0 if sys.platform == 'darwin' else 1024.0
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_scale
+
+    return dict(steps=steps,
+                steps_per_second=steps / best,
+                peak_rss_mb=peak_rss / 1e6,
+                traced_bytes_per_step=traced_peak / float(steps))
+
+
+def run_benchmarks(scenarios=None, controllers=None, runtime=30e-3, repeat=3):
+    """ Runs every scenario for every available controller, returns {case_name : metrics} """
+    scenarios = scenarios or sorted(SCENARIOS)
+    controllers = [name for name in (controllers or sorted(CONTROLLERS)) if controller_available(name)]
+    cases = [(scenario, controller, runtime, repeat) for scenario in scenarios for controller in controllers]
+    # a new process for every case keeps peak RSS measurements independent
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        metrics = pool.map(run_case, cases, chunksize=1)
+    return dict(('%s/%s' % (scenario, controller), m) for (scenario, controller, r, n), m in zip(cases, metrics))
+
+
+def compare(results, baseline, tolerance):
+    """ Returns list of (case, metric, baseline value, new value) that are worse than tolerance """
+    regressions = []
+    for case, metrics in sorted(results.items()):
+        if case not in baseline:
+            continue
+        for metric, larger_is_better in METRICS:
+            old = baseline[case][metric]
+            new = metrics[metric]
+            if larger_is_better:
+                worse = new < old * (1.0 - tolerance)
+            else:
+                worse = new > old * (1.0 + tolerance)
+            if worse:
+                regressions.append((case, metric, old, new))
+    return regressions
+
+
+def print_results(results, baseline):
+    print("%-26s %14s %10s %12s %12s" % ('case', 'steps/s', 'vs base', 'peak RSS MB', 'bytes/step'))
+    for case, metrics in sorted(results.items()):
+        change = ''
+        if case in baseline:
+            change = '%+.1f%%' % (100.0 * (metrics['steps_per_second'] / baseline[case]['steps_per_second'] - 1.0))
+        print("%-26s %14.0f %10s %12.1f %12.1f" % (case, metrics['steps_per_second'], change,
+                                                   metrics['peak_rss_mb'], metrics['traced_bytes_per_step']))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark motor simulator and FOC controllers")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="scenario to run (default all)")
+    parser.add_argument('--controller', action='append', choices=sorted(CONTROLLERS), help="controller to run (default all)")
+    parser.add_argument('--runtime', type=float, default=30e-3, help="simulated time per run (seconds)")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per case, best is reported")
+    parser.add_argument('--baseline', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json'),
+                        help="baseline JSON file")
+    parser.add_argument('--save-baseline', action='store_true', help="write results as new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="allowed relative change before regression is reported")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(args.scenario, args.controller, args.runtime, args.repeat)
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("baseline written to %s" % args.baseline)
+        return 0
+
+    if not baseline:
+        print("no baseline at %s, run with --save-baseline to create one" % args.baseline)
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for case, metric, old, new in regressions:
+        print("REGRESSION %s %s : %.4g -> %.4g" % (case, metric, old, new))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Checkpoints of complete simulation state.
+
+run_simulation() saves the state of everything it simulates at the end of
+the run in result.state : time, motor currents / back-emf / velocity /
+position, FOC controller state (both PI controller integrators, filtered
+cmd_q, angle offset estimate), pending PWM commands and outer loop state of
+a trajectory.  Passing it back as run_simulation(config, start=state)
+continues the simulation from there until config.runtime, with exactly the
+same result as one long run.
+
+This makes it cheap to warm up a motor once and then fork many experiments:
+
+  warm = run_simulation(SimConfig(runtime=50e-3))
+  blob = warm.state.to_bytes()      # compact binary, about 250 bytes
+  for load in (0.005, 0.01, 0.02):
+      disturbance = Trajectory(0.03, load=Profile.steps([0.0, 52e-3], [0.0, load]))
+      result = run_simulation(SimConfig(runtime=60e-3, trajectory=disturbance), start=blob)
+
+Settings of the continued run may differ from the saved one (target torque,
+trajectory, load...), only the time steps must be the same.  Times of the
+continued run, including trajectory profiles, are absolute.  Sensor pipeline
+state (noise generator, delay buffers) is not saved, so configs with sensors
+can not be continued.
+
+A Checkpoint is a set of named sections of float values, to_bytes() writes
+  magic, version, number of sections
+  for every section : name length, value count, name, values (little endian doubles)
+"""
+
+import struct
+
+MAGIC = b'FOCSIMST'
+VERSION = 1
+HEADER = struct.Struct('<8sHH')
+SECTION = struct.Struct('<BI')
+
+
+class Checkpoint:
+    """ Simulation state as named sections of float values.
+    Sections written by run_simulation():
+      sim : (t, foc_dt, motor_sim_dt, vxa, vxb, vxc, cmd_a, cmd_b, cmd_c)
+      motor : MotorSim.get_state()
+      foc : FOC controller get_state()
+      trajectory : Trajectory.get_state(), only if config has a trajectory
+    """
+    def __init__(self, sections=None):
+        self.sections = dict((name, tuple(float(v) for v in values))
+                             for name, values in (sections or {}).items())
+
+    @property
+    def t(self):
+        return self.sections['sim'][0]
+
+    def __getitem__(self, name):
+        return self.sections[name]
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def get(self, name, default=None):
+        return self.sections.get(name, default)
+
+    def __eq__(self, other):
+        return isinstance(other, Checkpoint) and self.sections == other.sections
+
+    def __repr__(self):
+        return "Checkpoint(%s)" % ', '.join("%s[%d]" % (name, len(values))
+                                            for name, values in sorted(self.sections.items()))
+
+    def to_bytes(self):
+        parts = [HEADER.pack(MAGIC, VERSION, len(self.sections))]
+        for name, values in sorted(self.sections.items()):
+            key = name.encode('ascii')
+            parts.append(SECTION.pack(len(key), len(values)))
+            parts.append(key)
+            parts.append(struct.pack('<%dd' % len(values), *values))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        blob = bytes(blob)
+        if len(blob) < HEADER.size:
+            raise ValueError("checkpoint is truncated")
+        magic, version, count = HEADER.unpack_from(blob, 0)
+        if magic != MAGIC:
+            raise ValueError("not a simulation checkpoint")
+        if version != VERSION:
+            raise ValueError("unsupported checkpoint version %d" % version)
+        offset = HEADER.size
+        sections = {}
+        try:
+            for n in range(count):
+                key_size, size = SECTION.unpack_from(blob, offset)
+                offset += SECTION.size
+                name = blob[offset:offset+key_size].decode('ascii')
+                offset += key_size
+                sections[name] = struct.unpack_from('<%dd' % size, blob, offset)
+                offset += 8*size
+        except struct.error:
+            raise ValueError("checkpoint is truncated")
+        if offset != len(blob):
+            raise ValueError("checkpoint has %d bytes of trailing data" % (len(blob) - offset))
+        return cls(sections)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+def as_checkpoint(value):
+    """ Returns Checkpoint from Checkpoint or bytes written by Checkpoint.to_bytes() """
+    if isinstance(value, Checkpoint):
+        return value
+    return Checkpoint.from_bytes(value)
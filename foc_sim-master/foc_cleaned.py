@@ -27,6 +27,8 @@
 #
 
 from math import sin, cos, pi, sqrt
+from trace_recorder import create_trace, sub_trace_options
+from motor_catalog import as_motor_params
 
 
 ####################################################################################################
@@ -397,16 +399,18 @@ class PI_Controller:
     """ Specialized PI controller for FOC control, limits both output 
     and I-term to range of -1 to 1
     """
-    def __init__(self, gains):
+    trace_fields = ('t', 'i_term', 'output')
+
+    def __init__(self, gains, trace_options=None):
         p_gain, i_gain = gains
         self.p_gain = p_gain
         self.i_gain = i_gain
-        self.t = [0.0]
-        self.i_term = [0.0]
-        self.output = [0.0]
+        self.i_term = 0.0
+        self.trace = create_trace(self.trace_fields, **(trace_options or {}))
+        self.trace.record(0.0, 0.0, 0.0)
 
     def update(self, t, dt, error):
-        i_term = self.i_term[-1]
+        i_term = self.i_term
         i_term += error*self.i_gain*dt
         if i_term > 1.0: 
             i_term = 1.0        
@@ -417,67 +421,71 @@ class PI_Controller:
             output = 1.0
         elif output < -1.0:
             output = -1.0
-        self.output.append(output)
-        self.i_term.append(i_term)
-        self.t.append(t)
+        self.i_term = i_term
+        self.trace.record(t, i_term, output)
         return output
 
+    def get_state(self):
+        return (self.i_term,)
+
+    def set_state(self, state):
+        self.i_term, = state
+
 
 class FOC_Controller:
-    def __init__(self, dt, motor, d_gains, q_gains, supply_current_limit):
+    trace_fields = ('t', 'input_target_torque', 'measured_torque', 'measured_id', 'measured_iq',
+                    'target_torque', 'target_id', 'target_iq', 'cmd_a', 'cmd_b', 'cmd_c',
+                    'cmd_d', 'cmd_q', 'cmd_q_filt', 'cmd_vd', 'est_vd', 'error_vd', 'backemf_voltage',
+                    'est_el_angle_offset', 'el_angle_offset', 'torque_limit')
+
+    def __init__(self, dt, motor, d_gains, q_gains, supply_current_limit, trace_options=None, angle_lut=None):
         self.name = "Python FOC"
         self.dt = dt
-        self.motor = motor
+        self.motor = as_motor_params(motor)
         self.supply_current_limit = supply_current_limit
+        # optional angle_lut.AngleLUT, Park transforms use table lookup instead of math.sin/cos
+        self.angle_lut = angle_lut
 
-        self.d_ctrl = PI_Controller(d_gains)
-        self.q_ctrl = PI_Controller(q_gains)
-        
-        self.t = [0.0]
-        self.measured_torque = [0.0]
-        self.measured_id = [0.0]
-        self.measured_iq = [0.0]
-
-        self.input_target_torque = [0.0] # what torque was requested from higher level
-        self.target_torque = [0.0] #what torque was actually limited to
-        self.target_id = [0.0]
-        self.target_iq = [0.0]
-        
-        self.cmd_a = [0.0]
-        self.cmd_b = [0.0]
-        self.cmd_c = [0.0]
-
-        self.cmd_d = [0.0]
-        self.cmd_q = [0.0]
-        self.cmd_q_filt = [0.0]
-        self.cmd_vd = [0.0]
-        self.est_vd = [0.0]
-        self.error_vd = [0.0]
-        self.backemf_voltage = [0.0]
-        self.est_el_angle_offset = [0.0]
-        self.el_angle_offset = [0.0]
-
-        self.torque_limit = [0.0]
+        self.d_ctrl = PI_Controller(d_gains, sub_trace_options(trace_options, 'd_ctrl'))
+        self.q_ctrl = PI_Controller(q_gains, sub_trace_options(trace_options, 'q_ctrl'))
+
+        # controller state carried between updates
+        self.cmd_d = 0.0
+        self.cmd_q_filt = 0.0
+        self.el_angle_offset = 0.0
+
+        # recorded history of controller inputs, outputs and intermediate values
+        self.trace = create_trace(self.trace_fields, **(trace_options or {}))
+        self.trace.record(*((0.0,) * len(self.trace_fields)))
 
     def reset(self, velocity, supply_voltage):
-        self.d_ctrl.i_term[-1] = 0.0        
-        self.q_ctrl.i_term[-1] = -velocity * self.motor.torque_constant / supply_voltage * pi/3.0
-        self.cmd_q_filt[-1] = 0.0
+        self.d_ctrl.i_term = 0.0        
+        self.q_ctrl.i_term = -velocity * self.motor.torque_constant / supply_voltage * pi/3.0
+        self.cmd_q_filt = 0.0
+
+    def get_state(self):
+        """ Returns controller state, (cmd_d, cmd_q_filt, el_angle_offset, d i_term, q i_term) """
+        return (self.cmd_d, self.cmd_q_filt, self.el_angle_offset) + self.d_ctrl.get_state() + self.q_ctrl.get_state()
+
+    def set_state(self, state):
+        self.cmd_d, self.cmd_q_filt, self.el_angle_offset, d_i_term, q_i_term = state
+        self.d_ctrl.set_state((d_i_term,))
+        self.q_ctrl.set_state((q_i_term,))
 
     def update(self, t, target_torque, position, velocity, ia, ib, ic, supply_voltage):
         dt = self.dt 
         motor = self.motor
-        self.input_target_torque.append(target_torque)
+        input_target_torque = target_torque
 
         # Conversion from torque to quadrature current
         #     Torque =  pi/(sqrt(2)*3) * Kb * Iq
         #     Iq = Torque/Kb * sqrt(2)*3/pi        
-        torque_constant = self.motor.torque_constant * 0.7404804896930609 # sqrt(2)*3/pi
+        torque_constant = motor.foc_torque_constant # motor.torque_constant * sqrt(2)*3/pi
 
         # Have dynamic limit on torque based on supply current limit (aka a power limit)
         torque_limit = 0.0
         if self.supply_current_limit > 0.0:
-            cmd_q_filt = self.cmd_q_filt[-1]
+            cmd_q_filt = self.cmd_q_filt
             if abs(cmd_q_filt) > 1e-3:
                 sqrt2 = 1.4142135623730951 # sqrt(2)
                 torque_limit = -torque_constant*self.supply_current_limit*sqrt2/cmd_q_filt
@@ -509,8 +517,8 @@ class FOC_Controller:
         # Motor electrial angle, 
         #  the number of electical cycles for every mechanical rotor cycle depends 
         #  on the number of motor poles-pairs.
-        pole_pairs = self.motor.pole_pairs
-        el_angle = position * pole_pairs - self.el_angle_offset[-1]
+        pole_pairs = motor.pole_pairs
+        el_angle = position * pole_pairs - self.el_angle_offset
     
 
         # Park Tranform
@@ -519,8 +527,11 @@ class FOC_Controller:
         #  i_d = direct axis current
         #  i_q = quadrature axis current
         #  this is basicaly a rotatation matrix multiplication where by -el_angle
-        s1 = sin(el_angle)
-        c1 = cos(el_angle)
+        if self.angle_lut is None:
+            s1 = sin(el_angle)
+            c1 = cos(el_angle)
+        else:
+            s1, c1 = self.angle_lut.sincos(el_angle)
         measured_id =   c1*i_alpha + s1*i_beta
         measured_iq =  -s1*i_alpha + c1*i_beta
     
@@ -546,19 +557,22 @@ class FOC_Controller:
             cmd_q /= mag
 
         # Keep a filtered cmd_q value for supply current limiting
-        cmd_q_filt = self.cmd_q_filt[-1]
+        cmd_q_filt = self.cmd_q_filt
         cmd_q_filt += (cmd_q - cmd_q_filt) * 0.25
 
         # Project motor angle into future using time delay and current velocity
         #   delay is based time between measurement of  current values to execution of new commands
         #   this is about 1-2 PWM cycles
         #   this is not absolutely needed but improves performace at higher speeds
-        el_velocity = velocity * self.motor.pole_pairs
+        el_velocity = velocity * pole_pairs
         el_angle2 = el_angle + (el_velocity * dt) * 1.32
 
         # Map d/q commands back to stator referenced values (inverse park transform)
-        s2 = sin(el_angle2)
-        c2 = cos(el_angle2)
+        if self.angle_lut is None:
+            s2 = sin(el_angle2)
+            c2 = cos(el_angle2)
+        else:
+            s2, c2 = self.angle_lut.sincos(el_angle2)
         cmd_alpha =  c2*cmd_d - s2*cmd_q
         cmd_beta  =  s2*cmd_d + c2*cmd_q
         
@@ -577,45 +591,32 @@ class FOC_Controller:
 
         # Determine the difference between the commanded value of direct voltage 
         # and what is should be based on velocity and current
-        cmd_vd = supply_voltage*self.cmd_d[-1] 
-        L = self.motor.terminal_inductance / sqrt(2)
+        cmd_vd = supply_voltage*self.cmd_d 
+        L = motor.foc_inductance # motor.terminal_inductance / sqrt(2)
         est_vd = - el_velocity * measured_iq * L 
         error_vd = cmd_vd - est_vd
 
         # Update estimate of el_angle_offset
-        backemf_constant = self.motor.torque_constant
+        backemf_constant = motor.torque_constant
         backemf_voltage = velocity * backemf_constant
         if abs(backemf_voltage) > 1.0:
             est_el_angle_offset = -error_vd / backemf_voltage
             alpha = 0.01
-            el_angle_offset = self.el_angle_offset[-1] + alpha * est_el_angle_offset 
+            el_angle_offset = self.el_angle_offset + alpha * est_el_angle_offset 
         else:
             est_el_angle_offset = 0.0
-            el_angle_offset = self.el_angle_offset[-1]
+            el_angle_offset = self.el_angle_offset
+
+        # update state
+        self.cmd_d = cmd_d
+        self.cmd_q_filt = cmd_q_filt
+        self.el_angle_offset = el_angle_offset
 
         # record values
-        self.t.append(t)
-        self.measured_torque.append(measured_torque)
-        self.measured_id.append(measured_id)
-        self.measured_iq.append(measured_iq)
-        self.target_torque.append(target_torque)
-        self.target_id.append(target_id)
-        self.target_iq.append(target_iq)
-        self.cmd_a.append(cmd_a)
-        self.cmd_b.append(cmd_b)
-        self.cmd_c.append(cmd_c)
-
-        self.cmd_d.append(cmd_d)
-        self.cmd_q.append(cmd_q)
-        self.cmd_q_filt.append(cmd_q_filt)
-        self.cmd_vd.append(cmd_vd)
-        self.est_vd.append(est_vd)
-        self.error_vd.append(error_vd)
-        self.backemf_voltage.append(backemf_voltage)
-        self.est_el_angle_offset.append(est_el_angle_offset)
-        self.el_angle_offset.append(el_angle_offset)
-
-        self.torque_limit.append(torque_limit)
+        self.trace.record(t, input_target_torque, measured_torque, measured_id, measured_iq,
+                          target_torque, target_id, target_iq, cmd_a, cmd_b, cmd_c,
+                          cmd_d, cmd_q, cmd_q_filt, cmd_vd, est_vd, error_vd, backemf_voltage,
+                          est_el_angle_offset, el_angle_offset, torque_limit)
 
         return (cmd_a, cmd_b, cmd_c)
 
@@ -625,8 +626,10 @@ class FOC_Controller:
 class FOC_CWrapper:
     """ Wrapper around C++ implementation of FOC-algorithm 
     Makes interface to C++ functions almost exactly the same as the python implemenation.
+    foc_py is built outside this repository, foc_native.FOC_Native is a C implementation
+    that is built from this repository.
     """
-    def __init__(self, dt, motor, d_gains, q_gains, supply_current_limit):
+    def __init__(self, dt, motor, d_gains, q_gains, supply_current_limit, trace_options=None):
         self.name = "C++ FOC"
         # I know this is frowned upon, but we don't want to import foc_py
         # if we are not using it -- especially since it needs to be compiled first
@@ -650,30 +653,11 @@ class FOC_CWrapper:
         foc.pole_pairs = motor.pole_pairs
 
         self.cmds_v3 = foc_py.FOC_Vector3()
-        
-        self.t = [0.0]
-        self.input_target_torque = [0.0]
-        self.measured_torque = [0.0]
-        self.measured_id = [0.0]
-        self.measured_iq = [0.0]
-
-        self.target_torque = [0.0]
-        self.target_id = [0.0]
-        self.target_iq = [0.0]
-        
-        self.cmd_a = [0.0]
-        self.cmd_b = [0.0]
-        self.cmd_c = [0.0]
-
-        self.cmd_d = [0.0]
-        self.cmd_q = [0.0]
-        self.cmd_vd = [0.0]
-        self.est_vd = [0.0]
-        self.error_vd = [0.0]
-        self.backemf_voltage = [0.0]
-        self.est_el_angle_offset = [0.0]
-        self.el_angle_offset = [0.0]
-        self.torque_limit = [0.0]
+
+        # use same trace layout as python implementation so plotting code works for both,
+        # C++ implementation does not expose filtered cmd_q so it is recorded as 0
+        self.trace = create_trace(FOC_Controller.trace_fields, **(trace_options or {}))
+        self.trace.record(*((0.0,) * len(FOC_Controller.trace_fields)))
 
     def reset(self, velocity, supply_voltage):
         self.foc.reset(velocity, supply_voltage)
@@ -687,26 +671,9 @@ class FOC_CWrapper:
         cmd_c = self.cmds_v3.c
 
 
-        self.t.append(t)
-        self.input_target_torque.append(target_torque)
-        self.measured_torque.append(foc.measured_torque)
-        self.measured_id.append(foc.measured_id)
-        self.measured_iq.append(foc.measured_iq)
-        self.target_torque.append(target_torque)
-        self.target_id.append(foc.target_id)
-        self.target_iq.append(foc.target_iq)
-        self.cmd_a.append(cmd_a)
-        self.cmd_b.append(cmd_b)
-        self.cmd_c.append(cmd_c)
-
-        self.cmd_d.append(foc.cmd_d)
-        self.cmd_q.append(foc.cmd_q)
-        self.cmd_vd.append(foc.cmd_vd)
-        self.est_vd.append(foc.est_vd)
-        self.error_vd.append(foc.error_vd)
-        self.backemf_voltage.append(foc.backemf_voltage)
-        self.est_el_angle_offset.append(foc.est_el_angle_offset)
-        self.el_angle_offset.append(foc.el_angle_offset)
-        self.torque_limit.append(foc.torque_limit)
+        self.trace.record(t, target_torque, foc.measured_torque, foc.measured_id, foc.measured_iq,
+                          target_torque, foc.target_id, foc.target_iq, cmd_a, cmd_b, cmd_c,
+                          foc.cmd_d, foc.cmd_q, 0.0, foc.cmd_vd, foc.est_vd, foc.error_vd, foc.backemf_voltage,
+                          foc.est_el_angle_offset, foc.el_angle_offset, foc.torque_limit)
 
         return (cmd_a, cmd_b, cmd_c)
@@ -0,0 +1,394 @@
+/*
+ * Copyright (c) 2013, Unbounded Robotics Inc.
+ * All rights reserved.
+ *
+ * Redistribution and use in source and binary forms, with or without modification,
+ *  are permitted provided that the following conditions are met:
+ *
+ * 1. Redistributions of source code must retain the above copyright notice,
+ *  this list of conditions and the following disclaimer.
+ *
+ * 2. Redistributions in binary form must reproduce the above copyright notice,
+ *  this list of conditions and the following disclaimer in the documentation
+ *  and/or other materials provided with the distribution.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+ * AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+ * WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+ * IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+ * INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+ * NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+ * OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+ * WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ * ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+ * POSSIBILITY OF SUCH DAMAGE.
+ *
+ */
+
+/*
+ * Native FOC controller and Euler motor model, see foc_core.h
+ * Comments refer to matching steps of FOC_Controller.update(), see foc_cleaned.py for details.
+ */
+
+#include <math.h>
+#include "foc_core.h"
+
+#define PI 3.141592653589793
+#define SQRT2 1.4142135623730951     /* sqrt(2) */
+#define S30 0.5                      /* sin(30) */
+#define C30 0.8660254037844387       /* cos(30) */
+#define SQRT2D3 0.816496580927726    /* sqrt(2/3) */
+#define INV_SQRT3 0.5773502691896258 /* 1/sqrt(3) */
+
+/* Python min(a, b) and max(a, b), return first argument on ties */
+static double py_min(double a, double b) { return (b < a) ? b : a; }
+static double py_max(double a, double b) { return (b > a) ? b : a; }
+
+/* PI_Controller.update(), limits both output and I-term to range of -1 to 1 */
+static double pi_update(double *i_term, double p_gain, double i_gain, double dt, double error)
+{
+    double i = *i_term;
+    double output;
+    i += error*i_gain*dt;
+    if (i > 1.0)
+        i = 1.0;
+    else if (i < -1.0)
+        i = -1.0;
+    output = error*p_gain + i;
+    if (output > 1.0)
+        output = 1.0;
+    else if (output < -1.0)
+        output = -1.0;
+    *i_term = i;
+    return output;
+}
+
+void foc_init(foc_state *state)
+{
+    state->d_i_term = 0.0;
+    state->q_i_term = 0.0;
+    state->cmd_d = 0.0;
+    state->cmd_q_filt = 0.0;
+    state->el_angle_offset = 0.0;
+}
+
+void foc_reset(const foc_params *params, foc_state *state, double velocity, double supply_voltage)
+{
+    state->d_i_term = 0.0;
+    state->q_i_term = -velocity * params->backemf_constant / supply_voltage * PI/3.0;
+    state->cmd_q_filt = 0.0;
+}
+
+void foc_update(const foc_params *params, foc_state *state, double target_torque, double position,
+                double velocity, double ia, double ib, double ic, double supply_voltage, double *out)
+{
+    double dt = params->dt;
+    double torque_constant = params->torque_constant;
+    double input_target_torque = target_torque;
+    double torque_limit = 0.0;
+    double i_alpha, i_beta, el_angle, s1, c1, measured_id, measured_iq, measured_torque;
+    double target_id, target_iq, cmd_d, cmd_q, mag, cmd_q_filt;
+    double el_velocity, el_angle2, s2, c2, cmd_alpha, cmd_beta, cmd_a, cmd_b, cmd_c, cmd_min;
+    double cmd_vd, est_vd, error_vd, backemf_voltage, est_el_angle_offset, el_angle_offset;
+
+    /* dynamic torque limit based on supply current limit */
+    if (params->supply_current_limit > 0.0) {
+        cmd_q_filt = state->cmd_q_filt;
+        if (fabs(cmd_q_filt) > 1e-3) {
+            torque_limit = -torque_constant*params->supply_current_limit*SQRT2/cmd_q_filt;
+            if (torque_limit > 0.0)
+                target_torque = py_min(target_torque, torque_limit);
+            else
+                target_torque = py_max(target_torque, torque_limit);
+        }
+    }
+
+    /* motor torque limit */
+    if (target_torque > params->max_torque)
+        target_torque = params->max_torque;
+    else if (target_torque < -params->max_torque)
+        target_torque = -params->max_torque;
+
+    /* Clarke transform */
+    i_alpha = SQRT2D3 * (ia  - S30*ib - S30*ic);
+    i_beta  = SQRT2D3 * (      C30*ib - C30*ic);
+
+    /* Park transform */
+    el_angle = position * params->pole_pairs - state->el_angle_offset;
+    s1 = sin(el_angle);
+    c1 = cos(el_angle);
+    measured_id =   c1*i_alpha + s1*i_beta;
+    measured_iq =  -s1*i_alpha + c1*i_beta;
+    measured_torque = -measured_iq * torque_constant;
+
+    target_id = 0.0;
+    target_iq = -target_torque / torque_constant;
+
+    /* PI controllers */
+    cmd_d = pi_update(&state->d_i_term, params->d_p_gain, params->d_i_gain, dt, target_id - measured_id);
+    cmd_q = pi_update(&state->q_i_term, params->q_p_gain, params->q_i_gain, dt, target_iq - measured_iq);
+
+    /* circle limit */
+    mag = sqrt(cmd_d*cmd_d + cmd_q*cmd_q);
+    if (mag > 1.0) {
+        cmd_d /= mag;
+        cmd_q /= mag;
+    }
+
+    cmd_q_filt = state->cmd_q_filt;
+    cmd_q_filt += (cmd_q - cmd_q_filt) * 0.25;
+
+    /* inverse Park transform with angle projected over control loop delay */
+    el_velocity = velocity * params->pole_pairs;
+    el_angle2 = el_angle + (el_velocity * dt) * 1.32;
+    s2 = sin(el_angle2);
+    c2 = cos(el_angle2);
+    cmd_alpha =  c2*cmd_d - s2*cmd_q;
+    cmd_beta  =  s2*cmd_d + c2*cmd_q;
+
+    /* inverse Clarke transform and quasi-SVM */
+    cmd_a = INV_SQRT3 * (      cmd_alpha                );
+    cmd_b = INV_SQRT3 * ( -S30*cmd_alpha + C30*cmd_beta );
+    cmd_c = INV_SQRT3 * ( -S30*cmd_alpha - C30*cmd_beta );
+    cmd_min = py_min(py_min(cmd_a, cmd_b), cmd_c);
+    cmd_a -= cmd_min;
+    cmd_b -= cmd_min;
+    cmd_c -= cmd_min;
+
+    /* angle offset estimate */
+    cmd_vd = supply_voltage*state->cmd_d;
+    est_vd = - el_velocity * measured_iq * params->inductance;
+    error_vd = cmd_vd - est_vd;
+    backemf_voltage = velocity * params->backemf_constant;
+    if (fabs(backemf_voltage) > 1.0) {
+        est_el_angle_offset = -error_vd / backemf_voltage;
+        el_angle_offset = state->el_angle_offset + 0.01 * est_el_angle_offset;
+    } else {
+        est_el_angle_offset = 0.0;
+        el_angle_offset = state->el_angle_offset;
+    }
+
+    state->cmd_d = cmd_d;
+    state->cmd_q_filt = cmd_q_filt;
+    state->el_angle_offset = el_angle_offset;
+
+    out[0] = input_target_torque;
+    out[1] = measured_torque;
+    out[2] = measured_id;
+    out[3] = measured_iq;
+    out[4] = target_torque;
+    out[5] = target_id;
+    out[6] = target_iq;
+    out[7] = cmd_a;
+    out[8] = cmd_b;
+    out[9] = cmd_c;
+    out[10] = cmd_d;
+    out[11] = cmd_q;
+    out[12] = cmd_q_filt;
+    out[13] = cmd_vd;
+    out[14] = est_vd;
+    out[15] = error_vd;
+    out[16] = backemf_voltage;
+    out[17] = est_el_angle_offset;
+    out[18] = el_angle_offset;
+    out[19] = torque_limit;
+}
+
+/* Runs count controller updates.  inputs are FOC_INPUTS arrays (target_torque, position, velocity,
+ * ia, ib, ic, supply_voltage), update n reads inputs[k][n*strides[k]], stride 0 repeats one value.
+ * Outputs of update n are written to out[n*FOC_OUTPUTS ...] */
+long foc_update_batch(const foc_params *params, foc_state *state, long count,
+                      const double *const *inputs, const long *strides, double *out)
+{
+    long n;
+    for (n = 0; n < count; ++n) {
+        foc_update(params, state, inputs[0][n*strides[0]], inputs[1][n*strides[1]], inputs[2][n*strides[2]],
+                   inputs[3][n*strides[3]], inputs[4][n*strides[4]], inputs[5][n*strides[5]],
+                   inputs[6][n*strides[6]], out + n*FOC_OUTPUTS);
+    }
+    return count;
+}
+
+void motor_init(motor_state *state, double position)
+{
+    state->ia = state->ib = state->ic = 0.0;
+    state->backemf_a = state->backemf_b = state->backemf_c = 0.0;
+    state->velocity = 0.0;
+    state->position = position;
+}
+
+/* MotorSim.update_euler(), returns motor torque.
+ * If row is not NULL, fields 1.. of motor trace row are written (caller writes time) */
+double motor_step(const motor_params *params, motor_state *state, double dt, double load_torque,
+                  double vxa, double vxb, double vxc, double *row)
+{
+    double R = params->phase_resistance;
+    double L = params->phase_inductance;
+    double torque_constant = params->phase_torque_constant;
+    double ia = state->ia, ib = state->ib, ic = state->ic;
+    double vcenter, va, vb, vc, Lva, Lvb, Lvc, iavg, el_angle, sa, sb, sc, torque, velocity, position;
+
+    /* phase voltages relative to star point */
+    vcenter = ( vxa + vxb + vxc ) / 3.0;
+    va = vxa - vcenter;
+    vb = vxb - vcenter;
+    vc = vxc - vcenter;
+
+    /* voltage across phase inductances changes phase currents */
+    Lva = va - state->backemf_a - ia * R;
+    Lvb = vb - state->backemf_b - ib * R;
+    Lvc = vc - state->backemf_c - ic * R;
+    ia += Lva / L * dt;
+    ib += Lvb / L * dt;
+    ic += Lvc / L * dt;
+
+    /* Wye-wound motor has no circulating currents */
+    iavg = (ia+ib+ic)/3.0;
+    ia -= iavg;
+    ib -= iavg;
+    ic -= iavg;
+
+    el_angle = state->position * params->pole_pairs;
+    sa = sin(el_angle);
+    sb = sin(el_angle-PI*2/3);
+    sc = sin(el_angle+PI*2/3);
+    torque = (ia*sa + ib*sb + ic*sc) * torque_constant;
+
+    velocity = state->velocity;
+    velocity += (torque - load_torque - velocity*params->friction)/params->inertia*dt;
+    position = state->position + velocity*dt;
+
+    state->ia = ia;
+    state->ib = ib;
+    state->ic = ic;
+    state->backemf_a = sa * velocity * torque_constant;
+    state->backemf_b = sb * velocity * torque_constant;
+    state->backemf_c = sc * velocity * torque_constant;
+    state->velocity = velocity;
+    state->position = position;
+
+    if (row) {
+        row[1] = vxa;
+        row[2] = vxb;
+        row[3] = vxc;
+        row[4] = va;
+        row[5] = vb;
+        row[6] = vc;
+        row[7] = ia;
+        row[8] = ib;
+        row[9] = ic;
+        row[10] = state->backemf_a;
+        row[11] = state->backemf_b;
+        row[12] = state->backemf_c;
+        row[13] = torque;
+        row[14] = velocity;
+        row[15] = position;
+    }
+    return torque;
+}
+
+/* decimated trace recording, same as TraceRecorder.record()
+ * returns row to write or NULL if sample is skipped */
+typedef struct {
+    double *rows;
+    long fields;
+    long capacity;
+    long count;
+    long decimation;
+    long skip;
+} trace_rows;
+
+static double *next_row(trace_rows *trace)
+{
+    double *row;
+    if (trace->skip > 0) {
+        trace->skip -= 1;
+        return 0;
+    }
+    if (trace->decimation <= 0 || trace->count >= trace->capacity)
+        return 0;
+    trace->skip = trace->decimation - 1;
+    row = trace->rows + trace->count*trace->fields;
+    trace->count += 1;
+    return row;
+}
+
+/* Simulation loop of run_simulation() with Euler motor model.
+ * target_torque[n] is used by FOC update n (update 0 is done at t=0 with zero torque and current),
+ * load_torque[n] (NULL = no load) is applied to motor from FOC update n until next update.
+ * Past the end of the arrays the last value is held.
+ * Traces are written to motor_rows (motor_capacity x MOTOR_TRACE_FIELDS) and
+ * foc_rows (foc_capacity x FOC_TRACE_FIELDS), counts receives number of (motor, foc) rows written.
+ * Returns number of FOC updates. */
+long foc_simulate(const foc_params *fp, foc_state *fs, const motor_params *mp, motor_state *ms,
+                  const sim_params *sp, const double *target_torque, const double *load_torque,
+                  long ticks, double *motor_rows, long motor_capacity,
+                  double *foc_rows, long foc_capacity, long *counts)
+{
+    trace_rows motor_trace = { motor_rows, MOTOR_TRACE_FIELDS, motor_capacity, 0, sp->decimation, 0 };
+    trace_rows foc_trace = { foc_rows, FOC_TRACE_FIELDS, foc_capacity, 0, sp->decimation, 0 };
+    double supply_voltage = sp->supply_voltage;
+    double motor_dt = sp->motor_dt;
+    double out[FOC_OUTPUTS];
+    double t = 0.0, vxa, vxb, vxc, load, *row;
+    long tick = 0, last = ticks - 1, i, j, k;
+
+    /* initial state rows */
+    row = next_row(&motor_trace);
+    if (row) {
+        for (k = 0; k < MOTOR_TRACE_FIELDS; ++k)
+            row[k] = 0.0;
+        row[15] = ms->position;
+    }
+    row = next_row(&foc_trace);
+    if (row) {
+        for (k = 0; k < FOC_TRACE_FIELDS; ++k)
+            row[k] = 0.0;
+    }
+
+    /* first FOC update before loop starts */
+    foc_update(fp, fs, 0.0, ms->position, ms->velocity, 0.0, 0.0, 0.0, supply_voltage, out);
+    row = next_row(&foc_trace);
+    if (row) {
+        row[0] = t;
+        for (k = 0; k < FOC_OUTPUTS; ++k)
+            row[k+1] = out[k];
+    }
+    load = load_torque ? load_torque[0] : 0.0;
+    vxa = supply_voltage*out[FOC_OUT_CMD_A];
+    vxb = supply_voltage*out[FOC_OUT_CMD_B];
+    vxc = supply_voltage*out[FOC_OUT_CMD_C];
+
+    while (t < sp->runtime) {
+        for (j = 0; j < sp->foc_update_cycles; ++j) {
+            for (i = 0; i < sp->motor_substeps; ++i) {
+                row = next_row(&motor_trace);
+                if (row)
+                    row[0] = t;
+                motor_step(mp, ms, motor_dt, load, vxa, vxb, vxc, row);
+                t += motor_dt;
+            }
+            /* command voltages are applied one cycle late to simulate control loop delay */
+            vxa = supply_voltage*out[FOC_OUT_CMD_A];
+            vxb = supply_voltage*out[FOC_OUT_CMD_B];
+            vxc = supply_voltage*out[FOC_OUT_CMD_C];
+        }
+
+        tick += 1;
+        k = tick < last ? tick : last;
+        if (load_torque)
+            load = load_torque[k];
+        foc_update(fp, fs, target_torque[k], ms->position + sp->angle_offset, ms->velocity,
+                   ms->ia, ms->ib, ms->ic, supply_voltage, out);
+        row = next_row(&foc_trace);
+        if (row) {
+            row[0] = t;
+            for (k = 0; k < FOC_OUTPUTS; ++k)
+                row[k+1] = out[k];
+        }
+    }
+
+    counts[0] = motor_trace.count;
+    counts[1] = foc_trace.count;
+    return tick + 1;
+}
@@ -0,0 +1,120 @@
+/*
+ * Copyright (c) 2013, Unbounded Robotics Inc.
+ * All rights reserved.
+ *
+ * Redistribution and use in source and binary forms, with or without modification,
+ *  are permitted provided that the following conditions are met:
+ *
+ * 1. Redistributions of source code must retain the above copyright notice,
+ *  this list of conditions and the following disclaimer.
+ *
+ * 2. Redistributions in binary form must reproduce the above copyright notice,
+ *  this list of conditions and the following disclaimer in the documentation
+ *  and/or other materials provided with the distribution.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+ * AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+ * WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+ * IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+ * INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+ * NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+ * OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+ * WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ * ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+ * POSSIBILITY OF SUCH DAMAGE.
+ *
+ */
+
+/*
+ * Native FOC controller and Euler motor model.
+ *
+ * Same equations, in the same floating point order, as FOC_Controller in
+ * foc_cleaned.py and MotorSim.update_euler() in motor_sim_cleaned.py, so
+ * results match the Python classes exactly when compiled without
+ * floating point contraction (-ffp-contract=off, no -ffast-math).
+ *
+ * Used from Python through ctypes by foc_native.py.  All functions only work
+ * on caller provided structures and arrays and never allocate memory.
+ */
+
+#ifndef FOC_CORE_H
+#define FOC_CORE_H
+
+/* number of values written by foc_update(), same order as
+ * FOC_Controller.trace_fields without 't' */
+#define FOC_OUTPUTS 20
+#define FOC_OUT_CMD_A 7
+#define FOC_OUT_CMD_B 8
+#define FOC_OUT_CMD_C 9
+
+/* number of values in one motor trace row (MotorSim.trace_fields) */
+#define MOTOR_TRACE_FIELDS 16
+/* number of values in one FOC trace row (FOC_Controller.trace_fields) */
+#define FOC_TRACE_FIELDS (FOC_OUTPUTS + 1)
+
+/* number of inputs of foc_update_batch() */
+#define FOC_INPUTS 7
+
+typedef struct {
+    double dt;                    /* FOC update period (seconds) */
+    double torque_constant;       /* motor.foc_torque_constant, Nm per A of Iq */
+    double backemf_constant;      /* motor.torque_constant, V/(rad/s) */
+    double inductance;            /* motor.foc_inductance */
+    double max_torque;
+    double pole_pairs;
+    double supply_current_limit;  /* negative = no limit */
+    double d_p_gain, d_i_gain;
+    double q_p_gain, q_i_gain;
+} foc_params;
+
+typedef struct {
+    double d_i_term;
+    double q_i_term;
+    double cmd_d;
+    double cmd_q_filt;
+    double el_angle_offset;
+} foc_state;
+
+typedef struct {
+    double phase_resistance;
+    double phase_inductance;
+    double phase_torque_constant;
+    double friction;
+    double inertia;               /* rotor + load inertia */
+    double pole_pairs;
+} motor_params;
+
+typedef struct {
+    double ia, ib, ic;
+    double backemf_a, backemf_b, backemf_c;
+    double velocity;
+    double position;
+} motor_state;
+
+typedef struct {
+    double supply_voltage;
+    double angle_offset;          /* added to position seen by controller (radians) */
+    double motor_dt;
+    long motor_substeps;          /* motor steps per PWM cycle */
+    long foc_update_cycles;       /* PWM cycles per FOC update */
+    double runtime;
+    long decimation;              /* record every decimation-th sample, 0 = no recording */
+} sim_params;
+
+void foc_init(foc_state *state);
+void foc_reset(const foc_params *params, foc_state *state, double velocity, double supply_voltage);
+void foc_update(const foc_params *params, foc_state *state, double target_torque, double position,
+                double velocity, double ia, double ib, double ic, double supply_voltage, double *out);
+long foc_update_batch(const foc_params *params, foc_state *state, long count,
+                      const double *const *inputs, const long *strides, double *out);
+
+void motor_init(motor_state *state, double position);
+double motor_step(const motor_params *params, motor_state *state, double dt, double load_torque,
+                  double vxa, double vxb, double vxc, double *row);
+
+long foc_simulate(const foc_params *fp, foc_state *fs, const motor_params *mp, motor_state *ms,
+                  const sim_params *sp, const double *target_torque, const double *load_torque,
+                  long ticks, double *motor_rows, long motor_capacity,
+                  double *foc_rows, long foc_capacity, long *counts);
+
+#endif
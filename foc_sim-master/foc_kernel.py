@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Fused, optionally JIT-compiled, simulation loop.
+
+fused_loop() contains the complete simulation loop from sim() with
+MotorSim.update (Euler), FOC_Controller.update and PI_Controller.update
+written out inline, so the whole simulation runs as a single function that
+writes its traces straight into preallocated arrays.
+
+When numba is installed fused_loop() is compiled to machine code.  When it
+is not, run_fast() falls back to running the normal Python classes.
+The equations (and the order of floating point operations) are exactly the
+same as the classes, so both paths produce identical traces, which can be
+checked with verify_kernel().
+"""
+
+import numpy
+from math import sin, cos, pi, sqrt
+from trace_recorder import TraceRecorder
+from foc_cleaned import FOC_Controller
+from motor_sim_cleaned import MotorSim, SimConfig, SimResult, run_simulation
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+MOTOR_FIELDS = MotorSim.trace_fields
+FOC_FIELDS = FOC_Controller.trace_fields
+
+
+def fused_loop(motor_rows, foc_rows, decimation,
+               torque_constant, terminal_resistance, terminal_inductance, rotor_inertia,
+               friction, max_torque, pole_pairs, load_inertia,
+               d_p_gain, d_i_gain, q_p_gain, q_i_gain, supply_current_limit,
+               supply_voltage, target_torque, angle_offset,
+               foc_dt, foc_update_cycles, motor_sim_dt, motor_sim_substeps, runtime):
+    """ Runs Euler motor simulation and FOC controller loop from sim().
+    Recorded rows are written to motor_rows (samples x 16) and foc_rows (samples x 21)
+    in same order as MotorSim.trace_fields and FOC_Controller.trace_fields.
+    Every decimation-th sample is recorded, if decimation is 0 nothing is recorded.
+    Returns (number of motor rows, number of foc rows, final position, final velocity)
+    """
+    n_motor = 0
+    n_foc = 0
+    motor_skip = 0
+    foc_skip = 0
+    motor_capacity = motor_rows.shape[0]
+    foc_capacity = foc_rows.shape[0]
+
+    # MotorSim state
+    ia = 0.0
+    ib = 0.0
+    ic = 0.0
+    backemf_a = 0.0
+    backemf_b = 0.0
+    backemf_c = 0.0
+    velocity = 0.0
+    position = 0.0
+    if decimation > 0:
+        for k in range(16):
+            motor_rows[0, k] = 0.0
+        n_motor = 1
+        motor_skip = decimation - 1
+
+    # FOC_Controller state, includes FOC_Controller.reset()
+    d_i_term = 0.0
+    q_i_term = -velocity * torque_constant / supply_voltage * pi/3.0
+    prev_cmd_d = 0.0
+    cmd_q_filt = 0.0
+    el_angle_offset = 0.0
+    if decimation > 0:
+        for k in range(21):
+            foc_rows[0, k] = 0.0
+        n_foc = 1
+        foc_skip = decimation - 1
+
+    # constants
+    R = terminal_resistance * 0.5
+    L = terminal_inductance * 0.5
+    motor_torque_constant = torque_constant * 0.60459978807807258  # pi/3 / sqrt(3)
+    foc_torque_constant = torque_constant * 0.7404804896930609 # sqrt(2)*3/pi
+    foc_L = terminal_inductance / sqrt(2)
+    sqrt2 = 1.4142135623730951 # sqrt(2)
+    s30 = 0.5  # sin(30)
+    c30 = 0.8660254037844387 # cos(30)
+    sqrt2d3 = 0.816496580927726 # sqrt(2/3)
+    inv_sqrt3 = 0.5773502691896258 # 1/sqrt(3)
+
+    t = 0.0
+    vxa = 0.0
+    vxb = 0.0
+    vxc = 0.0
+    cmd_a = 0.0
+    cmd_b = 0.0
+    cmd_c = 0.0
+    first = True
+    while first or t < runtime:
+        if not first:
+            for j in range(foc_update_cycles):
+                for i in range(motor_sim_substeps):
+                    ############ MotorSim.update_euler ############
+                    vcenter = ( vxa + vxb + vxc ) / 3.0
+                    va = vxa - vcenter
+                    vb = vxb - vcenter
+                    vc = vxc - vcenter
+                    Lva = va - backemf_a - ia * R
+                    Lvb = vb - backemf_b - ib * R
+                    Lvc = vc - backemf_c - ic * R
+                    ia += Lva / L * motor_sim_dt
+                    ib += Lvb / L * motor_sim_dt
+                    ic += Lvc / L * motor_sim_dt
+                    iavg = (ia+ib+ic)/3.0
+                    ia -= iavg
+                    ib -= iavg
+                    ic -= iavg
+                    el_angle = position * pole_pairs
+                    sa = sin(el_angle)
+                    sb = sin(el_angle-pi*2/3)
+                    sc = sin(el_angle+pi*2/3)
+                    torque = (ia*sa + ib*sb + ic*sc) * motor_torque_constant
+                    velocity += (torque - velocity*friction)/(rotor_inertia+load_inertia)*motor_sim_dt
+                    position = position + velocity*motor_sim_dt
+                    backemf_a = sa * velocity * motor_torque_constant
+                    backemf_b = sb * velocity * motor_torque_constant
+                    backemf_c = sc * velocity * motor_torque_constant
+
+                    if decimation > 0:
+                        if motor_skip > 0:
+                            motor_skip -= 1
+                        elif n_motor < motor_capacity:
+                            motor_skip = decimation - 1
+                            row = motor_rows[n_motor]
+                            row[0] = t
+                            row[1] = vxa
+                            row[2] = vxb
+                            row[3] = vxc
+                            row[4] = va
+                            row[5] = vb
+                            row[6] = vc
+                            row[7] = ia
+                            row[8] = ib
+                            row[9] = ic
+                            row[10] = backemf_a
+                            row[11] = backemf_b
+                            row[12] = backemf_c
+                            row[13] = torque
+                            row[14] = velocity
+                            row[15] = position
+                            n_motor += 1
+                    t += motor_sim_dt
+                # calulate command voltages here to simulate 1 cycle control loop delay
+                vxa = supply_voltage*cmd_a
+                vxb = supply_voltage*cmd_b
+                vxc = supply_voltage*cmd_c
+            foc_target_torque = target_torque
+            foc_position = position + angle_offset
+            foc_ia = ia
+            foc_ib = ib
+            foc_ic = ic
+        else:
+            # first FOC update is done before loop with zero torque and zero current
+            foc_target_torque = 0.0
+            foc_position = position
+            foc_ia = 0.0
+            foc_ib = 0.0
+            foc_ic = 0.0
+
+        ############ FOC_Controller.update ############
+        input_target_torque = foc_target_torque
+        limited_torque = foc_target_torque
+        torque_limit = 0.0
+        if supply_current_limit > 0.0:
+            if abs(cmd_q_filt) > 1e-3:
+                torque_limit = -foc_torque_constant*supply_current_limit*sqrt2/cmd_q_filt
+                if torque_limit > 0.0:
+                    limited_torque = min(limited_torque, torque_limit)
+                else:
+                    limited_torque = max(limited_torque, torque_limit)
+        if limited_torque > max_torque:
+            limited_torque = max_torque
+        elif limited_torque < -max_torque:
+            limited_torque = -max_torque
+
+        i_alpha = sqrt2d3 * (foc_ia  - s30*foc_ib - s30*foc_ic)
+        i_beta  = sqrt2d3 * (          c30*foc_ib - c30*foc_ic)
+        el_angle = foc_position * pole_pairs - el_angle_offset
+        s1 = sin(el_angle)
+        c1 = cos(el_angle)
+        measured_id =   c1*i_alpha + s1*i_beta
+        measured_iq =  -s1*i_alpha + c1*i_beta
+        measured_torque = -measured_iq * foc_torque_constant
+        target_id = 0.0
+        target_iq = -limited_torque / foc_torque_constant
+
+        # PI_Controller.update for d and q
+        error = target_id - measured_id
+        d_i_term += error*d_i_gain*foc_dt
+        if d_i_term > 1.0:
+            d_i_term = 1.0
+        elif d_i_term < -1.0:
+            d_i_term = -1.0
+        cmd_d = error*d_p_gain + d_i_term
+        if cmd_d > 1.0:
+            cmd_d = 1.0
+        elif cmd_d < -1.0:
+            cmd_d = -1.0
+
+        error = target_iq - measured_iq
+        q_i_term += error*q_i_gain*foc_dt
+        if q_i_term > 1.0:
+            q_i_term = 1.0
+        elif q_i_term < -1.0:
+            q_i_term = -1.0
+        cmd_q = error*q_p_gain + q_i_term
+        if cmd_q > 1.0:
+            cmd_q = 1.0
+        elif cmd_q < -1.0:
+            cmd_q = -1.0
+
+        mag = sqrt(cmd_d*cmd_d + cmd_q*cmd_q)
+        if mag > 1.0:
+            cmd_d /= mag
+            cmd_q /= mag
+        cmd_q_filt += (cmd_q - cmd_q_filt) * 0.25
+
+        el_velocity = velocity * pole_pairs
+        el_angle2 = el_angle + (el_velocity * foc_dt) * 1.32
+        s2 = sin(el_angle2)
+        c2 = cos(el_angle2)
+        cmd_alpha =  c2*cmd_d - s2*cmd_q
+        cmd_beta  =  s2*cmd_d + c2*cmd_q
+        cmd_a = inv_sqrt3 * (      cmd_alpha                )
+        cmd_b = inv_sqrt3 * ( -s30*cmd_alpha + c30*cmd_beta )
+        cmd_c = inv_sqrt3 * ( -s30*cmd_alpha - c30*cmd_beta )
+        cmd_min = min(min(cmd_a, cmd_b), cmd_c)
+        cmd_a -= cmd_min
+        cmd_b -= cmd_min
+        cmd_c -= cmd_min
+
+        cmd_vd = supply_voltage*prev_cmd_d
+        est_vd = - el_velocity * measured_iq * foc_L
+        error_vd = cmd_vd - est_vd
+        backemf_voltage = velocity * torque_constant
+        if abs(backemf_voltage) > 1.0:
+            est_el_angle_offset = -error_vd / backemf_voltage
+            alpha = 0.01
+            el_angle_offset = el_angle_offset + alpha * est_el_angle_offset
+        else:
+            est_el_angle_offset = 0.0
+        prev_cmd_d = cmd_d
+
+        if decimation > 0:
+            if foc_skip > 0:
+                foc_skip -= 1
+            elif n_foc < foc_capacity:
+                foc_skip = decimation - 1
+                row = foc_rows[n_foc]
+                row[0] = t
+                row[1] = input_target_torque
+                row[2] = measured_torque
+                row[3] = measured_id
+                row[4] = measured_iq
+                row[5] = limited_torque
+                row[6] = target_id
+                row[7] = target_iq
+                row[8] = cmd_a
+                row[9] = cmd_b
+                row[10] = cmd_c
+                row[11] = cmd_d
+                row[12] = cmd_q
+                row[13] = cmd_q_filt
+                row[14] = cmd_vd
+                row[15] = est_vd
+                row[16] = error_vd
+                row[17] = backemf_voltage
+                row[18] = est_el_angle_offset
+                row[19] = el_angle_offset
+                row[20] = torque_limit
+                n_foc += 1
+
+        if first:
+            vxa = supply_voltage*cmd_a
+            vxb = supply_voltage*cmd_b
+            vxc = supply_voltage*cmd_c
+            first = False
+
+    return n_motor, n_foc, position, velocity
+
+
+if njit is not None:
+    compiled_loop = njit(cache=True)(fused_loop)
+else:
+    compiled_loop = None
+
+
+def trace_capacities(runtime, foc_dt, foc_update_cycles, motor_sim_substeps, decimation):
+    """ Returns number of (motor, foc) trace rows recorded by simulation loop """
+    foc_samples = int(runtime / foc_dt) + 3
+    motor_samples = (foc_samples - 1) * foc_update_cycles * motor_sim_substeps + 1
+    if decimation > 1:
+        foc_samples = foc_samples // decimation + 2
+        motor_samples = motor_samples // decimation + 2
+    return motor_samples, foc_samples
+
+
+def row_view(trace):
+    """ Returns 2-d float view (capacity x fields) of trace buffer """
+    return trace.data.view(numpy.float64).reshape(trace.capacity, len(trace.fields))
+
+
+def kernel_supports(config):
+    """ Returns True if config can be simulated by fused kernel
+    (Euler integrator, python FOC controller, exact sin/cos and sensors, constant target torque,
+    no ring-buffer or streamed traces)
+    """
+    return (config.integrator == 'euler' and config.controller is FOC_Controller
+            and config.trace_ring_time is None and config.trace_dir is None
+            and config.foc_angle_lut is None and config.motor_angle_lut is None
+            and config.sensors is None and config.trajectory is None and not config.is_multirate())
+
+
+def run_kernel(config, loop=None):
+    """ Runs fused simulation loop, returns SimResult with motor and foc traces.
+    Only motor and foc are recorded, SimResult pwm, d_ctrl, q_ctrl, trajectory and state are None
+    (sim_plots.plot_result leaves out PWM commands and PI controller figures).
+    loop defaults to compiled kernel, pass fused_loop to run the kernel as plain Python
+    """
+    if loop is None:
+        if compiled_loop is None:
+            raise RuntimeError("numba is not installed, cannot compile fused kernel")
+        loop = compiled_loop
+    if not kernel_supports(config):
+        raise ValueError("fused kernel only supports euler integrator and FOC_Controller with in-memory traces")
+    motor = config.motor
+    decimation = config.trace_decimation
+    motor_samples, foc_samples = trace_capacities(config.runtime, config.foc_dt, config.foc_update_cycles,
+                                                  config.motor_sim_substeps, decimation)
+    motor_trace = TraceRecorder(MOTOR_FIELDS, motor_samples, decimation)
+    foc_trace = TraceRecorder(FOC_FIELDS, foc_samples, decimation)
+    n_motor, n_foc, position, velocity = loop(
+        row_view(motor_trace), row_view(foc_trace), decimation,
+        motor.torque_constant, motor.terminal_resistance, motor.terminal_inductance, motor.rotor_inertia,
+        motor.friction, motor.max_torque, motor.pole_pairs, config.load_inertia,
+        config.d_gains[0], config.d_gains[1], config.q_gains[0], config.q_gains[1], config.supply_current_limit,
+        config.supply_voltage, config.get_target_torque(), config.el_angle_offset / motor.pole_pairs,
+        config.foc_dt, config.foc_update_cycles, config.motor_sim_dt, config.motor_sim_substeps, config.runtime)
+    motor_trace.count = n_motor
+    foc_trace.count = n_foc
+    return SimResult(config, "Fused FOC kernel", motor_trace, foc_trace, None)
+
+
+def run_fast(config):
+    """ Runs simulation with compiled fused kernel if numba is available and
+    kernel supports config, otherwise falls back to run_simulation() with Python classes.
+    Motor and foc traces are the same either way, other traces are only recorded
+    by run_simulation() (see run_kernel)
+    """
+    if compiled_loop is not None and kernel_supports(config):
+        return run_kernel(config)
+    return run_simulation(config)
+
+
+def verify_kernel(config):
+    """ Asserts fused kernel produces exactly same traces as Python classes.
+    Compiled kernel is checked if numba is available, otherwise the kernel is run as plain Python.
+    """
+    loop = compiled_loop if compiled_loop is not None else fused_loop
+    expected = run_simulation(config)
+    actual = run_kernel(config, loop=loop)
+    for name in ("motor", "foc"):
+        expected_trace = getattr(expected, name)
+        actual_trace = getattr(actual, name)
+        assert len(expected_trace) == len(actual_trace), \
+            "%s trace length %d != %d" % (name, len(actual_trace), len(expected_trace))
+        for field in expected_trace.fields:
+            assert numpy.array_equal(expected_trace[field], actual_trace[field]), \
+                "%s trace field %s differs" % (name, field)
+
+
+if __name__ == "__main__":
+    import time
+
+    verify_kernel(SimConfig(el_angle_offset=-0.3, load_inertia=2e-7))
+    print("fused kernel traces match python classes", "(compiled)" if compiled_loop else "(not compiled)")
+
+    config = SimConfig(runtime=150e-3)
+    for name, run in (("classes", run_simulation), ("kernel", run_fast)):
+        start = time.time()
+        run(config)
+        print("%s : %.3f seconds for 150ms simulation" % (name, time.time() - start))
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Native (C) FOC controller and simulation loop, used through ctypes.
+
+foc_core.c implements FOC_Controller.update() and MotorSim.update_euler()
+with the same equations, in the same floating point order, as the Python
+classes.  It is compiled into a shared library with the system C compiler
+(cc, or $CC) the first time it is needed, and rebuilt when foc_core.c or
+foc_core.h change.  No Python extension headers or build system are needed.
+
+There are three ways to use it :
+  FOC_Native : drop-in replacement for FOC_Controller (config.controller = FOC_Native),
+      one C call per FOC update, outputs are written into a preallocated buffer
+  FOC_Native.update_batch() : runs K controller updates from NumPy arrays of
+      measurements in a single C call, outputs go into a caller provided (K x 20) array
+  run_native() : whole simulation loop (motor model + controller) in C,
+      traces are written straight into TraceRecorder buffers
+
+ctypes releases the GIL during calls, so batch calls can run in threads.
+
+Run this file to check native results against the Python classes and time them.
+"""
+
+import ctypes
+import os
+import subprocess
+import sys
+from math import ceil
+import numpy
+
+from foc_cleaned import FOC_Controller
+from foc_kernel import MOTOR_FIELDS, FOC_FIELDS, trace_capacities, row_view
+from motor_catalog import as_motor_params
+from motor_sim_cleaned import SimConfig, SimResult, run_simulation
+from trace_recorder import TraceRecorder, create_trace
+
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCES = (os.path.join(SOURCE_DIR, 'foc_core.c'), os.path.join(SOURCE_DIR, 'foc_core.h'))
+LIBRARY = os.path.join(SOURCE_DIR, '_foc_core' + ('.dll' if sys.platform == 'win32' else '.so'))
+# floating point contraction (fused multiply-add) would change rounding compared to Python
+CFLAGS = ['-O2', '-std=c99', '-ffp-contract=off', '-fPIC', '-shared']
+
+# values written by foc_update(), same order as FOC_Controller.trace_fields without 't'
+OUTPUT_FIELDS = FOC_FIELDS[1:]
+FOC_OUTPUTS = len(OUTPUT_FIELDS)
+INPUT_FIELDS = ('target_torque', 'position', 'velocity', 'ia', 'ib', 'ic', 'supply_voltage')
+
+double_p = ctypes.POINTER(ctypes.c_double)
+
+
+class foc_params(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_double) for name in
+                ('dt', 'torque_constant', 'backemf_constant', 'inductance', 'max_torque', 'pole_pairs',
+                 'supply_current_limit', 'd_p_gain', 'd_i_gain', 'q_p_gain', 'q_i_gain')]
+
+
+class foc_state(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_double) for name in
+                ('d_i_term', 'q_i_term', 'cmd_d', 'cmd_q_filt', 'el_angle_offset')]
+
+
+class motor_params(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_double) for name in
+                ('phase_resistance', 'phase_inductance', 'phase_torque_constant', 'friction', 'inertia',
+                 'pole_pairs')]
+
+
+class motor_state(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_double) for name in
+                ('ia', 'ib', 'ic', 'backemf_a', 'backemf_b', 'backemf_c', 'velocity', 'position')]
+
+
+class sim_params(ctypes.Structure):
+    _fields_ = [('supply_voltage', ctypes.c_double), ('angle_offset', ctypes.c_double),
+                ('motor_dt', ctypes.c_double), ('motor_substeps', ctypes.c_long),
+                ('foc_update_cycles', ctypes.c_long), ('runtime', ctypes.c_double),
+                ('decimation', ctypes.c_long)]
+
+
+def build(force=False):
+    """ Compiles foc_core.c into LIBRARY if it is missing or older than sources, returns library path """
+    if (not force and os.path.exists(LIBRARY)
+            and os.path.getmtime(LIBRARY) >= max(os.path.getmtime(path) for path in SOURCES)):
+        return LIBRARY
+    compiler = os.environ.get('CC', 'cc')
+    # build to temporary name first, so other processes never load a half-written library
+    root, ext = os.path.splitext(LIBRARY)
+    output = '%s.%d%s' % (root, os.getpid(), ext)
+    command = [compiler] + CFLAGS + ['-o', output, SOURCES[0], '-lm']
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except OSError as e:
+        raise RuntimeError("cannot run C compiler %r : %s" % (compiler, e))
+    if result.returncode != 0:
+        if os.path.exists(output):
+            os.remove(output)
+        raise RuntimeError("building %s failed:\n%s\n%s" % (LIBRARY, ' '.join(command), result.stderr))
+    os.replace(output, LIBRARY)
+    return LIBRARY
+
+
+_library = None
+
+
+def library():
+    """ Returns loaded native library, building it first if needed """
+    global _library
+    if _library is None:
+        lib = ctypes.CDLL(build())
+        P = ctypes.POINTER
+        d = ctypes.c_double
+        lib.foc_init.argtypes = [P(foc_state)]
+        lib.foc_init.restype = None
+        lib.foc_reset.argtypes = [P(foc_params), P(foc_state), d, d]
+        lib.foc_reset.restype = None
+        lib.foc_update.argtypes = [P(foc_params), P(foc_state), d, d, d, d, d, d, d, double_p]
+        lib.foc_update.restype = None
+        lib.foc_update_batch.argtypes = [P(foc_params), P(foc_state), ctypes.c_long,
+                                         P(double_p), P(ctypes.c_long), double_p]
+        lib.foc_update_batch.restype = ctypes.c_long
+        lib.motor_init.argtypes = [P(motor_state), d]
+        lib.motor_init.restype = None
+        lib.foc_simulate.argtypes = [P(foc_params), P(foc_state), P(motor_params), P(motor_state),
+                                     P(sim_params), double_p, double_p, ctypes.c_long,
+                                     double_p, ctypes.c_long, double_p, ctypes.c_long, P(ctypes.c_long)]
+        lib.foc_simulate.restype = ctypes.c_long
+        _library = lib
+    return _library
+
+
+def native_available():
+    """ True if native library can be built and loaded """
+    try:
+        library()
+    except (RuntimeError, OSError):
+        return False
+    return True
+
+
+def make_foc_params(dt, motor, d_gains, q_gains, supply_current_limit):
+    motor = as_motor_params(motor)
+    return foc_params(dt=dt, torque_constant=motor.foc_torque_constant, backemf_constant=motor.torque_constant,
+                      inductance=motor.foc_inductance, max_torque=motor.max_torque, pole_pairs=motor.pole_pairs,
+                      supply_current_limit=supply_current_limit,
+                      d_p_gain=d_gains[0], d_i_gain=d_gains[1], q_p_gain=q_gains[0], q_i_gain=q_gains[1])
+
+
+def array_pointer(array):
+    return array.ctypes.data_as(double_p)
+
+
+class FOC_Native:
+    """ FOC_Controller implemented in C, same interface and same results as FOC_Controller.
+    PI controller states are part of the C controller, so d_ctrl / q_ctrl traces are not recorded.
+    """
+    trace_fields = FOC_FIELDS
+
+    def __init__(self, dt, motor, d_gains, q_gains, supply_current_limit, trace_options=None):
+        self.name = "Native FOC"
+        self.lib = library()
+        self.dt = dt
+        self.params = make_foc_params(dt, motor, d_gains, q_gains, supply_current_limit)
+        self.state = foc_state()
+        self.lib.foc_init(self.state)
+        # byref objects and output buffer are created once, not on every update
+        self.params_ref = ctypes.byref(self.params)
+        self.state_ref = ctypes.byref(self.state)
+        self.out = (ctypes.c_double * FOC_OUTPUTS)()
+
+        self.trace = create_trace(self.trace_fields, **(trace_options or {}))
+        self.trace.record(*((0.0,) * len(self.trace_fields)))
+
+    def reset(self, velocity, supply_voltage):
+        self.lib.foc_reset(self.params_ref, self.state_ref, velocity, supply_voltage)
+
+    def get_state(self):
+        """ Returns controller state, same layout as FOC_Controller.get_state() """
+        state = self.state
+        return (state.cmd_d, state.cmd_q_filt, state.el_angle_offset, state.d_i_term, state.q_i_term)
+
+    def set_state(self, state):
+        s = self.state
+        s.cmd_d, s.cmd_q_filt, s.el_angle_offset, s.d_i_term, s.q_i_term = state
+
+    def update(self, t, target_torque, position, velocity, ia, ib, ic, supply_voltage):
+        out = self.out
+        self.lib.foc_update(self.params_ref, self.state_ref, target_torque, position, velocity,
+                            ia, ib, ic, supply_voltage, out)
+        values = out[:]
+        self.trace.record(t, *values)
+        return (values[7], values[8], values[9])
+
+    def update_batch(self, target_torque, position, velocity, ia, ib, ic, supply_voltage, out=None):
+        """ Runs one controller update for every element of input arrays in a single native call.
+        Inputs are 1-d arrays of same length or scalars (same value for every update), they are
+        read in place when they are float64 (columns of a 2-d array work too).
+        Returns out, a (count x 20) float64 array with one row of OUTPUT_FIELDS per update.
+        Batch updates are not recorded to trace.
+        """
+        inputs = [numpy.asarray(value, dtype=numpy.float64)
+                  for value in (target_torque, position, velocity, ia, ib, ic, supply_voltage)]
+        count = max([len(value) for value in inputs if value.ndim == 1] or [1])
+        pointers = (double_p * len(inputs))()
+        strides = (ctypes.c_long * len(inputs))()
+        for k, value in enumerate(inputs):
+            if value.ndim == 0:
+                value = value.reshape(1)
+                inputs[k] = value
+                strides[k] = 0
+            elif value.ndim != 1 or len(value) != count:
+                raise ValueError("%s must be scalar or 1-d array of length %d" % (INPUT_FIELDS[k], count))
+            elif value.strides[0] % value.itemsize:
+                inputs[k] = value = numpy.ascontiguousarray(value)
+                strides[k] = 1
+            else:
+                strides[k] = value.strides[0] // value.itemsize
+            pointers[k] = array_pointer(value)
+
+        if out is None:
+            out = numpy.empty((count, FOC_OUTPUTS))
+        elif (out.dtype != numpy.float64 or out.shape != (count, FOC_OUTPUTS)
+              or not out.flags.c_contiguous or not out.flags.writeable):
+            raise ValueError("out must be writeable C-contiguous float64 array of shape (%d, %d)"
+                             % (count, FOC_OUTPUTS))
+        self.lib.foc_update_batch(self.params_ref, self.state_ref, count, pointers, strides, array_pointer(out))
+        return out
+
+
+def native_supports(config):
+    """ Returns True if config can be simulated by run_native()
+    (Euler integrator, FOC_Controller or FOC_Native, exact sin/cos and sensors, no trajectory,
+    no ring-buffer or streamed traces)
+    """
+    return (config.integrator == 'euler' and config.controller in (FOC_Controller, FOC_Native)
+            and config.trace_ring_time is None and config.trace_dir is None
+            and config.foc_angle_lut is None and config.motor_angle_lut is None
+            and config.sensors is None and config.trajectory is None and not config.is_multirate())
+
+
+def tick_array(values, ticks, default):
+    """ Returns float64 array with one value per FOC update (values can be None or scalar) """
+    if values is None:
+        values = default
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if values.ndim == 0:
+        return numpy.full(ticks, float(values))
+    if values.ndim != 1 or len(values) == 0:
+        raise ValueError("per-update values must be scalar or non-empty 1-d array")
+    return numpy.ascontiguousarray(values)
+
+
+def run_native(config=None, target_torque=None, load_torque=None):
+    """ Runs whole simulation loop in C, returns SimResult with motor and foc traces.
+    Like foc_kernel.run_kernel only motor and foc are recorded, SimResult pwm, d_ctrl, q_ctrl,
+    trajectory and state are None (sim_plots.plot_result leaves out those plots).
+    target_torque and load_torque optionally give a value for every FOC update
+    (update n runs at n*foc_dt, last value is held), by default config target torque and no load
+    """
+    if config is None:
+        config = SimConfig()
+    if not native_supports(config):
+        raise ValueError("native simulation only supports euler integrator and FOC_Controller with in-memory traces")
+    lib = library()
+    motor = as_motor_params(config.motor)
+    decimation = config.trace_decimation
+    motor_samples, foc_samples = trace_capacities(config.runtime, config.foc_dt, config.foc_update_cycles,
+                                                  config.motor_sim_substeps, decimation)
+    motor_trace = TraceRecorder(MOTOR_FIELDS, motor_samples, decimation)
+    foc_trace = TraceRecorder(FOC_FIELDS, foc_samples, decimation)
+
+    ticks = int(ceil(config.runtime / config.foc_dt)) + 3
+    targets = tick_array(target_torque, ticks, config.get_target_torque())
+    loads = tick_array(load_torque, ticks, 0.0) if load_torque is not None else None
+
+    fp = make_foc_params(config.foc_dt, motor, config.d_gains, config.q_gains, config.supply_current_limit)
+    fs = foc_state()
+    lib.foc_init(fs)
+    mp = motor_params(phase_resistance=motor.phase_resistance, phase_inductance=motor.phase_inductance,
+                      phase_torque_constant=motor.phase_torque_constant, friction=motor.friction,
+                      inertia=motor.rotor_inertia + config.load_inertia, pole_pairs=motor.pole_pairs)
+    ms = motor_state()
+    lib.motor_init(ms, 0.0)
+    lib.foc_reset(fp, fs, ms.velocity, config.supply_voltage)
+    sp = sim_params(supply_voltage=config.supply_voltage, angle_offset=config.el_angle_offset / motor.pole_pairs,
+                    motor_dt=config.motor_sim_dt, motor_substeps=config.motor_sim_substeps,
+                    foc_update_cycles=config.foc_update_cycles, runtime=config.runtime, decimation=decimation)
+    motor_rows = row_view(motor_trace)
+    foc_rows = row_view(foc_trace)
+    counts = (ctypes.c_long * 2)()
+    lib.foc_simulate(fp, fs, mp, ms, sp, array_pointer(targets),
+                     array_pointer(loads) if loads is not None else None, len(targets),
+                     array_pointer(motor_rows), len(motor_rows), array_pointer(foc_rows), len(foc_rows), counts)
+    motor_trace.count = counts[0]
+    foc_trace.count = counts[1]
+    return SimResult(config, "Native FOC", motor_trace, foc_trace, None)
+
+
+def verify_native(config):
+    """ Asserts native controller and native simulation loop produce exactly same traces as Python classes """
+    expected = run_simulation(config.copy(controller=FOC_Controller))
+    for name, actual in (("FOC_Native", run_simulation(config.copy(controller=FOC_Native))),
+                         ("run_native", run_native(config))):
+        for trace_name in ("motor", "foc"):
+            expected_trace = getattr(expected, trace_name)
+            actual_trace = getattr(actual, trace_name)
+            assert len(expected_trace) == len(actual_trace), \
+                "%s %s trace length %d != %d" % (name, trace_name, len(actual_trace), len(expected_trace))
+            for field in expected_trace.fields:
+                assert numpy.array_equal(expected_trace[field], actual_trace[field]), \
+                    "%s %s trace field %s differs" % (name, trace_name, field)
+
+
+if __name__ == "__main__":
+    import time
+
+    verify_native(SimConfig(el_angle_offset=-0.3, load_inertia=2e-7))
+    print("native traces match python classes")
+
+    config = SimConfig(runtime=150e-3)
+    for name, run in (("classes", run_simulation), ("FOC_Native", lambda c: run_simulation(c.copy(controller=FOC_Native))),
+                      ("run_native", run_native)):
+        start = time.time()
+        run(config)
+        print("%s : %.3f seconds for 150ms simulation" % (name, time.time() - start))
+
+    # open-loop batch : same random measurements through per-update calls and one batch call
+    count = 100000
+    rng = numpy.random.default_rng(0)
+    measurements = rng.uniform(-1.0, 1.0, (count, 6)) * [0.05, 10.0, 100.0, 1.0, 1.0, 1.0]
+    controllers = [FOC_Native(config.foc_dt, config.motor, config.d_gains, config.q_gains,
+                              config.supply_current_limit, dict(capacity=count + 1)) for n in range(2)]
+    start = time.time()
+    for row in measurements.tolist():
+        controllers[0].update(0.0, *(row + [config.supply_voltage]))
+    single = time.time() - start
+    start = time.time()
+    outputs = controllers[1].update_batch(*([measurements[:, k] for k in range(6)] + [config.supply_voltage]))
+    batch = time.time() - start
+    assert numpy.array_equal(outputs, row_view(controllers[0].trace)[1:count+1, 1:])
+    print("%d updates : %.3f seconds one call per update, %.4f seconds update_batch" % (count, single, batch))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Sweeps PI controller gains of FOC controller over a grid of (p_gain, i_gain)
+values and computes step-response metrics for every point.
+
+Each grid point is an independent simulation, so they are spread over all
+CPU cores with a process pool.  Simulations use foc_kernel.run_fast(),
+which uses the compiled kernel when numba is installed.
+
+Results are written as a table with one row per grid point.  The format is
+selected by file extension: .csv, .npz or .parquet (needs pandas).
+
+Example:
+  ./gain_sweep.py --p-gains 0.1:1.0:10 --i-gains 100:2000:20 --axis both -o sweep.csv
+"""
+
+import csv
+import math
+import os
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+
+from foc_kernel import run_fast
+from motor_sim_cleaned import SimConfig
+
+
+RESULT_FIELDS = ('d_p_gain', 'd_i_gain', 'q_p_gain', 'q_i_gain',
+                 'rise_time', 'overshoot', 'settling_time', 'rms_iq_error', 'peak_phase_current')
+
+
+def step_metrics(result, settling_band=0.02):
+    """ Computes step-response metrics of quadrature current from SimResult.
+    Torque step is applied at t=0.  Response is measured relative to target Iq at every
+    sample, so dynamic torque limiting does not show up as a step-response error.
+      rise_time : time from 10% to 90% of target (seconds)
+      overshoot : peak response above target (fraction of target)
+      settling_time : time after which response stays inside settling_band (seconds)
+      rms_iq_error : RMS of target Iq - measured Iq (Amps)
+      peak_phase_current : largest absolute phase current (Amps)
+    Times are nan if response never gets there.
+    """
+    motor_trace = result.motor
+    foc_trace = result.foc
+    # first two FOC samples are initial state and zero-torque update before loop starts
+    t = foc_trace.t[2:]
+    target_iq = foc_trace.target_iq[2:]
+    measured_iq = foc_trace.measured_iq[2:]
+
+    nonzero = target_iq != 0.0
+    response = numpy.where(nonzero, measured_iq / numpy.where(nonzero, target_iq, 1.0), 1.0)
+
+    def first_time(mask):
+        idx = numpy.flatnonzero(mask)
+        return t[idx[0]] if len(idx) else math.nan
+
+    rise_time = first_time(response >= 0.9) - first_time(response >= 0.1)
+    overshoot = max(response.max() - 1.0, 0.0) if len(response) else math.nan
+
+    outside = numpy.flatnonzero(abs(response - 1.0) > settling_band)
+    if len(outside) == 0:
+        settling_time = 0.0
+    elif outside[-1] + 1 < len(t):
+        settling_time = t[outside[-1] + 1]
+    else:
+        settling_time = math.nan
+
+    rms_iq_error = math.sqrt(numpy.mean((target_iq - measured_iq)**2)) if len(t) else math.nan
+    peak_phase_current = max(abs(motor_trace.ia).max(), abs(motor_trace.ib).max(), abs(motor_trace.ic).max())
+
+    return dict(rise_time=rise_time, overshoot=overshoot, settling_time=settling_time,
+                rms_iq_error=rms_iq_error, peak_phase_current=peak_phase_current)
+
+
+def run_point(config):
+    """ Runs single sweep point in worker process, returns result row """
+    result = run_fast(config)
+    row = dict(d_p_gain=config.d_gains[0], d_i_gain=config.d_gains[1],
+               q_p_gain=config.q_gains[0], q_i_gain=config.q_gains[1])
+    row.update(step_metrics(result))
+    return row
+
+
+def sweep_points(p_gains, i_gains, axis, config):
+    """ Returns list of (d_gains, q_gains) for every combination of p and i gain.
+    axis selects which controller gets swept gains : 'd', 'q' or 'both'
+    The other controller keeps gains from config
+    """
+    if axis not in ('d', 'q', 'both'):
+        raise ValueError("axis must be 'd', 'q' or 'both'")
+    points = []
+    for p_gain in p_gains:
+        for i_gain in i_gains:
+            gains = (float(p_gain), float(i_gain))
+            d_gains = gains if axis in ('d', 'both') else config.d_gains
+            q_gains = gains if axis in ('q', 'both') else config.q_gains
+            points.append((d_gains, q_gains))
+    return points
+
+
+def sweep_gains(config, p_gains, i_gains, axis='both', workers=None):
+    """ Simulates every (p_gain, i_gain) combination in parallel, returns list of result rows.
+    All other simulation settings (runtime, load_inertia, etc..) come from config
+    """
+    jobs = [config.copy(d_gains=d_gains, q_gains=q_gains)
+            for d_gains, q_gains in sweep_points(p_gains, i_gains, axis, config)]
+    chunksize = max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_point, jobs, chunksize=chunksize))
+
+
+def write_results(rows, path):
+    """ Writes result rows to .csv, .npz or .parquet file """
+    ext = os.path.splitext(path)[1].lower()
+    columns = dict((name, numpy.array([row[name] for row in rows], dtype=float)) for name in RESULT_FIELDS)
+    if ext == '.csv':
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(dict((name, repr(float(row[name]))) for name in RESULT_FIELDS))
+    elif ext == '.npz':
+        numpy.savez_compressed(path, **columns)
+    elif ext == '.parquet':
+        import pandas
+        pandas.DataFrame(columns).to_parquet(path)
+    else:
+        raise ValueError("unknown result file type %r, use .csv, .npz or .parquet" % ext)
+
+
+def parse_range(text):
+    """ Parses 'start:stop:count' into evenly spaced values or 'a,b,c' into list """
+    if ':' in text:
+        start, stop, count = text.split(':')
+        return numpy.linspace(float(start), float(stop), int(count))
+    return [float(v) for v in text.split(',')]
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Sweep FOC PI controller gains")
+    parser.add_argument('--p-gains', default='0.1:1.0:10', help="start:stop:count or comma separated list")
+    parser.add_argument('--i-gains', default='100:2000:20', help="start:stop:count or comma separated list")
+    parser.add_argument('--axis', default='both', choices=('d', 'q', 'both'), help="controller to sweep")
+    parser.add_argument('--runtime', type=float, default=15e-3, help="simulation time (seconds)")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('-o', '--output', default='gain_sweep.csv', help="result file (.csv, .npz, .parquet)")
+    args = parser.parse_args()
+
+    config = SimConfig(runtime=args.runtime)
+    start = time.time()
+    rows = sweep_gains(config, parse_range(args.p_gains), parse_range(args.i_gains),
+                       args.axis, args.workers)
+    write_results(rows, args.output)
+    print("%d simulations in %.1f seconds, results written to %s" % (len(rows), time.time() - start, args.output))
+
+    settled = [row for row in rows if not math.isnan(row['settling_time'])]
+    if settled:
+        best = min(settled, key=lambda row: row['rms_iq_error'])
+        print("lowest RMS Iq error : d_gains=(%g, %g) q_gains=(%g, %g) rms=%.4g A settling=%.3g ms" %
+              (best['d_p_gain'], best['d_i_gain'], best['q_p_gain'], best['q_i_gain'],
+               best['rms_iq_error'], best['settling_time'] * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Library of motor parameters.
+
+Motors are described as data in a catalog file (motors.json next to this
+module by default, .toml files are also accepted) so adding a motor does not
+need any code.  Every entry has the datasheet values used by the simulator
+and the FOC controller, in SI units:
+  torque_constant : Nm/A (== V/(rad/s))
+  terminal_resistance : Ohm, phase to phase
+  terminal_inductance : H, phase to phase
+  rotor_inertia : kg*m^2
+  friction : viscous friction Nm/(rad/s)
+  max_torque : Nm
+  pole_pairs : integer
+and optionally d_gains / q_gains, [p_gain, i_gain] for PI current controllers,
+and free-form notes.
+
+Entries are loaded as MotorParams objects.  MotorParams is immutable and also
+holds constants derived from the datasheet values (per-phase resistance,
+sinusoidal torque constant, ...) so simulation loops don't need to recompute
+them on every step.  Use replace() to make a variation of a motor.
+"""
+
+import json
+import os
+from math import sqrt
+
+
+DEFAULT_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'motors.json')
+
+
+class MotorParams:
+    """ Immutable motor parameters with precomputed derived constants.
+    Derived constants:
+      phase_resistance, phase_inductance : values of a single Wye phase winding
+      phase_torque_constant : torque constant for sinusoidal currents, also back-emf V/(rad/s) of a phase
+      foc_torque_constant : torque constant for FOC quadrature current
+      foc_inductance : inductance seen by FOC d/q currents
+      electrical_time_constant : L/R in seconds (inf for an ideal winding with R = 0)
+    """
+    params = ('name', 'torque_constant', 'terminal_resistance', 'terminal_inductance',
+              'rotor_inertia', 'friction', 'max_torque', 'pole_pairs', 'd_gains', 'q_gains', 'notes')
+    derived = ('phase_resistance', 'phase_inductance', 'phase_torque_constant',
+               'foc_torque_constant', 'foc_inductance', 'electrical_time_constant')
+    __slots__ = params + derived
+
+    def __init__(self, name, torque_constant, terminal_resistance, terminal_inductance,
+                 rotor_inertia, friction, max_torque, pole_pairs, d_gains=None, q_gains=None, notes=''):
+        values = dict(name=name, torque_constant=float(torque_constant),
+                      terminal_resistance=float(terminal_resistance),
+                      terminal_inductance=float(terminal_inductance),
+                      rotor_inertia=float(rotor_inertia), friction=float(friction),
+                      max_torque=float(max_torque), pole_pairs=int(pole_pairs),
+                      d_gains=tuple(d_gains) if d_gains is not None else None,
+                      q_gains=tuple(q_gains) if q_gains is not None else None,
+                      notes=notes)
+        if values['terminal_resistance'] < 0.0:
+            raise ValueError("motor %r terminal_resistance must not be negative, got %g"
+                             % (name, values['terminal_resistance']))
+        # see notes about motor torque with sinusoidal control in motor_sim_cleaned
+        values['phase_resistance'] = values['terminal_resistance'] * 0.5
+        values['phase_inductance'] = values['terminal_inductance'] * 0.5
+        values['phase_torque_constant'] = values['torque_constant'] * 0.60459978807807258  # pi/3 / sqrt(3)
+        values['foc_torque_constant'] = values['torque_constant'] * 0.7404804896930609  # sqrt(2)*3/pi
+        values['foc_inductance'] = values['terminal_inductance'] / sqrt(2)
+        if values['terminal_resistance'] > 0.0:
+            values['electrical_time_constant'] = values['terminal_inductance'] / values['terminal_resistance']
+        else:
+            values['electrical_time_constant'] = float('inf')
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MotorParams is immutable, use replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError("MotorParams is immutable")
+
+    def __reduce__(self):
+        return (MotorParams, tuple(getattr(self, name) for name in self.params))
+
+    def __eq__(self, other):
+        if not isinstance(other, MotorParams):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.params)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, name) for name in self.params))
+
+    def __repr__(self):
+        return 'MotorParams(%s)' % ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.params[:8])
+
+    def replace(self, **changes):
+        """ Returns copy of motor with some datasheet values changed """
+        values = dict((name, getattr(self, name)) for name in self.params)
+        for name, value in changes.items():
+            if name not in values:
+                raise TypeError("unknown motor parameter %r" % name)
+            values[name] = value
+        return MotorParams(**values)
+
+    def as_dict(self):
+        """ Returns datasheet values in catalog file format """
+        values = dict((name, getattr(self, name)) for name in self.params if name != 'name')
+        for name in ('d_gains', 'q_gains'):
+            if values[name] is None:
+                del values[name]
+            else:
+                values[name] = list(values[name])
+        return values
+
+
+def as_motor_params(motor):
+    """ Returns motor as MotorParams.
+    Any object with datasheet attributes (like old style motor classes) is converted
+    """
+    if isinstance(motor, MotorParams):
+        return motor
+    return MotorParams(getattr(motor, 'name', type(motor).__name__),
+                       motor.torque_constant, motor.terminal_resistance, motor.terminal_inductance,
+                       motor.rotor_inertia, motor.friction, motor.max_torque, motor.pole_pairs,
+                       getattr(motor, 'd_gains', None), getattr(motor, 'q_gains', None))
+
+
+# catalogs that have already been loaded, by path
+_catalogs = {}
+
+
+def read_catalog_file(path):
+    """ Returns raw {name : parameter dict} contents of .json or .toml catalog file """
+    if path.lower().endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_catalog(path=None):
+    """ Returns {name : MotorParams} for all motors in catalog file """
+    path = os.path.abspath(path or DEFAULT_CATALOG)
+    if path not in _catalogs:
+        entries = read_catalog_file(path)
+        _catalogs[path] = dict((name, MotorParams(name=name, **values)) for name, values in entries.items())
+    return _catalogs[path]
+
+
+def get_motor(name, path=None):
+    """ Returns MotorParams of named motor from catalog """
+    catalog = load_catalog(path)
+    if name not in catalog:
+        raise KeyError("motor %r not in catalog, available motors : %s" % (name, ', '.join(sorted(catalog))))
+    return catalog[name]
+
+
+def motor_names(path=None):
+    return sorted(load_catalog(path))
+
+
+def save_catalog(motors, path):
+    """ Writes list of MotorParams to .json catalog file """
+    with open(path, 'w') as f:
+        json.dump(dict((motor.name, motor.as_dict()) for motor in motors), f, indent=2, sort_keys=True)
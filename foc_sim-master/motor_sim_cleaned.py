@@ -37,9 +37,19 @@ The simulator combinded with ploting tools should allow easier insight into
 motor and controller operation that can be had from running on hardware system
 
 Simulator uses first-order (Euler or RK1) method to simulate motor differential
-equations.  The Euler method needs a smaller simulation timestep (than other methods)
+equations by default.  The Euler method needs a smaller simulation timestep (than other methods)
 is need to make simulation stable.  However, the Euler method is much easier to implement.
 
+MotorSim can also use a classic 4th order Runge-Kutta method (integrator='rk4') or an
+adaptive-step Dormand-Prince RK45 method (integrator='rk45').  With RK45 each call to update()
+integrates over the whole interval dt using as many internal steps as are needed to keep
+the error below tolerance.  The end of the interval is never stepped over, so when update()
+is called once per PWM cycle the PWM/FOC update times are hard breakpoints for the integrator.
+
+Since phase voltages are constant between PWM updates, the RL phase circuit also has an exact
+exponential solution (integrator='exact').  It is stable for any time step, so it needs just one
+step per PWM cycle, also for low inductance motors that need very small Euler steps.
+
 There are two time-constants to worry about for simulator.
 The motor inductance time-constant, and the motor inertial time-constant.
 In practice most real motors have an indutance time-constant that is always smaller
@@ -54,9 +64,12 @@ simulator code to support type of motor or controller operation that is of inter
 """
 
 
-from math import sin, cos, pi, sqrt
-import pylab
+import os
+from math import sin, cos, pi, sqrt, exp
 from foc_cleaned import FOC_Controller, FOC_CWrapper, alignmentRatio
+from trace_recorder import create_trace, sized_trace_options
+from motor_catalog import get_motor, as_motor_params
+from checkpoint import Checkpoint, as_checkpoint
 
 ################################################################################
 # Block-Commutation Versus simulation
@@ -147,23 +160,10 @@ from foc_cleaned import FOC_Controller, FOC_CWrapper, alignmentRatio
 # Parameters for Maxon EC-Flat 45 30-Watt 24V
 # Parameters are taken from Maxon data-sheet, however these parameters
 # are based on block commutation control of motors
-class Maxon_339283:
-    def __init__(self):
-        self.torque_constant = 51e-3 # Nm/A == V/(rad/s)
-        self.terminal_resistance = 5.03
-        self.terminal_inductance = 2.24e-3 #mH
-        self.rotor_inertia = 92.5 * 1e-7  # gcm2 = kg/1000 * (m/100 * m/100) = kg/m2/1e7
-
-    #no load speed = 4380 rpm
-    #no load speed = 458.67 rad/s
-    #no load current = 73mA
-    #no load torque = 73mA * 51  = 3.723e-3 Nm
-        self.friction = 3.723e-3 / 458.67  # Nm/(rad/s)
-
-        self.max_torque = 54.7e-3
-
-        self.pole_pairs = 8
-
+# Motor parameters and controller gains are loaded from motor catalog (motors.json, see motor_catalog.py)
+# adding a motor only needs a new catalog entry.  These names are kept for existing scripts.
+def Maxon_339283():
+    return get_motor('maxon_339283')
 
 
 # These controller gains work well for 17.5kHz control loop rate and Maxon_339283
@@ -173,46 +173,94 @@ class Maxon_339283_Controller_Gains:
         # q_gains for quadrature current controller
         # first value is proportial term for PI controller
         # second value is integral term for PI controller
-        self.d_gains = (0.4, 800.)
-        self.q_gains = (0.4, 800.)
+        motor = get_motor('maxon_339283')
+        self.d_gains = motor.d_gains
+        self.q_gains = motor.q_gains
 
 
 
+# Dormand-Prince RK45 coefficients used by MotorSim.update_rk45()
+DP_A21 = 1.0/5
+DP_A31, DP_A32 = 3.0/40, 9.0/40
+DP_A41, DP_A42, DP_A43 = 44.0/45, -56.0/15, 32.0/9
+DP_A51, DP_A52, DP_A53, DP_A54 = 19372.0/6561, -25360.0/2187, 64448.0/6561, -212.0/729
+DP_A61, DP_A62, DP_A63, DP_A64, DP_A65 = 9017.0/3168, -355.0/33, 46732.0/5247, 49.0/176, -5103.0/18656
+DP_B1, DP_B3, DP_B4, DP_B5, DP_B6 = 35.0/384, 500.0/1113, 125.0/192, -2187.0/6784, 11.0/84
+# difference between 5th order and embedded 4th order weights
+DP_E1, DP_E3, DP_E4, DP_E5, DP_E6, DP_E7 = 71.0/57600, -71.0/16695, 71.0/1920, -17253.0/339200, 22.0/525, -1.0/40
 
 
 # Simulates 3-phase brushless motor with sinusoidal back-EMF using parameters from motor class.
 # Assume motor phases are Wye (or star) connected so are no circulating currents.
 # Currently, cannot simulate field-weaking, relectance torque, or no-sinusoid back-EMF
-# Keeps arrays of motor states, inputs and outputs to allow easy plotting of motor operation later,
-# However these arrays can easily get too big if simulation is run too long.
+# Motor states, inputs and outputs are recorded to a TraceRecorder to allow easy plotting of
+# motor operation later.  The recorder can be decimated or made a ring buffer (see trace_options)
+# so memory stays bounded when simulation is run for a long time, or given a path in trace_options
+# to stream every sample to a .npy file.
+#
+# integrator selects method used by update() : 'euler', 'rk4', 'rk45' or 'exact'
+# rtol and atol are relative and absolute error tolerances used by 'rk45'
+# angle_lut (an angle_lut.AngleLUT) replaces sin() of phase angles with interpolated table lookup
 class MotorSim:
-    def __init__(self, motor, load_inertia, start_position=0.0):
-        self.motor =motor #motor parameter (backemf contant, torque constant, terminal resistance, terminal inductance, inertia, etc..)
+    trace_fields = ('t', 'vxa', 'vxb', 'vxc', 'va', 'vb', 'vc', 'ia', 'ib', 'ic',
+                    'backemf_a', 'backemf_b', 'backemf_c', 'torque', 'velocity', 'position')
+    integrators = ('euler', 'rk4', 'rk45', 'exact')
+
+    def __init__(self, motor, load_inertia, start_position=0.0, trace_options=None,
+                 integrator='euler', rtol=1e-6, atol=1e-6, angle_lut=None):
+        # motor parameter (backemf contant, torque constant, terminal resistance, terminal inductance, inertia, etc..)
+        # converted to MotorParams, which has per-phase constants precomputed
+        self.motor = as_motor_params(motor)
         self.load_inertia = load_inertia
-        self.ia = [0.0]  # phase currents
-        self.ib = [0.0]
-        self.ic = [0.0]
-        self.vxa = [0.0]  # terminal voltages
-        self.vxb = [0.0]
-        self.vxc = [0.0]
-        self.va = [0.0]  # phase voltages
-        self.vb = [0.0]
-        self.vc = [0.0]
-        self.backemf_a = [0.0]  # back-emf voltages
-        self.backemf_b = [0.0]
-        self.backemf_c = [0.0]
-        self.torque = [0.0]   # torque produced  
-        self.velocity = [0.0] # motor velocity (radians/sec)
-        self.position = [start_position] # motor position (radians)
-        self.t = [0.0]
+        # current motor state
+        self.t = 0.0
+        self.ia = 0.0  # phase currents
+        self.ib = 0.0
+        self.ic = 0.0
+        self.backemf_a = 0.0  # back-emf voltages
+        self.backemf_b = 0.0
+        self.backemf_c = 0.0
+        self.velocity = 0.0 # motor velocity (radians/sec)
+        self.position = start_position # motor position (radians)
+        # external load torque (Nm), opposes positive motor torque. Can be changed between updates
+        self.load_torque = 0.0
+        # recorded history of motor state, inputs and outputs
+        self.trace = create_trace(self.trace_fields, **(trace_options or {}))
+        self.trace.record(0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+                          0.0, 0.0, 0.0, 0.0, 0.0, start_position)
+
+        if integrator not in self.integrators:
+            raise ValueError("unknown integrator %r, use one of %s" % (integrator, self.integrators))
+        self.integrator = integrator
+        self.update = getattr(self, 'update_' + integrator)
+        self.rtol = rtol
+        self.atol = atol
+        self.angle_lut = angle_lut
+        self.step_size = None  # last step size used by adaptive integrator
+        self.steps = 0  # number of integrator steps taken (includes rejected rk45 steps)
+        # exponential decay factors used by 'exact' integrator, recalculated when dt changes
+        self.exact_dt = None
+        self.exact_decay = 0.0
+        self.exact_gain = 0.0
+
+    def get_state(self):
+        """ Returns motor state as tuple of floats, load_torque is an input and not included """
+        return (self.t, self.ia, self.ib, self.ic, self.backemf_a, self.backemf_b, self.backemf_c,
+                self.velocity, self.position, self.step_size or 0.0, self.steps)
+
+    def set_state(self, state):
+        (self.t, self.ia, self.ib, self.ic, self.backemf_a, self.backemf_b, self.backemf_c,
+         self.velocity, self.position, step_size, steps) = state
+        self.step_size = step_size or None
+        self.steps = int(steps)
     
-    def update(self, t, dt, vxa, vxb, vxc):
+    def update_euler(self, t, dt, vxa, vxb, vxc):
     # Updates motor state (phase currents, velocity, position) given excited voltages on each phase    t is the current time    dt is the timestep
     
         motor = self.motor
-        ia = self.ia[-1]
-        ib = self.ib[-1]
-        ic = self.ic[-1]
+        ia = self.ia
+        ib = self.ib
+        ic = self.ic
     
     # phase voltages are not absolute (since there is not ground)
     # as such sum of voltages should be 0.
@@ -223,16 +271,16 @@ class MotorSim:
         vc = vxc - vcenter
 
     # resistance of a single phase winding
-        R = motor.terminal_resistance * 0.5    
+        R = motor.phase_resistance
 
     # determine voltages that are seen by inductances of each phase
     # by removing resitance and back-emf voltages
-        Lva = va - self.backemf_a[-1] - ia * R
-        Lvb = vb - self.backemf_b[-1] - ib * R
-        Lvc = vc - self.backemf_c[-1] - ic * R
+        Lva = va - self.backemf_a - ia * R
+        Lvb = vb - self.backemf_b - ib * R
+        Lvc = vc - self.backemf_c - ic * R
 
     # inductance of a single phase
-        L = motor.terminal_inductance * 0.5
+        L = motor.phase_inductance
 
     # volatage will induce current change in phase current
         ia += Lva / L * dt
@@ -247,25 +295,28 @@ class MotorSim:
         ic -= iavg
 
     # sin of motor angle will be important for a couple calcs
-        el_angle = self.position[-1] * self.motor.pole_pairs
-        sa = sin(el_angle)
-        sb = sin(el_angle-pi*2/3)
-        sc = sin(el_angle+pi*2/3)
+        el_angle = self.position * motor.pole_pairs
+        if self.angle_lut is None:
+            sa = sin(el_angle)
+            sb = sin(el_angle-pi*2/3)
+            sc = sin(el_angle+pi*2/3)
+        else:
+            sa, sb, sc = self.angle_lut.sin3(el_angle)
 
     # determine torque
     # note that the torque_constant is based on block commutation.
     # read notes about motor torque with sinusoidal control to
     # get a better idea scale constant comes from
-        scale  = 0.60459978807807258  # pi/3 / sqrt(3)
-        torque_constant = motor.torque_constant * scale
+        # scale = 0.60459978807807258  # pi/3 / sqrt(3)
+        torque_constant = motor.phase_torque_constant  # motor.torque_constant * scale
         torque = (ia*sa + ib*sb + ic*sc) * torque_constant
 
-    # determine new motor velocity (include viscous friction)
-        velocity = self.velocity[-1]
-        velocity += (torque - velocity*motor.friction)/(motor.rotor_inertia+self.load_inertia)*dt
+    # determine new motor velocity (include viscous friction and external load torque)
+        velocity = self.velocity
+        velocity += (torque - self.load_torque - velocity*motor.friction)/(motor.rotor_inertia+self.load_inertia)*dt
 
     # determine new motor position
-        position = self.position[-1] + velocity*dt
+        position = self.position + velocity*dt
 
     # determine new back-emf voltages (for next time)
     # for motor V/(rad/s) == A/Nm == 1/(Nm/A)
@@ -282,94 +333,508 @@ class MotorSim:
         backemf_b = sb * velocity * voltage_constant
         backemf_c = sc * velocity * voltage_constant
 
+    # update state
+        self.t = t
+        self.ia = ia
+        self.ib = ib
+        self.ic = ic
+        self.backemf_a = backemf_a
+        self.backemf_b = backemf_b
+        self.backemf_c = backemf_c
+        self.velocity = velocity
+        self.position = position
+
     # record 
-        self.vxa.append(vxa)
-        self.vxb.append(vxb)
-        self.vxc.append(vxc)
-        self.va.append(va)
-        self.vb.append(vb)
-        self.vc.append(vc)
-        self.ia.append(ia)
-        self.ib.append(ib)
-        self.ic.append(ic)
-        self.backemf_a.append(backemf_a)
-        self.backemf_b.append(backemf_b)
-        self.backemf_c.append(backemf_c)
-        self.torque.append(torque)
-        self.velocity.append(velocity)
-        self.position.append(position)
-        self.t.append(t)
+        self.trace.record(t, vxa, vxb, vxc, va, vb, vc, ia, ib, ic,
+                          backemf_a, backemf_b, backemf_c, torque, velocity, position)
+        self.steps += 1
 
         return (position, velocity, ia, ib, ic)
 
+    def derivatives(self, va, vb, vc, state):
+        """ Returns time derivative of motor state (ia, ib, ic, velocity, position)
+        for given phase voltages.  Unlike Euler update, back-emf is calculated
+        from the state itself instead of being delayed by one step.
+        """
+        motor = self.motor
+        ia, ib, ic, velocity, position = state
+        R = motor.phase_resistance
+        L = motor.phase_inductance
+        torque_constant = motor.phase_torque_constant
+
+        el_angle = position * motor.pole_pairs
+        if self.angle_lut is None:
+            sa = sin(el_angle)
+            sb = sin(el_angle-pi*2/3)
+            sc = sin(el_angle+pi*2/3)
+        else:
+            sa, sb, sc = self.angle_lut.sin3(el_angle)
+        bemf = velocity * torque_constant
+
+        dia = (va - sa*bemf - ia*R) / L
+        dib = (vb - sb*bemf - ib*R) / L
+        dic = (vc - sc*bemf - ic*R) / L
+        # derivatives of Wye-wound motor currents must also sum to 0
+        davg = (dia + dib + dic) / 3.0
 
+        torque = (ia*sa + ib*sb + ic*sc) * torque_constant
+        dvelocity = (torque - self.load_torque - velocity*motor.friction)/(motor.rotor_inertia+self.load_inertia)
+        return (dia-davg, dib-davg, dic-davg, dvelocity, velocity)
 
-def sim():
-    # Motor parameters can be switched here pretty quickly
-    motor = Maxon_339283()
-    load_inertia = 0.0 * 1e-7 #0.0 # Extra intertial load to use when simulating motor (kg*m^2)
-
-    gains = Maxon_339283_Controller_Gains()
-    d_gains = gains.d_gains
-    q_gains = gains.q_gains
+    def finish_step(self, t, vxa, vxb, vxc, va, vb, vc, state):
+        """ Stores new state from higher-order integrators and records it """
+        motor = self.motor
+        ia, ib, ic, velocity, position = state
+        iavg = (ia+ib+ic)/3.0
+        ia -= iavg
+        ib -= iavg
+        ic -= iavg
 
-    alignmentRatio(motor)
+        el_angle = position * motor.pole_pairs
+        if self.angle_lut is None:
+            sa = sin(el_angle)
+            sb = sin(el_angle-pi*2/3)
+            sc = sin(el_angle+pi*2/3)
+        else:
+            sa, sb, sc = self.angle_lut.sin3(el_angle)
+        torque_constant = motor.phase_torque_constant
+        torque = (ia*sa + ib*sb + ic*sc) * torque_constant
+        backemf_a = sa * velocity * torque_constant
+        backemf_b = sb * velocity * torque_constant
+        backemf_c = sc * velocity * torque_constant
+
+        self.t = t
+        self.ia = ia
+        self.ib = ib
+        self.ic = ic
+        self.backemf_a = backemf_a
+        self.backemf_b = backemf_b
+        self.backemf_c = backemf_c
+        self.velocity = velocity
+        self.position = position
+
+        self.trace.record(t, vxa, vxb, vxc, va, vb, vc, ia, ib, ic,
+                          backemf_a, backemf_b, backemf_c, torque, velocity, position)
+
+    def update_rk4(self, t, dt, vxa, vxb, vxc):
+        """ Same as update_euler() but uses classic 4th order Runge-Kutta method """
+        vcenter = ( vxa + vxb + vxc ) / 3.0
+        va = vxa - vcenter
+        vb = vxb - vcenter
+        vc = vxc - vcenter
 
-    # motor simulator 
-    motor_sim = MotorSim(motor, load_inertia)
+        y = (self.ia, self.ib, self.ic, self.velocity, self.position)
+        f = self.derivatives
+        k1 = f(va, vb, vc, y)
+        k2 = f(va, vb, vc, [y[i] + 0.5*dt*k1[i] for i in range(5)])
+        k3 = f(va, vb, vc, [y[i] + 0.5*dt*k2[i] for i in range(5)])
+        k4 = f(va, vb, vc, [y[i] + dt*k3[i] for i in range(5)])
+        y = [y[i] + dt/6.0*(k1[i] + 2.0*k2[i] + 2.0*k3[i] + k4[i]) for i in range(5)]
+        self.steps += 1
+
+        self.finish_step(t, vxa, vxb, vxc, va, vb, vc, y)
+        return (self.position, self.velocity, self.ia, self.ib, self.ic)
+
+    def update_exact(self, t, dt, vxa, vxb, vxc):
+        """ Same as update_euler() but phase currents use exact solution of RL phase circuit.
+        With phase voltage and back-emf constant over the step
+            i(t+dt) = i(t)*exp(-R/L*dt) + (v - backemf)/R * (1 - exp(-R/L*dt))
+        which is stable for any dt, so one step per PWM cycle is enough even for motors
+        with very small inductance.  Velocity and position use a semi-implicit Euler step.
+        """
+        vcenter = ( vxa + vxb + vxc ) / 3.0
+        va = vxa - vcenter
+        vb = vxb - vcenter
+        vc = vxc - vcenter
 
-    
-    # Simulate starting offset to absolte motor position measurement 
-    #  (for testing incremental alignment)
-    el_angle_offset = 0.0 #-20.0 * pi/180.
-    angle_offset = el_angle_offset / motor.pole_pairs
+        motor = self.motor
+        if dt != self.exact_dt:
+            R = motor.phase_resistance
+            L = motor.phase_inductance
+            decay = exp(-R/L*dt)
+            self.exact_dt = dt
+            self.exact_decay = decay
+            self.exact_gain = (1.0 - decay)/R if R > 0.0 else dt/L
+        decay = self.exact_decay
+        gain = self.exact_gain
+
+        el_angle = self.position * motor.pole_pairs
+        if self.angle_lut is None:
+            sa = sin(el_angle)
+            sb = sin(el_angle-pi*2/3)
+            sc = sin(el_angle+pi*2/3)
+        else:
+            sa, sb, sc = self.angle_lut.sin3(el_angle)
+        torque_constant = motor.phase_torque_constant
+
+        ia = self.ia
+        ib = self.ib
+        ic = self.ic
+        velocity = self.velocity
+        bemf = velocity * torque_constant
+        torque = (ia*sa + ib*sb + ic*sc) * torque_constant
 
-    # Supply voltage, controller outputs PWM duty values that should be in range 0.0-1.0.
-    # the simulator multiple the supply voltage to simulate a 3-phase inverter
-    supply_voltage = 24.0
+        ia = ia*decay + (va - sa*bemf)*gain
+        ib = ib*decay + (vb - sb*bemf)*gain
+        ic = ic*decay + (vc - sc*bemf)*gain
+        velocity += (torque - self.load_torque - velocity*motor.friction)/(motor.rotor_inertia+self.load_inertia)*dt
+        position = self.position + velocity*dt
+        self.steps += 1
+
+        self.finish_step(t, vxa, vxb, vxc, va, vb, vc, (ia, ib, ic, velocity, position))
+        return (self.position, self.velocity, self.ia, self.ib, self.ic)
+
+    def update_rk45(self, t, dt, vxa, vxb, vxc):
+        """ Integrates motor state from t to t+dt with adaptive Dormand-Prince RK45 method.
+        The step size is adapted to keep error estimate below rtol/atol, but a step
+        never goes past t+dt, since the phase voltages change there.
+        Every accepted internal step is recorded.
+        """
+        vcenter = ( vxa + vxb + vxc ) / 3.0
+        va = vxa - vcenter
+        vb = vxb - vcenter
+        vc = vxc - vcenter
 
-    # For FOC controller this is the initial target torque that is passed in.
-    # if more complex torque profile or higher level position / velocity controller is
-    # needed, implement it in simulatin loop
-    target_torque = 0.65 * motor.max_torque
+        f = self.derivatives
+        rtol = self.rtol
+        atol = self.atol
+        y = (self.ia, self.ib, self.ic, self.velocity, self.position)
+        h = self.step_size or dt
+        elapsed = 0.0
+        k1 = f(va, vb, vc, y)
+        R = range(5)
+        while elapsed < dt:
+            # don't step past end of interval
+            remaining = dt - elapsed
+            step = min(h, remaining)
+            k2 = f(va, vb, vc, [y[i] + step*(DP_A21*k1[i]) for i in R])
+            k3 = f(va, vb, vc, [y[i] + step*(DP_A31*k1[i] + DP_A32*k2[i]) for i in R])
+            k4 = f(va, vb, vc, [y[i] + step*(DP_A41*k1[i] + DP_A42*k2[i] + DP_A43*k3[i]) for i in R])
+            k5 = f(va, vb, vc, [y[i] + step*(DP_A51*k1[i] + DP_A52*k2[i] + DP_A53*k3[i] + DP_A54*k4[i]) for i in R])
+            k6 = f(va, vb, vc, [y[i] + step*(DP_A61*k1[i] + DP_A62*k2[i] + DP_A63*k3[i] + DP_A64*k4[i] + DP_A65*k5[i]) for i in R])
+            y_new = [y[i] + step*(DP_B1*k1[i] + DP_B3*k3[i] + DP_B4*k4[i] + DP_B5*k5[i] + DP_B6*k6[i]) for i in R]
+            k7 = f(va, vb, vc, y_new)
+            self.steps += 1
+
+            # error is difference between 5th and embedded 4th order solutions
+            err = 0.0
+            for i in R:
+                e = step*(DP_E1*k1[i] + DP_E3*k3[i] + DP_E4*k4[i] + DP_E5*k5[i] + DP_E6*k6[i] + DP_E7*k7[i])
+                scale = atol + rtol*max(abs(y[i]), abs(y_new[i]))
+                err += (e/scale)**2
+            err = sqrt(err / 5.0)
+
+            if err <= 1.0:
+                self.finish_step(t + elapsed, vxa, vxb, vxc, va, vb, vc, y_new)
+                elapsed = dt if step == remaining else elapsed + step
+                y = (self.ia, self.ib, self.ic, self.velocity, self.position)
+                k1 = f(va, vb, vc, y)
+                factor = 5.0 if err == 0.0 else min(5.0, 0.9 * err**-0.2)
+                if step < h:
+                    # step was shortened to hit end of interval, don't let that shrink next step
+                    h = max(h, step*factor)
+                else:
+                    h = step*factor
+            else:
+                h = step * max(0.2, 0.9 * err**-0.2)
+
+        self.step_size = h
+        return (self.position, self.velocity, self.ia, self.ib, self.ic)
+
+
+
+class SimConfig:
+    """ Settings for a single motor + FOC simulation run.
+    Any setting can be changed by passing it as keyword argument
+    """
+    def __init__(self, **settings):
+        # Motor parameters can be switched here pretty quickly
+        self.motor = Maxon_339283()
+        self.load_inertia = 0.0 * 1e-7 #0.0 # Extra intertial load to use when simulating motor (kg*m^2)
+
+        gains = Maxon_339283_Controller_Gains()
+        self.d_gains = gains.d_gains
+        self.q_gains = gains.q_gains
+
+        # Simulate starting offset to absolte motor position measurement 
+        #  (for testing incremental alignment)
+        self.el_angle_offset = 0.0 #-20.0 * pi/180.
+
+        # Supply voltage, controller outputs PWM duty values that should be in range 0.0-1.0.
+        # the simulator multiple the supply voltage to simulate a 3-phase inverter
+        self.supply_voltage = 24.0
+
+        # For FOC controller this is the initial target torque that is passed in.
+        # None means 0.65 * motor.max_torque
+        self.target_torque = None
+
+        # Optional trajectory.Trajectory for more complex torque profiles or higher level
+        # position / velocity control, and external load torque profiles.
+        # When set it replaces target_torque
+        self.trajectory = None
+
+        # Inverter PWM frequency. Simulator does not simulate actual PWM (on-off with specific duty cycle)
+        # However simulator does change output voltage in discrete times steps to mirror actual PWM based
+        # inverter that can only change its output at discrete time-steps.
+        # Set pwm_switching (run_multirate only) to switch phases between 0 and supply voltage
+        # at center-aligned PWM edges instead, this shows current ripple.
+        self.pwm_dt = 1.0 / 35e3 
+        self.pwm_switching = False
+
+        # How many PWM cycles occur before FOC update is run.
+        # If this value is 1 the FOC is recalculated after every PWM cycle
+        # This code makes assumption that FOC is run synchronously to PWM cycle.
+        #
+        # However, in some controllers the FOC is run asynchornously to PWM updates,
+        # This decouples PWM frequency from FOC update frequency, but at cost
+        # of less repeatable performance since FOC and PWM update are sliding in and
+        # out of phase.
+        #
+        # To simulate a FOC update that is asynchrounous to PWM, set foc_period below
+        # and use multirate_sim.run_multirate() instead of run_simulation().
+        self.foc_update_cycles = 1
+
+        # Some FOC controllers enforce supply currnet (or supply power limit)
+        self.supply_current_limit = 1.2 # negative value = no current limit
+
+        # FOC implementation, FOC_Controller (python) or FOC_CWrapper (C++)
+        self.controller = FOC_Controller
+
+        # Optional angle_lut.AngleLUT used instead of math.sin/cos.  foc_angle_lut mimics
+        # table based sin/cos of embedded controllers (FOC_Controller only),
+        # motor_angle_lut trades a bounded amount of motor simulation accuracy for speed
+        self.foc_angle_lut = None
+        self.motor_angle_lut = None
+
+        # Optional sensors.MeasurementPipeline applied to currents and position before they are
+        # passed to FOC controller (quantization, gain/offset error, noise, encoder resolution, delay)
+        # None means controller sees exact simulated values
+        self.sensors = None
+
+        # Motor integration method and number of motor simulation steps per PWM cycle.
+        # Euler needs about 8 substeps to be stable, 'rk4' gets better accuracy with 1-2 substeps.
+        # 'exact' solves the RL phase circuit in closed form and is stable with 1 substep.
+        # With 'rk45' use 1 substep, the integrator picks its own internal step size and
+        # treats every PWM update as a hard breakpoint.
+        self.integrator = 'euler'
+        self.motor_sim_substeps = 8
+        self.runtime = 15e-3 
+
+        # Recorded traces are preallocated from runtime.  For long simulations increase
+        # trace_decimation to record only every N-th sample (0 = don't record), or set
+        # trace_ring_time to only keep the last trace_ring_time seconds of the simulation.
+        # If trace_dir is set, full traces are streamed to .npy files in that directory
+        # (motor.npy, foc.npy, pwm.npy...) instead, they can be reopened with trace_recorder.TraceFile
+        self.trace_decimation = 1
+        self.trace_ring_time = None
+        self.trace_dir = None
+
+        # Multi-rate simulation (multirate_sim.run_multirate) runs every firmware task on its
+        # own schedule instead of the fixed loop above.  Periods are in seconds.
+        # foc_period None means FOC runs every foc_update_cycles PWM cycles,
+        # adc_period / encoder_period None means currents / position are sampled right before
+        # every FOC update.  Jitter delays every event of a task by a random time in [0, jitter)
+        self.foc_period = None
+        self.adc_period = None
+        self.encoder_period = None
+        self.pwm_jitter = 0.0
+        self.foc_jitter = 0.0
+        self.adc_jitter = 0.0
+        self.encoder_jitter = 0.0
+        self.scheduler_seed = 0
+        # ADC sample time offset from PWM period start (seconds), used when adc_period is set.
+        # With pwm_switching, sampling at start of period sees the average of symmetric ripple.
+        self.adc_phase = 0.0
+
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise TypeError("unknown simulation setting %r" % name)
+            setattr(self, name, value)
+
+    @property
+    def foc_dt(self):
+        if self.foc_period is not None:
+            return self.foc_period
+        return self.pwm_dt * self.foc_update_cycles
+
+    @property
+    def motor_sim_dt(self):
+        return self.pwm_dt / self.motor_sim_substeps
+
+    def is_multirate(self):
+        """ True if config uses settings only supported by multirate_sim.run_multirate() """
+        return (self.foc_period is not None or self.adc_period is not None or self.encoder_period is not None
+                or self.pwm_jitter > 0.0 or self.foc_jitter > 0.0 or self.adc_jitter > 0.0
+                or self.encoder_jitter > 0.0 or self.adc_phase != 0.0 or self.pwm_switching)
+
+    def get_target_torque(self):
+        if self.target_torque is None:
+            return 0.65 * self.motor.max_torque
+        return self.target_torque
+
+    def copy(self, **changes):
+        """ Returns copy of config with some settings changed """
+        config = SimConfig()
+        config.__dict__.update(self.__dict__)
+        for name, value in changes.items():
+            if not hasattr(config, name):
+                raise TypeError("unknown simulation setting %r" % name)
+            setattr(config, name, value)
+        return config
+
+    def trace_options(self, dt, name):
+        """ Returns TraceRecorder options for trace called name, recorded every dt seconds """
+        if self.trace_ring_time is not None:
+            options = sized_trace_options(self.trace_ring_time, dt, self.trace_decimation, ring=True)
+        else:
+            options = sized_trace_options(self.runtime, dt, self.trace_decimation)
+        if self.trace_dir is not None:
+            options['path'] = os.path.join(self.trace_dir, name + '.npy')
+        return options
+
+
+class SimResult:
+    """ Recorded traces from simulation run.
+    Every trace is a TraceRecorder, fields are read as numpy arrays (result.motor.ia)
+      motor  : MotorSim trace
+      foc    : FOC controller trace
+      pwm    : PWM commands actually applied to motor (None from foc_kernel.run_kernel
+               and foc_native.run_native, their loops do not record it)
+      d_ctrl, q_ctrl : PI controller traces (None if controller does not record them)
+      trajectory : outer loop setpoints and load torque (None without config.trajectory)
+    state is checkpoint.Checkpoint of simulation state at end of run, or None if it
+    was not saved.  Pass it as run_simulation(config, start=result.state) to continue
+    """
+    def __init__(self, config, name, motor, foc, pwm, d_ctrl=None, q_ctrl=None, trajectory=None, state=None):
+        self.config = config
+        self.name = name
+        self.motor = motor
+        self.foc = foc
+        self.pwm = pwm
+        self.d_ctrl = d_ctrl
+        self.q_ctrl = q_ctrl
+        self.trajectory = trajectory
+        self.state = state
+
+    def traces(self):
+        return (self.motor, self.foc, self.pwm, self.d_ctrl, self.q_ctrl, self.trajectory)
+
+    def window(self, t_start, t_end):
+        """ Returns SimResult with in-memory copy of samples where t_start <= t < t_end (seconds) """
+        traces = [trace.window(t_start, t_end) if trace is not None else None for trace in self.traces()]
+        return SimResult(self.config, self.name, *traces)
+
+
+def build_simulation(config):
+    """ Creates motor simulator, FOC controller and PWM command trace for config """
+    motor_sim = MotorSim(config.motor, config.load_inertia,
+                         trace_options=config.trace_options(config.motor_sim_dt, 'motor'),
+                         integrator=config.integrator, angle_lut=config.motor_angle_lut)
+
+    controller_options = {}
+    if config.foc_angle_lut is not None:
+        controller_options['angle_lut'] = config.foc_angle_lut
+    foc = config.controller(config.foc_dt, config.motor, config.d_gains, config.q_gains,
+                            config.supply_current_limit, config.trace_options(config.foc_dt, 'foc'),
+                            **controller_options)
+    foc.reset(motor_sim.velocity, config.supply_voltage)
+    if config.sensors is not None:
+        config.sensors.reset()
+    if config.trajectory is not None:
+        config.trajectory.reset(config)
+        motor_sim.load_torque = config.trajectory.initial_load()
+
+    # PWM commands actually applied to motor (delayed by one cycle from FOC commands)
+    pwm = create_trace(('t', 'cmd_a', 'cmd_b', 'cmd_c'), **config.trace_options(config.pwm_dt, 'pwm'))
+    return motor_sim, foc, pwm
+
+
+def finish_simulation(config, motor_sim, foc, pwm):
+    """ Collects traces of finished simulation into SimResult """
+    d_ctrl = getattr(foc, 'd_ctrl', None)
+    q_ctrl = getattr(foc, 'q_ctrl', None)
+    trajectory = config.trajectory
+    result = SimResult(config, foc.name, motor_sim.trace, foc.trace, pwm,
+                       d_ctrl.trace if d_ctrl else None, q_ctrl.trace if q_ctrl else None,
+                       trajectory.trace if trajectory is not None else None)
+    # make sure streamed traces are completely written to disk
+    for trace in result.traces():
+        if trace is not None:
+            trace.flush()
+    return result
+
+
+def save_state(config, t, vx, cmds, motor_sim, foc):
+    """ Returns Checkpoint of run_simulation() loop state, None if controller state can't be saved """
+    if not hasattr(foc, 'get_state'):
+        return None
+    sections = dict(sim=(t, config.foc_dt, config.motor_sim_dt) + tuple(vx) + tuple(cmds),
+                    motor=motor_sim.get_state(), foc=foc.get_state())
+    if config.trajectory is not None:
+        sections['trajectory'] = config.trajectory.get_state()
+    return Checkpoint(sections)
+
+
+def restore_state(config, start, motor_sim, foc, pwm):
+    """ Restores checkpoint into simulation objects of build_simulation() and clears their traces.
+    Returns (t, (vxa, vxb, vxc), (cmd_a, cmd_b, cmd_c)) of run_simulation() loop
+    """
+    state = as_checkpoint(start)
+    if config.sensors is not None:
+        raise ValueError("checkpoint does not include sensor pipeline state, can't continue simulation with sensors")
+    if not hasattr(foc, 'set_state'):
+        raise ValueError("%s state can't be restored from checkpoint" % foc.name)
+    t, foc_dt, motor_sim_dt, vxa, vxb, vxc, cmd_a, cmd_b, cmd_c = state['sim']
+    if foc_dt != config.foc_dt or motor_sim_dt != config.motor_sim_dt:
+        raise ValueError("checkpoint was saved with different time steps (foc_dt %g, motor_sim_dt %g)"
+                         % (foc_dt, motor_sim_dt))
+    motor_sim.set_state(state['motor'])
+    foc.set_state(state['foc'])
+    trajectory = config.trajectory
+    if trajectory is not None:
+        # checkpoint is saved right after a FOC update, profiles continue from that update
+        tick = int(round(t / foc_dt))
+        trajectory.set_state(state.get('trajectory'), tick)
+        motor_sim.load_torque = trajectory.loads[tick]
+    # traces of continued run start after checkpoint
+    traces = [motor_sim.trace, foc.trace, pwm]
+    traces += [ctrl.trace for ctrl in (getattr(foc, 'd_ctrl', None), getattr(foc, 'q_ctrl', None)) if ctrl]
+    if trajectory is not None:
+        traces.append(trajectory.trace)
+    for trace in traces:
+        trace.clear()
+    return t, (vxa, vxb, vxc), (cmd_a, cmd_b, cmd_c)
+
+
+def run_simulation(config=None, start=None):
+    """ Runs motor and FOC simulation without any plotting, returns SimResult.
+    start is a checkpoint (result.state of an earlier run, or its to_bytes() blob)
+    to continue from instead of starting at t=0, see checkpoint.py
+    """
+    if config is None:
+        config = SimConfig()
+    if config.is_multirate():
+        raise ValueError("config has multi-rate settings, use multirate_sim.run_multirate()")
+    motor = config.motor
+    angle_offset = config.el_angle_offset / motor.pole_pairs
+    supply_voltage = config.supply_voltage
+    target_torque = config.get_target_torque()
+    foc_update_cycles = config.foc_update_cycles
+    motor_sim_substeps = config.motor_sim_substeps
+    motor_sim_dt = config.motor_sim_dt
+    runtime = config.runtime
+    sensors = config.sensors
+    trajectory = config.trajectory
 
     # Sim time
     t = 0.0
 
-    # Inverter PWM frequency. Simulator does not simulate actual PWM (on-off with specific duty cycle)
-    # However simulator does change output voltage in discrete times steps to mirror actual PWM based
-    # inverter that can only change its output at discrete time-steps.
-    pwm_dt = 1.0 / 35e3 
-
-    # How many PWM cycles occur before FOC update is run.
-    # If this value is 1 the FOC is recalculated after every PWM cycle
-    # This code makes assumption that FOC is run synchronously to PWM cycle.
-    #
-    # However, in some controllers the FOC is run asynchornously to PWM updates,
-    # This decouples PWM frequency from FOC update frequency, but at cost
-    # of less repeatable performance since FOC and PWM update are sliding in and
-    # out of phase.
-    #
-    # To simulate a FOC update that is asynchrounous to PWM, change code in
-    # main simulation loop to keep separate update time for FOC controller.
-    foc_update_cycles = 1
-    foc_dt = pwm_dt * foc_update_cycles
-
-    # Some FOC controllers enforce supply currnet (or supply power limit)
-    supply_current_limit = 1.2 # negative value = no current limit
-
-    foc = FOC_Controller(foc_dt, motor, d_gains, q_gains, supply_current_limit)
-    #foc = FOC_CWrapper(foc_dt, motor, d_gains, q_gains, supply_current_limit)
-    foc.reset(motor_sim.velocity[-1], supply_voltage) 
+    motor_sim, foc, pwm = build_simulation(config)
 
-    #
-    pwm_t = []
-    pwm_cmd_a = []
-    pwm_cmd_b = []
-    pwm_cmd_c = []
-
-    if True:
-        cmd_a,cmd_b,cmd_c = foc.update(t, 0.0, motor_sim.position[-1], motor_sim.velocity[-1], 0., 0., 0., supply_voltage)
+    if start is not None:
+        t, (vxa,vxb,vxc), (cmd_a,cmd_b,cmd_c) = restore_state(config, start, motor_sim, foc, pwm)
+    elif True:
+        cmd_a,cmd_b,cmd_c = foc.update(t, 0.0, motor_sim.position, motor_sim.velocity, 0., 0., 0., supply_voltage)
         vxa = supply_voltage*cmd_a
         vxb = supply_voltage*cmd_b
         vxc = supply_voltage*cmd_c
@@ -377,9 +842,6 @@ def sim():
         vxa,vxb,vxc = (0.0, 0.0, 0.0)
         cmd_a,cmd_b,cmd_c = (0.0, 0.0, 0.0)
 
-    motor_sim_substeps = 8
-    motor_sim_dt = pwm_dt/motor_sim_substeps
-    runtime = 150e-3 
     while t < runtime:
         for j in range(foc_update_cycles):
             for i in range(motor_sim_substeps):
@@ -389,197 +851,35 @@ def sim():
             vxa = supply_voltage*cmd_a
             vxb = supply_voltage*cmd_b
             vxc = supply_voltage*cmd_c
-            pwm_t.append(t)
-            pwm_cmd_a.append(cmd_a)
-            pwm_cmd_b.append(cmd_b)
-            pwm_cmd_c.append(cmd_c)
-
-        cmd_a,cmd_b,cmd_c = foc.update(t, target_torque, position+angle_offset, velocity, ia,ib,ic, supply_voltage)
-
-
-    ts = pylab.array(motor_sim.t) * 1e3
-    tc = pylab.array(foc.t) * 1e3
-
-    va = pylab.array(motor_sim.va)
-    vb = pylab.array(motor_sim.vb)    
-    vc = pylab.array(motor_sim.vc)
-    backemf_a = pylab.array(motor_sim.backemf_a)
-    backemf_b = pylab.array(motor_sim.backemf_b)
-    backemf_c = pylab.array(motor_sim.backemf_c)
-    ia = pylab.array(motor_sim.ia)
-    ib = pylab.array(motor_sim.ib)
-    ic = pylab.array(motor_sim.ic)
-    vxa = pylab.array(motor_sim.vxa)
-    vxb = pylab.array(motor_sim.vxb)    
-    vxc = pylab.array(motor_sim.vxc)
-
-    cmd_d = pylab.array(foc.cmd_d)
-    cmd_q = pylab.array(foc.cmd_q)
-    id = pylab.array(foc.measured_id)
-    iq = pylab.array(foc.measured_iq)
-
-    pwm_t = pylab.array(pwm_t) * 1e3
-    pwm_cmd_a = pylab.array(pwm_cmd_a)
-    pwm_cmd_b = pylab.array(pwm_cmd_b)
-    pwm_cmd_c = pylab.array(pwm_cmd_c)
-
-    if True: #FOC stuff
-        pylab.figure("FOC")
-        pylab.subplot(3,1,1)
-        pylab.plot(tc, foc.cmd_a, 'r.-', label='cmd a')
-        pylab.plot(tc, foc.cmd_b, 'g.-', label='cmd b')
-        pylab.plot(tc, foc.cmd_c, 'b.-', label='cmd c')
-
-        pylab.plot(pwm_t, pwm_cmd_a, 'r.--', label='pwm cmd a')
-        pylab.plot(pwm_t, pwm_cmd_b, 'g.--', label='pwm_cmd b')
-        pylab.plot(pwm_t, pwm_cmd_c, 'b.--', label='pwm_cmd c')
-
-        pylab.legend()
-        pylab.title(foc.name)
-        pylab.xlabel('time ms')    
-        pylab.subplot(3,1,2)
-        pylab.plot(tc, 1e3*pylab.array(foc.target_id), 'r', label='target Id (mA)')
-        pylab.plot(tc, 1e3*pylab.array(foc.measured_id), 'g', label='measured Id (mA)')
-        pylab.legend()
-        pylab.xlabel('time ms')    
-        pylab.ylabel('mAmps')
-        pylab.subplot(3,1,3)
-        pylab.plot(tc, foc.target_iq, 'r', label='target Iq')
-        pylab.plot(tc, foc.measured_iq, 'g', label='measured Iq')
-        pylab.legend()
-        pylab.xlabel('time ms')    
-        pylab.ylabel('Amps')    
+            pwm.record(t, cmd_a, cmd_b, cmd_c)
 
-    
-    if False : # PI controllers
-        pylab.figure("PI Controllers")
-        d_ctrl = foc.d_ctrl
-        d_ctrl_t = pylab.array(d_ctrl.t) * 1e3
-        pylab.subplot(2,1,1)
-        pylab.plot(d_ctrl_t, d_ctrl.i_term, 'r', label='d_ctrl : i-term')
-        pylab.plot(d_ctrl_t, d_ctrl.output, 'b', label='d_ctrl : output')
-        pylab.legend()
-        pylab.xlabel('time ms')    
-        q_ctrl = foc.q_ctrl
-        q_ctrl_t = pylab.array(q_ctrl.t) * 1e3
-        pylab.subplot(2,1,2)
-        pylab.plot(q_ctrl_t, q_ctrl.i_term, 'r', label='q_ctrl : i-term')
-        pylab.plot(q_ctrl_t, q_ctrl.output, 'b', label='q_ctrl : output')
-        pylab.plot(tc, foc.cmd_q_filt, 'g', label='cmd_q_filt')
-
-        pylab.legend()
-        pylab.xlabel('time ms')    
-
-    print('peak current', max(ia.max(), ib.max(), ic.max()))
-
-    pylab.figure("Sim Currents, Voltage, and Power")
-    pylab.subplot(3,1,1)
-    pylab.plot(ts, ia, 'r', label='Ia')
-    pylab.plot(ts, ib, 'g', label='Ib')
-    pylab.plot(ts, ic, 'b', label='Ic')
-    pylab.legend()
-    pylab.xlabel('time ms')
-
-    pylab.subplot(3,1,2)
-    pylab.plot(ts, backemf_a, 'r', label='backemf A')
-    pylab.plot(ts, backemf_b, 'g', label='backemf B')
-    pylab.plot(ts, backemf_c, 'b', label='backemf C')
-    pylab.legend()
-
-
-    R = motor.terminal_resistance*0.5
-    rpower = R*(ia*ia+ib*ib+ic*ic)
-
-    # find inductive power by taking delta on inductor stored energy
-    # E = 1/2*L*(I**2)
-    L = motor.terminal_inductance*0.5
-    Lenergy = 0.5*L*(ia*ia+ib*ib+ic*ic)
-    Lpower = pylab.diff(Lenergy)
-    Lpower = pylab.append([0.0],Lpower)/motor_sim_dt
-
-
-    powerA = va*ia
-    powerB = vb*ib
-    powerC = vc*ic
-    elec_power = powerA + powerB + powerC
-
-    powerQD = (id*cmd_d + iq*cmd_q)*supply_voltage / sqrt(2.0)
-
-    torque   = pylab.array(motor_sim.torque)
-    velocity = pylab.array(motor_sim.velocity)
-    mech_power = torque * velocity
+        if trajectory is not None:
+            target_torque, motor_sim.load_torque = trajectory.update(t, position, velocity)
+        if sensors is None:
+            cmd_a,cmd_b,cmd_c = foc.update(t, target_torque, position+angle_offset, velocity, ia,ib,ic, supply_voltage)
+        else:
+            measured_ia, measured_ib, measured_ic = sensors.measure_currents(ia, ib, ic)
+            measured_position = sensors.measure_position(position+angle_offset)
+            cmd_a,cmd_b,cmd_c = foc.update(t, target_torque, measured_position, velocity,
+                                           measured_ia, measured_ib, measured_ic, supply_voltage)
 
-    
-    pylab.subplot(3,1,3)
-    pylab.plot(ts, mech_power, 'r', label='mechanical power')
-    pylab.plot(ts, elec_power, 'g', label='electical power')
-    pylab.plot(tc, powerQD, '0.5', label='QD power')
-    pylab.plot(ts, rpower, 'b', label='heating power')
-    pylab.plot(ts, Lpower, 'c', label='inductive power')
-    pylab.plot(ts, rpower+mech_power+Lpower, 'k--', label='heating + mech + inductive')
-    #pylab.plot(ts, powerA, 'r', label='power A')    
-    #pylab.plot(ts, powerB, 'g', label='power B')    
-    #pylab.plot(ts, powerC, 'b', label='power C')        
-    pylab.legend()
-
-
-    print("power ratio ", (powerQD[-1]/elec_power[-1]))
-
-    pylab.figure("Torque, Velocity, and Position")
-    pylab.subplot(3,1,1)
-    pylab.plot(tc, pylab.array(foc.input_target_torque) * 1e3, 'c', label='input target torque')
-    pylab.plot(tc, pylab.array(foc.target_torque) * 1e3, 'g', label='FOC target torque mNm')
-    pylab.plot(ts, torque * 1e3, 'r--', label='motor sim torque mNm')
-    pylab.plot(tc, pylab.array(foc.measured_torque) * 1e3, 'b', label='FOC measured torque mNm')
-    ylim = pylab.ylim()
-    pylab.plot(tc, pylab.array(foc.torque_limit) * 1e3, 'k--', label='dynamic torque limit mNm')
-    # torque limit can be really large in some cases, don't allow plot to zoom out because of this
-    yrange = ylim[1]-ylim[0]
-    pylab.ylim( (ylim[0]-yrange*0.1, ylim[1]+yrange*0.1)  )
-
-
-    pylab.ylabel("mNm")
-    pylab.legend()
-    pylab.subplot(3,1,2)
-    pylab.plot(ts, velocity*60/(2*pi), 'r', label='velocity (RPM)')
-    pylab.legend()
-    pylab.subplot(3,1,3)
-    pylab.plot(ts, pylab.array(motor_sim.position)*180./pi, 'r', label='position (degrees)')
-    pylab.legend()
-
-
-    # EL Angle offset error estimate
-    if True:
-        pylab.figure("Angle Offset")
-        pylab.subplot(3,1,1)
-        pylab.plot(tc, foc.error_vd, 'r', label='Vd error')
-        pylab.plot(tc, foc.cmd_vd, 'g', label='Vd cmd')
-        pylab.plot(tc, foc.est_vd, 'b', label='Vd est')
-        pylab.legend()
-        pylab.subplot(3,1,2)
-        pylab.plot(tc, foc.backemf_voltage, 'r', label='backemf voltage')
-        pylab.plot(tc, foc.est_vd, 'b', label='Vd est')
-        pylab.legend()
-        pylab.subplot(3,1,3)
-        pylab.plot(tc, pylab.array(foc.est_el_angle_offset)*180/pi, 'r', label='est_angle_offset (degrees)')
-        pylab.plot(tc, pylab.array(foc.el_angle_offset)*180/pi, 'g', label='angle_offset (degrees)')
-        pylab.plot(tc, (el_angle_offset-pylab.array(foc.el_angle_offset))*180/pi, 'k--', label='actual - angle_offset (degrees)')
-        pylab.plot([0,tc[-1]], [el_angle_offset*180/pi, el_angle_offset*180/pi], 'b-*', label='actual el angle offset (degrees)')
-        pylab.legend()
-        print((foc.measured_iq[-1]))
-
-
-    if False:
-        pylab.figure()
-        current_vs_torque = ( ((ia*ia + ib*ib + ic*ic)*0.5)**0.5 ) / torque * motor.torque_constant
-        pylab.plot(ts, current_vs_torque, label="Current/Torque sqrt(Ia^2+Ib^2+Ic^2)/(2*torque)")
-        pylab.legend()
-        print(("Current/Torque sqrt(Ia^2+Ib^2+Ic^2)/(2*torque) : ", current_vs_torque[20:].mean()))
-
-    pylab.show()
+    result = finish_simulation(config, motor_sim, foc, pwm)
+    result.state = save_state(config, t, (vxa,vxb,vxc), (cmd_a,cmd_b,cmd_c), motor_sim, foc)
+    return result
+
+
+def sim():
+    config = SimConfig(runtime=150e-3)
+    #config = SimConfig(runtime=150e-3, controller=FOC_CWrapper)
+    alignmentRatio(config.motor)
+    result = run_simulation(config)
+
+    # plotting is optional, only import matplotlib when it is used
+    import sim_plots
+    sim_plots.plot_result(result)
+    sim_plots.show()
 
 
 
 if __name__ == "__main__":
     sim()
-
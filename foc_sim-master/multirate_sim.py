@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Multi-rate motor and FOC simulation.
+
+run_simulation() in motor_sim_cleaned runs FOC synchronously with PWM, every
+foc_update_cycles PWM cycles.  Real firmware often runs FOC from its own
+timer, samples the ADC and encoder at yet other rates, and all of them have
+some timing jitter.  run_multirate() simulates this by scheduling every task
+separately (see scheduler.py) and advancing the motor model exactly to the
+time of the next event, with steps no longer than config.motor_sim_dt.
+
+Tasks and what they do:
+  pwm : loads latest FOC commands into the inverter (shadow register reload)
+        at start of PWM period
+  adc : samples phase currents
+  encoder : samples rotor position and velocity
+  foc : runs FOC controller on latest samples, commands are used at next PWM reload
+
+With default settings (no separate periods and no jitter) the result matches
+run_simulation() up to floating point rounding of the time steps, for any
+foc_update_cycles (see verify_multirate()).  Event times are counted in whole
+PWM periods, so an FOC update always runs after the PWM reload it coincides
+with and its commands are applied one PWM cycle later, like in run_simulation().
+
+By default the inverter output is the PWM average (supply_voltage * duty) over
+the whole PWM period.  With config.pwm_switching every phase is switched
+between 0 and supply_voltage by a center-aligned PWM : the phase is high for
+duty*pwm_dt in the middle of the period.  The edge times are computed when
+the PWM period starts and the motor integrator steps exactly to every edge,
+so switching ripple is simulated without making the motor time step smaller.
+"""
+
+from math import ceil
+
+from motor_sim_cleaned import SimConfig, build_simulation, finish_simulation, run_simulation
+from scheduler import PeriodicTask, Scheduler
+
+# tasks that fall on the same time run in this order
+PWM_PRIORITY = 0
+SAMPLE_PRIORITY = 1
+FOC_PRIORITY = 2
+
+
+def pwm_edges(t0, period, duties, high_voltage):
+    """ Returns switching edges of one center-aligned PWM period starting at t0.
+    Edges are (time, phase, voltage) tuples in reverse time order (next edge is last),
+    all phases are low at start of period
+    """
+    edges = []
+    center = t0 + 0.5*period
+    for phase, duty in enumerate(duties):
+        duty = min(max(duty, 0.0), 1.0)
+        if duty > 0.0:
+            half = 0.5*duty*period
+            edges.append((center - half, phase, high_voltage))
+            edges.append((center + half, phase, 0.0))
+    edges.sort(reverse=True)
+    return edges
+
+
+class MultiRateSim:
+    """ Simulation state and task callbacks for run_multirate() """
+    def __init__(self, config):
+        self.config = config
+        self.motor_sim, self.foc, self.pwm = build_simulation(config)
+        self.supply_voltage = config.supply_voltage
+        self.target_torque = config.get_target_torque()
+        self.trajectory = config.trajectory
+        self.angle_offset = config.el_angle_offset / config.motor.pole_pairs
+        self.max_dt = config.motor_sim_dt
+        # rk45 chooses its own steps, other integrators are stepped with at most max_dt
+        self.substep = config.integrator != 'rk45'
+        self.t = 0.0
+
+        # latest samples seen by firmware (position includes angle offset of position sensor)
+        self.sensors = config.sensors
+        self.ia = self.ib = self.ic = 0.0
+        self.position = self.motor_sim.position
+        self.velocity = self.motor_sim.velocity
+
+        # FOC commands waiting for next PWM reload, and voltages currently applied to motor
+        self.cmds = self.foc.update(0.0, 0.0, self.position, self.velocity, 0., 0., 0., self.supply_voltage)
+        self.position += self.angle_offset
+        self.switching = config.pwm_switching
+        self.edges = []  # pending switching edges of current PWM period, see pwm_edges()
+        if self.switching:
+            self.vx = [0.0, 0.0, 0.0]
+            self.edges = pwm_edges(0.0, config.pwm_dt, self.cmds, self.supply_voltage)
+        else:
+            self.vx = [self.supply_voltage*cmd for cmd in self.cmds]
+
+        self.sample_adc = config.adc_period is None
+        self.sample_encoder = config.encoder_period is None
+        # PWM period is base tick, so FOC updates every foc_update_cycles fall exactly on a PWM reload
+        scheduler = Scheduler(config.scheduler_seed, tick=config.pwm_dt)
+        scheduler.add(PeriodicTask('pwm', config.pwm_dt, self.pwm_reload, config.pwm_jitter, priority=PWM_PRIORITY))
+        scheduler.add(PeriodicTask('foc', config.foc_dt, self.foc_update, config.foc_jitter, priority=FOC_PRIORITY))
+        if config.adc_period is not None:
+            scheduler.add(PeriodicTask('adc', config.adc_period, self.adc_sample, config.adc_jitter,
+                                       config.adc_phase, priority=SAMPLE_PRIORITY))
+        if config.encoder_period is not None:
+            scheduler.add(PeriodicTask('encoder', config.encoder_period, self.encoder_sample, config.encoder_jitter,
+                                       priority=SAMPLE_PRIORITY))
+        self.scheduler = scheduler
+
+    def advance(self, t_end):
+        """ Integrates motor from current time to t_end, stopping at every PWM switching edge """
+        edges = self.edges
+        while edges and edges[-1][0] < t_end:
+            t_edge, phase, voltage = edges.pop()
+            if t_edge > self.t:
+                self.integrate(t_edge)
+            self.vx[phase] = voltage
+        self.integrate(t_end)
+
+    def integrate(self, t_end):
+        """ Integrates motor from current time to t_end with constant applied voltages """
+        interval = t_end - self.t
+        if interval <= 0.0:
+            return
+        steps = max(1, int(ceil(interval / self.max_dt - 1e-9))) if self.substep else 1
+        dt = interval / steps
+        vxa, vxb, vxc = self.vx
+        update = self.motor_sim.update
+        t = self.t
+        for i in range(steps):
+            update(t, dt, vxa, vxb, vxc)
+            t += dt
+        self.t = t_end
+
+    def pwm_reload(self, t):
+        cmd_a, cmd_b, cmd_c = self.cmds
+        supply_voltage = self.supply_voltage
+        if self.switching:
+            self.vx = [0.0, 0.0, 0.0]
+            self.edges = pwm_edges(t, self.config.pwm_dt, self.cmds, supply_voltage)
+        else:
+            self.vx = [supply_voltage*cmd_a, supply_voltage*cmd_b, supply_voltage*cmd_c]
+        self.pwm.record(t, cmd_a, cmd_b, cmd_c)
+
+    def adc_sample(self, t):
+        motor_sim = self.motor_sim
+        if self.sensors is None:
+            self.ia, self.ib, self.ic = motor_sim.ia, motor_sim.ib, motor_sim.ic
+        else:
+            self.ia, self.ib, self.ic = self.sensors.measure_currents(motor_sim.ia, motor_sim.ib, motor_sim.ic)
+
+    def encoder_sample(self, t):
+        position = self.motor_sim.position + self.angle_offset
+        if self.sensors is not None:
+            position = self.sensors.measure_position(position)
+        self.position = position
+        self.velocity = self.motor_sim.velocity
+
+    def foc_update(self, t):
+        if self.sample_adc:
+            self.adc_sample(t)
+        if self.sample_encoder:
+            self.encoder_sample(t)
+        if self.trajectory is not None:
+            motor_sim = self.motor_sim
+            self.target_torque, motor_sim.load_torque = self.trajectory.update(t, motor_sim.position, motor_sim.velocity)
+        self.cmds = self.foc.update(t, self.target_torque, self.position, self.velocity,
+                                    self.ia, self.ib, self.ic, self.supply_voltage)
+
+    def run(self):
+        self.scheduler.run(self.config.runtime, self.advance)
+        return finish_simulation(self.config, self.motor_sim, self.foc, self.pwm)
+
+
+def run_multirate(config=None):
+    """ Runs multi-rate simulation, returns SimResult """
+    if config is None:
+        config = SimConfig()
+    return MultiRateSim(config).run()
+
+
+def verify_multirate(config=None, foc_update_cycles=(1, 2, 3, 5, 7), tolerance=1e-9):
+    """ Asserts run_multirate() with default task settings matches run_simulation()
+    for every foc_update_cycles value (same trace lengths, fields equal within tolerance
+    relative to largest value of field)
+    """
+    import numpy
+
+    if config is None:
+        config = SimConfig(runtime=30e-3, el_angle_offset=-0.3)
+    for cycles in foc_update_cycles:
+        cycle_config = config.copy(foc_update_cycles=cycles)
+        expected = run_simulation(cycle_config)
+        actual = run_multirate(cycle_config)
+        for name in ("motor", "foc", "pwm"):
+            expected_trace = getattr(expected, name)
+            actual_trace = getattr(actual, name)
+            assert len(expected_trace) == len(actual_trace), \
+                "foc_update_cycles=%d: %s trace length %d != %d" % (cycles, name, len(actual_trace), len(expected_trace))
+            for field in expected_trace.fields:
+                expected_values = expected_trace[field]
+                error = numpy.abs(actual_trace[field] - expected_values).max(initial=0.0)
+                scale = max(1.0, numpy.abs(expected_values).max(initial=0.0))
+                assert error <= tolerance*scale, \
+                    "foc_update_cycles=%d: %s trace field %s differs by %g" % (cycles, name, field, error)
+
+
+if __name__ == "__main__":
+    verify_multirate()
+    print("run_multirate matches run_simulation")
+
+    # FOC running asynchronously at 16kHz with 35kHz PWM, 10kHz encoder and some jitter
+    config = SimConfig(runtime=30e-3, el_angle_offset=-0.3, foc_period=1/16e3, foc_jitter=2e-6,
+                       encoder_period=1/10e3, pwm_jitter=0.2e-6)
+    result = run_multirate(config)
+    print("final Iq %.4f A, target %.4f A" % (result.foc.measured_iq[-1], result.foc.target_iq[-1]))
+    import sim_plots
+    sim_plots.plot_result(result)
+    sim_plots.show()
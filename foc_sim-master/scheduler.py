@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Event scheduler for multi-rate simulation.
+
+Firmware on a real motor controller is made of several periodic tasks
+(PWM reload, ADC sample, encoder read, FOC update) that do not have to run
+at the same rate or in phase.  Instead of stepping everything with a global
+dt that is the least common multiple of all periods, Scheduler keeps a queue
+of the next time every task fires.  Between events the caller advances the
+continuous-time model (the motor) to the next event time, then the task runs.
+
+Every task has its own period, phase and timing jitter.  Event times are
+computed from the nominal schedule (phase + n*period) so jitter does not
+accumulate into drift.  When the scheduler has a base period (tick), tasks
+whose period and phase are whole multiples of it count in integer ticks, so
+events of different tasks that should coincide (e.g. FOC update and PWM
+reload) have exactly equal times and are ordered by priority.
+"""
+
+import heapq
+import random
+
+
+class PeriodicTask:
+    """ Task that fires every period seconds.
+    First event is at phase + period (time 0 is handled by the caller).
+    jitter : each event is delayed by a uniform random time in [0, jitter)
+    priority : tasks with lower priority run first when events fall on the same time
+    """
+    def __init__(self, name, period, callback, jitter=0.0, phase=0.0, priority=0):
+        if period <= 0.0:
+            raise ValueError("task %r period must be positive" % name)
+        if not 0.0 <= jitter < period:
+            raise ValueError("task %r jitter must be smaller than its period" % name)
+        self.name = name
+        self.period = period
+        self.callback = callback
+        self.jitter = jitter
+        self.phase = phase
+        self.priority = priority
+        self.cycle = 0  # number of times task has run
+        # period and phase in whole ticks of scheduler base period, see use_tick()
+        self.tick = None
+        self.period_ticks = self.phase_ticks = 0
+
+    def use_tick(self, tick):
+        """ Counts event times in integer multiples of tick if period and phase are whole multiples of it """
+        period_ticks = int(round(self.period / tick))
+        phase_ticks = int(round(self.phase / tick))
+        if (period_ticks >= 1 and abs(period_ticks*tick - self.period) <= 1e-9*self.period
+                and abs(phase_ticks*tick - self.phase) <= 1e-9*tick):
+            self.tick = tick
+            self.period_ticks = period_ticks
+            self.phase_ticks = phase_ticks
+
+    def event_time(self, rng):
+        """ Returns time of next event """
+        if self.tick is not None:
+            t = (self.phase_ticks + (self.cycle + 1) * self.period_ticks) * self.tick
+        else:
+            t = self.phase + (self.cycle + 1) * self.period
+        if self.jitter > 0.0:
+            t += rng.uniform(0.0, self.jitter)
+        return t
+
+
+class Scheduler:
+    """ Runs PeriodicTasks in time order.
+    seed makes jitter repeatable between runs
+    tick : optional base period, tasks that are multiples of it get exactly coincident event times
+    """
+    def __init__(self, seed=None, tick=None):
+        self.random = random.Random(seed)
+        self.tick = tick
+        self.queue = []
+        self.order = 0  # keeps tasks with equal time and priority in insertion order
+        self.t = 0.0
+
+    def add(self, task):
+        if self.tick is not None:
+            task.use_tick(self.tick)
+        self.push(task)
+        return task
+
+    def push(self, task):
+        heapq.heappush(self.queue, (task.event_time(self.random), task.priority, self.order, task))
+        self.order += 1
+
+    def next_time(self):
+        """ Returns time of next event, None if there are no tasks """
+        return self.queue[0][0] if self.queue else None
+
+    def run(self, until, advance):
+        """ Runs all events with time <= until.
+        advance(t) is called before every event to bring model up to event time t,
+        then task.callback(t) is called
+        """
+        queue = self.queue
+        while queue and queue[0][0] <= until:
+            t, priority, order, task = heapq.heappop(queue)
+            if t > self.t:
+                advance(t)
+                self.t = t
+            task.callback(t)
+            task.cycle += 1
+            self.push(task)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Measurement non-idealities for phase current and rotor position sensing.
+
+By default the FOC controller is given the exact simulated phase currents
+and rotor position.  A MeasurementPipeline puts a chain of stages between
+the motor and the controller, each stage models one sensor imperfection:
+  GainOffset : per-channel gain and offset error
+  WhiteNoise : gaussian noise
+  Quantize : ADC resolution and full scale clipping
+  EncoderResolution : encoder counts per revolution
+  SampleDelay : measurement delayed by a number of samples
+
+Stages run once per sample on plain Python floats, which is much cheaper
+than calling NumPy for every sample.  Random numbers are the expensive part,
+so WhiteNoise draws them with NumPy in blocks of many samples at once.
+
+Example:
+  sensors = MeasurementPipeline(current=[GainOffset(1.01, 0.005), WhiteNoise(0.005), Quantize(4.0/4096, 2.0)],
+                                position=[EncoderResolution(4096)], seed=1)
+  result = run_simulation(SimConfig(sensors=sensors))
+"""
+
+import math
+from collections import deque
+import numpy
+
+
+def per_channel(value, channels):
+    """ Returns value as list with one entry per channel """
+    if numpy.ndim(value) == 0:
+        return [float(value)] * channels
+    values = [float(v) for v in value]
+    if len(values) != channels:
+        raise ValueError("expected %d channel values, got %d" % (channels, len(values)))
+    return values
+
+
+class Stage:
+    """ Base class of measurement stages.
+    reset() is called before every simulation with number of channels and random generator,
+    calling stage with list of channel values returns list of measured values
+    """
+    def reset(self, channels, rng):
+        pass
+
+    def __call__(self, values):
+        return values
+
+
+class GainOffset(Stage):
+    """ measured = value * gain + offset, gain and offset can be scalars or per-channel sequences """
+    def __init__(self, gain=1.0, offset=0.0):
+        self.gain = gain
+        self.offset = offset
+
+    def reset(self, channels, rng):
+        self.gains = per_channel(self.gain, channels)
+        self.offsets = per_channel(self.offset, channels)
+
+    def __call__(self, values):
+        return [v*g + o for v, g, o in zip(values, self.gains, self.offsets)]
+
+
+class WhiteNoise(Stage):
+    """ Adds gaussian noise with standard deviation std (scalar or per-channel) """
+    def __init__(self, std, block=4096):
+        self.std = std
+        self.block = block
+
+    def reset(self, channels, rng):
+        self.rng = rng
+        self.stds = numpy.array(per_channel(self.std, channels))
+        self.noise = []
+        self.index = 0
+
+    def __call__(self, values):
+        if self.index >= len(self.noise):
+            self.noise = (self.rng.standard_normal((self.block, len(self.stds))) * self.stds).tolist()
+            self.index = 0
+        noise = self.noise[self.index]
+        self.index += 1
+        return [v + n for v, n in zip(values, noise)]
+
+
+class Quantize(Stage):
+    """ ADC quantization, rounds to nearest multiple of lsb and clips to +/- full_scale """
+    def __init__(self, lsb, full_scale=None):
+        self.lsb = float(lsb)
+        self.full_scale = full_scale
+
+    def __call__(self, values):
+        lsb = self.lsb
+        values = [round(v / lsb) * lsb for v in values]
+        full_scale = self.full_scale
+        if full_scale is not None:
+            values = [min(max(v, -full_scale), full_scale) for v in values]
+        return values
+
+    @classmethod
+    def adc(cls, bits, full_scale):
+        """ Returns quantizer of bipolar ADC with given number of bits covering +/- full_scale """
+        return cls(2.0*full_scale / 2**bits, full_scale)
+
+
+class EncoderResolution(Stage):
+    """ Incremental encoder, angle (radians) is truncated to whole encoder counts """
+    def __init__(self, counts_per_rev):
+        self.step = 2*math.pi / counts_per_rev
+
+    def __call__(self, values):
+        step = self.step
+        return [math.floor(v / step) * step for v in values]
+
+
+class SampleDelay(Stage):
+    """ Delays measurement by given number of samples.
+    Until enough samples have been seen, first sample is repeated
+    """
+    def __init__(self, samples):
+        self.samples = int(samples)
+
+    def reset(self, channels, rng):
+        self.buffer = deque()
+
+    def __call__(self, values):
+        buffer = self.buffer
+        if not buffer:
+            buffer.extend([values] * self.samples)
+        buffer.append(values)
+        return buffer.popleft()
+
+
+class MeasurementPipeline:
+    """ Chains of stages applied to phase currents (3 channels) and rotor position (1 channel).
+    seed makes noise repeatable, every reset() starts same random sequence again
+    """
+    def __init__(self, current=(), position=(), seed=None):
+        self.current = list(current)
+        self.position = list(position)
+        self.seed = seed
+
+    def reset(self):
+        rng = numpy.random.default_rng(self.seed)
+        for stage in self.current:
+            stage.reset(3, rng)
+        for stage in self.position:
+            stage.reset(1, rng)
+
+    def measure_currents(self, ia, ib, ic):
+        values = [ia, ib, ic]
+        for stage in self.current:
+            values = stage(values)
+        return values
+
+    def measure_position(self, position):
+        values = [position]
+        for stage in self.position:
+            values = stage(values)
+        return values[0]
+
+
+def typical_sensors(adc_bits=12, current_full_scale=2.0, gain_error=0.01, offset_error=0.005,
+                    current_noise=0.005, encoder_counts=4096, delay=0, seed=None):
+    """ Returns pipeline with typical shunt/ADC current sensing and incremental encoder.
+    Gain and offset errors are applied with opposite signs on phases so they don't cancel out
+    """
+    current = [GainOffset((1.0 + gain_error, 1.0 - gain_error, 1.0),
+                          (offset_error, -offset_error, 0.0)),
+               WhiteNoise(current_noise),
+               Quantize.adc(adc_bits, current_full_scale)]
+    position = [EncoderResolution(encoder_counts)]
+    if delay:
+        current.append(SampleDelay(delay))
+        position.append(SampleDelay(delay))
+    return MeasurementPipeline(current, position, seed)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Plotting functions for motor and FOC simulation results.
+
+This module is the only part of the simulator that imports matplotlib,
+so batch runs that only call run_simulation() never touch a GUI backend.
+
+Long simulations record millions of motor samples, far more than a figure has
+pixels.  Lines are drawn with lod_plot(), which only gives matplotlib the min/max
+envelope of the samples in every pixel column of the visible time range.  When
+the x-axis limits change (zoom or pan) the envelope is recomputed from the full
+trace, so zooming in shows every sample once there are few enough of them.
+"""
+
+from math import pi, sqrt
+import weakref
+import numpy
+import pylab
+
+
+# min/max envelope samples per pixel column of axes
+LOD_POINTS_PER_PIXEL = 2
+# smallest number of envelope bins, used before axes has a size
+LOD_MIN_BINS = 500
+
+# axes -> list of (line, x, y) drawn with lod_plot()
+lod_lines = weakref.WeakKeyDictionary()
+
+
+def show():
+    pylab.show()
+
+
+def envelope(x, y, x_min, x_max, bins):
+    """ Returns (x, y) samples that keep min and max of y in each of bins bins of
+    samples where x_min <= x <= x_max (x must be increasing).  One sample outside
+    range is kept on each side so lines continue to the edge of the axes
+    """
+    start = max(numpy.searchsorted(x, x_min, side='left') - 1, 0)
+    stop = min(numpy.searchsorted(x, x_max, side='right') + 1, len(x))
+    count = stop - start
+    if count <= bins * 2:
+        return x[start:stop], y[start:stop]
+    per_bin = -(-count // bins)
+    full = count // per_bin * per_bin
+    rows = y[start:start+full].reshape(-1, per_bin)
+    offsets = start + per_bin * numpy.arange(len(rows))
+    lo = offsets + rows.argmin(axis=1)
+    hi = offsets + rows.argmax(axis=1)
+    # keep min and max of every bin in time order, and first / last sample of range
+    idx = numpy.concatenate(([start], numpy.minimum(lo, hi), numpy.maximum(lo, hi),
+                             numpy.arange(start + full, stop), [stop - 1]))
+    idx = numpy.unique(idx)
+    return x[idx], y[idx]
+
+
+def lod_bins(ax):
+    return max(int(ax.bbox.width) * LOD_POINTS_PER_PIXEL // 2, LOD_MIN_BINS)
+
+
+def update_lod(ax):
+    """ Recomputes envelopes of lod_plot() lines for current x-axis limits of ax """
+    x_min, x_max = ax.get_xlim()
+    bins = lod_bins(ax)
+    for line, x, y in lod_lines.get(ax, ()):
+        line.set_data(*envelope(x, y, x_min, x_max, bins))
+
+
+def lod_plot(x, y, *args, **kwargs):
+    """ Same as pylab.plot(x, y, ...) for a single line, but only draws envelope of
+    samples in visible range, which is updated when x-axis limits change
+    """
+    ax = pylab.gca()
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    lines = ax.plot(*(envelope(x, y, -numpy.inf, numpy.inf, lod_bins(ax)) + args), **kwargs)
+    if ax not in lod_lines:
+        lod_lines[ax] = []
+        ax.callbacks.connect('xlim_changed', update_lod)
+    lod_lines[ax].extend((line, x, y) for line in lines)
+    return lines
+
+
+def plot_result(result, foc_plots=True, pi_controllers=False, angle_offset=True, current_per_torque=False,
+                time_window=None, lod=True):
+    """ Creates standard set of figures for SimResult from motor_sim_cleaned.run_simulation().
+    Keyword arguments enable or disable optional figures.
+    time_window=(t_start, t_end) in seconds only plots that part of simulation,
+    for streamed traces only samples inside window are read from disk.  Window can be
+    shorter than one FOC period, but must contain at least 2 motor samples (else ValueError)
+    lod=False draws every sample instead of zoom dependent min/max envelope
+    Traces that are None in result (pwm, d_ctrl, q_ctrl, trajectory) are left out of their figures
+    """
+    plot = lod_plot if lod else pylab.plot
+    if time_window is not None:
+        result = result.window(*time_window)
+        if len(result.motor) < 2:
+            raise ValueError("time_window contains fewer than 2 samples")
+    config = result.config
+    motor = config.motor
+    supply_voltage = config.supply_voltage
+    el_angle_offset = config.el_angle_offset
+
+    # traces are numpy arrays, no conversion needed for plotting
+    motor_trace = result.motor
+    foc_trace = result.foc
+    pwm = result.pwm
+    ts = motor_trace.t * 1e3
+    tc = foc_trace.t * 1e3
+
+    va = motor_trace.va
+    vb = motor_trace.vb
+    vc = motor_trace.vc
+    backemf_a = motor_trace.backemf_a
+    backemf_b = motor_trace.backemf_b
+    backemf_c = motor_trace.backemf_c
+    ia = motor_trace.ia
+    ib = motor_trace.ib
+    ic = motor_trace.ic
+    vxa = motor_trace.vxa
+    vxb = motor_trace.vxb
+    vxc = motor_trace.vxc
+
+    cmd_d = foc_trace.cmd_d
+    cmd_q = foc_trace.cmd_q
+    id = foc_trace.measured_id
+    iq = foc_trace.measured_iq
+
+    if foc_plots: #FOC stuff
+        pylab.figure("FOC")
+        pylab.subplot(3,1,1)
+        plot(tc, foc_trace.cmd_a, 'r.-', label='cmd a')
+        plot(tc, foc_trace.cmd_b, 'g.-', label='cmd b')
+        plot(tc, foc_trace.cmd_c, 'b.-', label='cmd c')
+
+        # fused kernel and native loop do not record PWM commands
+        if pwm is not None:
+            pwm_t = pwm.t * 1e3
+            plot(pwm_t, pwm.cmd_a, 'r.--', label='pwm cmd a')
+            plot(pwm_t, pwm.cmd_b, 'g.--', label='pwm_cmd b')
+            plot(pwm_t, pwm.cmd_c, 'b.--', label='pwm_cmd c')
+
+        pylab.legend()
+        pylab.title(result.name)
+        pylab.xlabel('time ms')    
+        pylab.subplot(3,1,2)
+        plot(tc, 1e3*foc_trace.target_id, 'r', label='target Id (mA)')
+        plot(tc, 1e3*foc_trace.measured_id, 'g', label='measured Id (mA)')
+        pylab.legend()
+        pylab.xlabel('time ms')    
+        pylab.ylabel('mAmps')
+        pylab.subplot(3,1,3)
+        plot(tc, foc_trace.target_iq, 'r', label='target Iq')
+        plot(tc, foc_trace.measured_iq, 'g', label='measured Iq')
+        pylab.legend()
+        pylab.xlabel('time ms')    
+        pylab.ylabel('Amps')    
+
+    
+    if pi_controllers and result.d_ctrl is not None: # PI controllers
+        pylab.figure("PI Controllers")
+        d_ctrl = result.d_ctrl
+        d_ctrl_t = d_ctrl.t * 1e3
+        pylab.subplot(2,1,1)
+        plot(d_ctrl_t, d_ctrl.i_term, 'r', label='d_ctrl : i-term')
+        plot(d_ctrl_t, d_ctrl.output, 'b', label='d_ctrl : output')
+        pylab.legend()
+        pylab.xlabel('time ms')    
+        q_ctrl = result.q_ctrl
+        q_ctrl_t = q_ctrl.t * 1e3
+        pylab.subplot(2,1,2)
+        plot(q_ctrl_t, q_ctrl.i_term, 'r', label='q_ctrl : i-term')
+        plot(q_ctrl_t, q_ctrl.output, 'b', label='q_ctrl : output')
+        plot(tc, foc_trace.cmd_q_filt, 'g', label='cmd_q_filt')
+
+        pylab.legend()
+        pylab.xlabel('time ms')    
+
+    print('peak current', max(ia.max(), ib.max(), ic.max()))
+
+    pylab.figure("Sim Currents, Voltage, and Power")
+    pylab.subplot(3,1,1)
+    plot(ts, ia, 'r', label='Ia')
+    plot(ts, ib, 'g', label='Ib')
+    plot(ts, ic, 'b', label='Ic')
+    pylab.legend()
+    pylab.xlabel('time ms')
+
+    pylab.subplot(3,1,2)
+    plot(ts, backemf_a, 'r', label='backemf A')
+    plot(ts, backemf_b, 'g', label='backemf B')
+    plot(ts, backemf_c, 'b', label='backemf C')
+    pylab.legend()
+
+
+    R = motor.terminal_resistance*0.5
+    rpower = R*(ia*ia+ib*ib+ic*ic)
+
+    # find inductive power by taking delta on inductor stored energy
+    # E = 1/2*L*(I**2)
+    L = motor.terminal_inductance*0.5
+    Lenergy = 0.5*L*(ia*ia+ib*ib+ic*ic)
+    # each recorded sample is labeled with time at start of step that produced it,
+    # so duration of step is time difference to next sample (rk45 steps are not uniform)
+    step_dt = pylab.diff(motor_trace.t)
+    step_dt = pylab.append(step_dt[1:], step_dt[-1])
+    Lpower = pylab.diff(Lenergy)/step_dt
+    Lpower = pylab.append([0.0],Lpower)
+
+
+    powerA = va*ia
+    powerB = vb*ib
+    powerC = vc*ic
+    elec_power = powerA + powerB + powerC
+
+    powerQD = (id*cmd_d + iq*cmd_q)*supply_voltage / sqrt(2.0)
+
+    torque   = motor_trace.torque
+    velocity = motor_trace.velocity
+    mech_power = torque * velocity
+
+    
+    pylab.subplot(3,1,3)
+    plot(ts, mech_power, 'r', label='mechanical power')
+    plot(ts, elec_power, 'g', label='electical power')
+    plot(tc, powerQD, '0.5', label='QD power')
+    plot(ts, rpower, 'b', label='heating power')
+    plot(ts, Lpower, 'c', label='inductive power')
+    plot(ts, rpower+mech_power+Lpower, 'k--', label='heating + mech + inductive')
+    #plot(ts, powerA, 'r', label='power A')    
+    #plot(ts, powerB, 'g', label='power B')    
+    #plot(ts, powerC, 'b', label='power C')        
+    pylab.legend()
+
+
+    # window shorter than one FOC period has no FOC samples
+    if len(powerQD):
+        print("power ratio ", (powerQD[-1]/elec_power[-1]))
+
+    pylab.figure("Torque, Velocity, and Position")
+    pylab.subplot(3,1,1)
+    plot(tc, foc_trace.input_target_torque * 1e3, 'c', label='input target torque')
+    plot(tc, foc_trace.target_torque * 1e3, 'g', label='FOC target torque mNm')
+    plot(ts, torque * 1e3, 'r--', label='motor sim torque mNm')
+    plot(tc, foc_trace.measured_torque * 1e3, 'b', label='FOC measured torque mNm')
+    ylim = pylab.ylim()
+    plot(tc, foc_trace.torque_limit * 1e3, 'k--', label='dynamic torque limit mNm')
+    # torque limit can be really large in some cases, don't allow plot to zoom out because of this
+    yrange = ylim[1]-ylim[0]
+    pylab.ylim( (ylim[0]-yrange*0.1, ylim[1]+yrange*0.1)  )
+    trajectory = result.trajectory
+    if trajectory is not None:
+        tt = trajectory.t * 1e3
+        plot(tt, trajectory.load_torque * 1e3, 'm', label='load torque mNm')
+
+    pylab.ylabel("mNm")
+    pylab.legend()
+    pylab.subplot(3,1,2)
+    plot(ts, velocity*60/(2*pi), 'r', label='velocity (RPM)')
+    if trajectory is not None and config.trajectory.mode != 'torque':
+        plot(tt, trajectory.velocity_setpoint*60/(2*pi), 'k--', label='velocity setpoint (RPM)')
+    pylab.legend()
+    pylab.subplot(3,1,3)
+    plot(ts, motor_trace.position*180./pi, 'r', label='position (degrees)')
+    if trajectory is not None and config.trajectory.mode == 'position':
+        plot(tt, trajectory.setpoint*180./pi, 'k--', label='position setpoint (degrees)')
+    pylab.legend()
+
+
+    # EL Angle offset error estimate
+    if angle_offset:
+        pylab.figure("Angle Offset")
+        pylab.subplot(3,1,1)
+        plot(tc, foc_trace.error_vd, 'r', label='Vd error')
+        plot(tc, foc_trace.cmd_vd, 'g', label='Vd cmd')
+        plot(tc, foc_trace.est_vd, 'b', label='Vd est')
+        pylab.legend()
+        pylab.subplot(3,1,2)
+        plot(tc, foc_trace.backemf_voltage, 'r', label='backemf voltage')
+        plot(tc, foc_trace.est_vd, 'b', label='Vd est')
+        pylab.legend()
+        pylab.subplot(3,1,3)
+        plot(tc, foc_trace.est_el_angle_offset*180/pi, 'r', label='est_angle_offset (degrees)')
+        plot(tc, foc_trace.el_angle_offset*180/pi, 'g', label='angle_offset (degrees)')
+        plot(tc, (el_angle_offset-foc_trace.el_angle_offset)*180/pi, 'k--', label='actual - angle_offset (degrees)')
+        if len(tc):
+            plot([tc[0],tc[-1]], [el_angle_offset*180/pi, el_angle_offset*180/pi], 'b-*', label='actual el angle offset (degrees)')
+        pylab.legend()
+        if len(iq):
+            print((iq[-1]))
+
+
+    if current_per_torque:
+        pylab.figure()
+        current_vs_torque = ( ((ia*ia + ib*ib + ic*ic)*0.5)**0.5 ) / torque * motor.torque_constant
+        plot(ts, current_vs_torque, label="Current/Torque sqrt(Ia^2+Ib^2+Ic^2)/(2*torque)")
+        pylab.legend()
+        if len(current_vs_torque) > 20:
+            print(("Current/Torque sqrt(Ia^2+Ib^2+Ic^2)/(2*torque) : ", current_vs_torque[20:].mean()))
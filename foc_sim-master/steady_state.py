@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Steady-state operating points of motor and FOC controller.
+
+At constant rotor speed the motor model and the FOC controller look the same
+from every rotor angle : rotating all currents, voltages and commands by an
+electrical angle gives the same solution rotated by that angle.  Written in
+the rotor d/q frame, the simulation is therefore a time-invariant map from
+the state at one FOC update to the state at the next one,
+    x[k+1] = F(x[k])
+and the periodic steady state seen in the phase currents is a fixed point
+x = F(x) in the rotor frame.  F is one FOC period of the batch simulator
+(batch_sim.py, Euler motor model) with the rotor held at constant speed like
+on a dynamometer (infinite load inertia).
+
+solve_steady_state() finds the fixed point with Newton's method (shooting over
+one FOC period).  The Jacobian comes from finite differences, and all
+operating points and all perturbed states are simulated as one NumPy batch,
+so a full speed x torque map costs a few hundred FOC periods of batch
+simulation instead of a transient simulation for every point.  A fixed point
+is only reached by a time simulation if it is stable, which is reported with
+the spectral radius of the Jacobian (stable if < 1).
+
+efficiency_map() fills tables of torque, power, efficiency, etc.. over a grid
+of speeds and target torques.  Run this file to compare the solver with
+brute-force integration and build an example map:
+  ./steady_state.py --speeds 0:450:10 --torques 0.005:0.05:10 -o map.csv
+"""
+
+import math
+import os
+import numpy
+from numpy import sin, cos, sqrt, pi
+
+from batch_sim import BatchMotorSim, BatchFOC_Controller
+from motor_sim_cleaned import SimConfig
+
+# rotor frame state x at a FOC update, right after controller has run :
+#   id, iq : motor phase currents
+#   vx_d, vx_q : voltage applied to motor during next PWM cycle
+#   cmd_d_next, cmd_q_next : controller command waiting to be applied (1 cycle delay)
+#   d_i_term, q_i_term, cmd_d, cmd_q_filt, el_angle_offset : FOC_Controller state
+STATE_FIELDS = ('id', 'iq', 'vx_d', 'vx_q', 'cmd_d_next', 'cmd_q_next',
+                'd_i_term', 'q_i_term', 'cmd_d', 'cmd_q_filt', 'el_angle_offset')
+OFFSET_STATE = STATE_FIELDS.index('el_angle_offset')
+
+RESULT_FIELDS = ('velocity', 'input_target_torque', 'target_torque', 'torque', 'shaft_torque',
+                 'measured_id', 'measured_iq', 'cmd_d', 'cmd_q', 'phase_current_rms',
+                 'elec_power', 'mech_power', 'heating_power', 'qd_power', 'efficiency', 'qd_power_ratio',
+                 'current_per_torque', 'el_angle_offset', 'voltage_limited',
+                 'converged', 'iterations', 'residual', 'spectral_radius', 'stable')
+
+S30 = 0.5  # sin(30)
+C30 = 0.8660254037844387 # cos(30)
+SQRT2D3 = 0.816496580927726 # sqrt(2/3)
+
+
+def clarke(a, b, c):
+    """ Returns (alpha, beta) of 3-phase values, same scaling as FOC_Controller """
+    return SQRT2D3 * (a - S30*b - S30*c), SQRT2D3 * (C30*b - C30*c)
+
+
+def inverse_clarke(alpha, beta):
+    """ Returns 3-phase values (without common mode) of (alpha, beta) """
+    return (SQRT2D3 * alpha,
+            SQRT2D3 * (-S30*alpha + C30*beta),
+            SQRT2D3 * (-S30*alpha - C30*beta))
+
+
+def rotate(alpha, beta, angle):
+    """ Park transform, returns (d, q) of stationary frame vector for rotor at electrical angle """
+    s = sin(angle)
+    c = cos(angle)
+    return c*alpha + s*beta, -s*alpha + c*beta
+
+
+class PeriodMap:
+    """ One FOC period of batch simulation at constant speed, in rotor d/q frame.
+    velocity and target_torque are arrays of shape (N,), one entry per operating point.
+    Only Euler motor model and FOC_Controller are supported (see batch_sim.py)
+    """
+    def __init__(self, config, velocity, target_torque):
+        if config.is_multirate():
+            raise ValueError("steady state solver does not support multi-rate settings")
+        self.config = config
+        self.motor = motor = config.motor
+        self.velocity = numpy.asarray(velocity, dtype=float)
+        self.target_torque = numpy.asarray(target_torque, dtype=float)
+        count = len(self.velocity)
+        self.count = count
+        self.angle_offset = config.el_angle_offset / motor.pole_pairs
+        self.motor_sim = BatchMotorSim(motor, numpy.inf, count, trace_options=dict(capacity=1, decimation=0))
+        # only last controller update is kept, measure() reads it
+        self.foc = BatchFOC_Controller(config.foc_dt, motor, config.d_gains, config.q_gains,
+                                       config.supply_current_limit, count, dict(capacity=1, ring=True))
+        # backemf of Euler model lags by one step, it follows from speed alone
+        self.lag_angle = -self.velocity * config.motor_sim_dt * motor.pole_pairs
+
+    def initial_state(self):
+        """ Returns state of controller started with FOC_Controller.reset() at operating point speed """
+        x = numpy.zeros((self.count, len(STATE_FIELDS)))
+        x[:, STATE_FIELDS.index('q_i_term')] = \
+            -self.velocity * self.motor.torque_constant / self.config.supply_voltage * pi/3.0
+        return x
+
+    def __call__(self, x, totals=None):
+        """ Returns state after one FOC period for states x (N x len(STATE_FIELDS)).
+        If totals is a dict, sums of (torque, elec_power, heating_power, current_squared)
+        over motor steps are stored in it
+        """
+        config = self.config
+        motor = self.motor
+        motor_sim = self.motor_sim
+        foc = self.foc
+        supply_voltage = config.supply_voltage
+        dt = config.motor_sim_dt
+        R = motor.phase_resistance
+        torque_constant = motor.phase_torque_constant
+
+        # every period starts at rotor angle 0, rotor frame == stationary frame
+        x = numpy.asarray(x, dtype=float)
+        ia, ib, ic = inverse_clarke(x[:, 0], x[:, 1])
+        vxa, vxb, vxc = inverse_clarke(x[:, 2], x[:, 3])
+        cmd_a, cmd_b, cmd_c = inverse_clarke(x[:, 4], x[:, 5])
+        velocity = self.velocity
+        motor_sim.ia, motor_sim.ib, motor_sim.ic = ia, ib, ic
+        motor_sim.velocity = velocity.copy()
+        motor_sim.position = numpy.zeros(self.count)
+        backemf = velocity * torque_constant
+        motor_sim.backemf_a = sin(self.lag_angle) * backemf
+        motor_sim.backemf_b = sin(self.lag_angle - pi*2/3) * backemf
+        motor_sim.backemf_c = sin(self.lag_angle + pi*2/3) * backemf
+        foc.d_ctrl.i_term = x[:, 6].copy()
+        foc.q_ctrl.i_term = x[:, 7].copy()
+        foc.cmd_d = x[:, 8].copy()
+        foc.cmd_q_filt = x[:, 9].copy()
+        foc.el_angle_offset = x[:, 10].copy()
+
+        if totals is not None:
+            for name in ('torque', 'elec_power', 'heating_power', 'current_squared', 'steps'):
+                totals[name] = 0.0
+        t = 0.0
+        for j in range(config.foc_update_cycles):
+            for i in range(config.motor_sim_substeps):
+                position, velocity, ia, ib, ic = motor_sim.update(t, dt, vxa, vxb, vxc)
+                t += dt
+                if totals is not None:
+                    vcenter = (vxa + vxb + vxc) / 3.0
+                    current_squared = ia*ia + ib*ib + ic*ic
+                    el_angle = (position - velocity*dt) * motor.pole_pairs
+                    totals['torque'] += (ia*sin(el_angle) + ib*sin(el_angle - pi*2/3)
+                                         + ic*sin(el_angle + pi*2/3)) * torque_constant
+                    totals['elec_power'] += (vxa-vcenter)*ia + (vxb-vcenter)*ib + (vxc-vcenter)*ic
+                    totals['heating_power'] += R * current_squared
+                    totals['current_squared'] += current_squared
+                    totals['steps'] += 1
+            vxa = supply_voltage*cmd_a
+            vxb = supply_voltage*cmd_b
+            vxc = supply_voltage*cmd_c
+        cmd_a, cmd_b, cmd_c = foc.update(t, self.target_torque, position + self.angle_offset, velocity,
+                                         ia, ib, ic, supply_voltage)
+
+        # back to rotor frame at new rotor angle
+        el_angle = position * motor.pole_pairs
+        result = numpy.empty_like(x)
+        result[:, 0], result[:, 1] = rotate(*clarke(ia, ib, ic), angle=el_angle)
+        result[:, 2], result[:, 3] = rotate(*clarke(vxa, vxb, vxc), angle=el_angle)
+        result[:, 4], result[:, 5] = rotate(*clarke(cmd_a, cmd_b, cmd_c), angle=el_angle)
+        result[:, 6] = foc.d_ctrl.i_term
+        result[:, 7] = foc.q_ctrl.i_term
+        result[:, 8] = foc.cmd_d
+        result[:, 9] = foc.cmd_q_filt
+        result[:, 10] = foc.el_angle_offset
+        return result
+
+    def estimating_offset(self):
+        """ True for operating points where controller updates its angle offset estimate """
+        return abs(self.velocity * self.motor.torque_constant) > 1.0
+
+    def measure(self, x):
+        """ Returns dict of RESULT_FIELDS (arrays of shape (N,)) averaged over one period from state x """
+        config = self.config
+        motor = self.motor
+        totals = {}
+        self(x, totals)
+        foc_trace = self.foc.trace
+        steps = totals['steps']
+        velocity = self.velocity
+        torque = totals['torque'] / steps
+        shaft_torque = torque - velocity*motor.friction
+        elec_power = totals['elec_power'] / steps
+        mech_power = shaft_torque * velocity
+        measured_id = foc_trace.last('measured_id')
+        measured_iq = foc_trace.last('measured_iq')
+        cmd_d = foc_trace.last('cmd_d')
+        cmd_q = foc_trace.last('cmd_q')
+        qd_power = (measured_id*cmd_d + measured_iq*cmd_q)*config.supply_voltage / sqrt(2.0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            # motoring : shaft power out / electrical power in,  generating : the other way around
+            efficiency = numpy.where((elec_power > 0.0) & (mech_power > 0.0), mech_power / elec_power,
+                                     numpy.where((elec_power < 0.0) & (mech_power < 0.0), elec_power / mech_power,
+                                                 numpy.nan))
+            qd_power_ratio = qd_power / elec_power
+            phase_current_rms = sqrt(totals['current_squared'] / steps / 3.0)
+            current_per_torque = phase_current_rms / torque
+        return dict(velocity=velocity, input_target_torque=self.target_torque,
+                    target_torque=foc_trace.last('target_torque'), torque=torque, shaft_torque=shaft_torque,
+                    measured_id=measured_id, measured_iq=measured_iq, cmd_d=cmd_d, cmd_q=cmd_q,
+                    phase_current_rms=phase_current_rms,
+                    elec_power=elec_power, mech_power=mech_power, heating_power=totals['heating_power'] / steps,
+                    qd_power=qd_power, efficiency=efficiency, qd_power_ratio=qd_power_ratio,
+                    current_per_torque=current_per_torque, el_angle_offset=x[:, OFFSET_STATE],
+                    voltage_limited=(cmd_d*cmd_d + cmd_q*cmd_q > 1.0 - 1e-9).astype(float))
+
+
+def jacobian(config, velocity, target_torque, x, fx=None):
+    """ Returns finite difference Jacobian dF/dx (N x n x n, [point, output, input]) and F(x) """
+    count, n = x.shape
+    h = 1e-7 * (1.0 + abs(x))
+    # point p, perturbation j is row p*(n+1) + j, perturbation 0 is unperturbed state
+    batch = numpy.repeat(x[:, None, :], n + 1, axis=1)
+    batch[:, 1:, :] += h[:, :, None] * numpy.eye(n)
+    period_map = PeriodMap(config, numpy.repeat(velocity, n + 1), numpy.repeat(target_torque, n + 1))
+    result = period_map(batch.reshape(-1, n)).reshape(count, n + 1, n)
+    fx = result[:, 0, :]
+    jac = (result[:, 1:, :] - fx[:, None, :]) / h[:, :, None]
+    return jac.transpose(0, 2, 1), fx
+
+
+def solve_steady_state(config=None, velocity=0.0, target_torque=None, warmup_periods=50,
+                       tolerance=1e-10, max_iterations=20):
+    """ Finds steady state of FOC controlled motor held at constant velocity (rad/s).
+    velocity and target_torque (None = config target torque) are scalars or arrays, one entry per
+    operating point.  Motor, gains, supply voltage, time steps etc.. come from config.
+    warmup_periods FOC periods are simulated from controller reset to get close before Newton iteration,
+    iteration stops when change of state is below tolerance (relative to 1 + |state|).
+    Returns dict of RESULT_FIELDS with arrays of shape (N,)
+    """
+    if config is None:
+        config = SimConfig()
+    if target_torque is None:
+        target_torque = config.get_target_torque()
+    velocity, target_torque = numpy.broadcast_arrays(numpy.asarray(velocity, dtype=float),
+                                                     numpy.asarray(target_torque, dtype=float))
+    velocity = velocity.ravel().copy()
+    target_torque = target_torque.ravel().copy()
+    count = len(velocity)
+    n = len(STATE_FIELDS)
+
+    period_map = PeriodMap(config, velocity, target_torque)
+    x = period_map.initial_state()
+    for k in range(warmup_periods):
+        x = period_map(x)
+
+    # angle offset estimate does not change when back-emf is too small, hold it there
+    frozen = ~period_map.estimating_offset()
+    converged = numpy.zeros(count, dtype=bool)
+    iterations = numpy.zeros(count)
+    residual = numpy.full(count, numpy.inf)
+    jac = numpy.zeros((count, n, n))
+    eye = numpy.eye(n)
+    for iteration in range(max_iterations):
+        active = ~converged
+        if not active.any():
+            break
+        jac_active, fx = jacobian(config, velocity[active], target_torque[active], x[active])
+        jac[active] = jac_active
+        error = fx - x[active]
+        # Newton step for G(x) = F(x) - x
+        A = jac_active - eye
+        A[frozen[active], OFFSET_STATE, :] = eye[OFFSET_STATE]
+        error[frozen[active], OFFSET_STATE] = 0.0
+        try:
+            step = numpy.linalg.solve(A, -error[:, :, None])[:, :, 0]
+        except numpy.linalg.LinAlgError:
+            step = numpy.einsum('pij,pj->pi', numpy.linalg.pinv(A), -error)
+        x[active] += step
+        scale = 1.0 + abs(x[active])
+        size = (abs(step) / scale).max(axis=1)
+        residual[active] = (abs(error) / scale).max(axis=1)
+        iterations[active] += 1
+        converged[active] = size < tolerance
+
+    result = PeriodMap(config, velocity, target_torque).measure(x)
+    jac[frozen, OFFSET_STATE, :] = 0.0
+    spectral_radius = abs(numpy.linalg.eigvals(jac)).max(axis=1)
+    result.update(converged=converged.astype(float), iterations=iterations, residual=residual,
+                  spectral_radius=spectral_radius, stable=(spectral_radius < 1.0).astype(float))
+    result['state'] = x
+    return result
+
+
+def efficiency_map(config, speeds, torques, **solver_options):
+    """ Solves steady state for every (target torque, speed) combination.
+    Returns dict of RESULT_FIELDS with arrays of shape (len(torques), len(speeds))
+    """
+    speeds = numpy.asarray(speeds, dtype=float)
+    torques = numpy.asarray(torques, dtype=float)
+    velocity, target_torque = numpy.meshgrid(speeds, torques)
+    result = solve_steady_state(config, velocity.ravel(), target_torque.ravel(), **solver_options)
+    shape = velocity.shape
+    return dict((name, result[name].reshape(shape)) for name in RESULT_FIELDS)
+
+
+def simulate_periods(config, velocity, target_torque, periods):
+    """ Brute-force reference : state after simulating periods FOC periods from controller reset """
+    period_map = PeriodMap(config, numpy.atleast_1d(velocity), numpy.atleast_1d(target_torque))
+    x = period_map.initial_state()
+    for k in range(periods):
+        x = period_map(x)
+    return period_map.measure(x)
+
+
+def write_map(result, path):
+    """ Writes map (or solve_steady_state() result) with one row per operating point to .csv or .npz """
+    ext = os.path.splitext(path)[1].lower()
+    columns = dict((name, numpy.asarray(result[name], dtype=float).ravel()) for name in RESULT_FIELDS)
+    if ext == '.csv':
+        import csv
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(RESULT_FIELDS)
+            for row in zip(*[columns[name] for name in RESULT_FIELDS]):
+                writer.writerow([repr(float(v)) for v in row])
+    elif ext == '.npz':
+        numpy.savez_compressed(path, **columns)
+    else:
+        raise ValueError("unknown map file type %r, use .csv or .npz" % ext)
+
+
+def main():
+    import argparse
+    import time
+    from gain_sweep import parse_range
+
+    parser = argparse.ArgumentParser(description="Steady-state efficiency map of FOC controlled motor")
+    parser.add_argument('--speeds', default='0:450:10', help="rad/s, start:stop:count or comma separated list")
+    parser.add_argument('--torques', default='0.005:0.05:10', help="Nm, start:stop:count or comma separated list")
+    parser.add_argument('-o', '--output', default=None, help="map file (.csv or .npz)")
+    args = parser.parse_args()
+
+    config = SimConfig()
+    # brute force comparison at one operating point
+    speed = 300.0
+    torque = config.get_target_torque()
+    start = time.time()
+    reference = simulate_periods(config, speed, torque, 2000)
+    brute_time = time.time() - start
+    start = time.time()
+    solved = solve_steady_state(config, speed, torque)
+    solve_time = time.time() - start
+    print("%g rad/s, %g Nm : brute force (2000 periods) %.3f s, Newton %.3f s (%d iterations)" %
+          (speed, torque, brute_time, solve_time, solved['iterations'][0]))
+    for name in ('torque', 'elec_power', 'efficiency', 'qd_power_ratio', 'current_per_torque'):
+        print("  %-20s %.10g  %.10g" % (name, reference[name][0], solved[name][0]))
+
+    speeds = parse_range(args.speeds)
+    torques = parse_range(args.torques)
+    start = time.time()
+    result = efficiency_map(config, speeds, torques)
+    print("%d operating points in %.2f seconds, %d not converged, %d unstable" %
+          (result['velocity'].size, time.time() - start,
+           (result['converged'] == 0).sum(), (result['stable'] == 0).sum()))
+    print("efficiency (rows: target torque mNm, columns: speed rad/s)")
+    print("%8s" % '' + ''.join("%7.0f" % s for s in speeds))
+    for torque, row in zip(torques, result['efficiency']):
+        print("%8.1f" % (torque * 1e3) + ''.join("%7.3f" % v for v in row))
+    if args.output:
+        write_map(result, args.output)
+        print("map written to %s" % args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Checks that plot_result() handles zoomed time windows, run with pytest.
+Figures are drawn with the non-interactive Agg backend.
+"""
+
+import matplotlib
+matplotlib.use('Agg')
+
+import pytest
+
+import sim_plots
+from motor_sim_cleaned import SimConfig, run_simulation
+
+
+@pytest.fixture(scope='module')
+def result():
+    return run_simulation(SimConfig(runtime=10e-3))
+
+
+def test_window_shorter_than_foc_period(result):
+    window = (5e-3, 5.01e-3)
+    assert window[1] - window[0] < result.config.foc_dt
+    zoomed = result.window(*window)
+    assert len(zoomed.foc) == 0 and len(zoomed.motor) >= 2
+    sim_plots.plot_result(result, pi_controllers=True, current_per_torque=True, time_window=window)
+    sim_plots.pylab.close('all')
+
+
+def test_window_without_samples(result):
+    with pytest.raises(ValueError):
+        sim_plots.plot_result(result, time_window=(5e-3, 5.001e-3))
+    sim_plots.pylab.close('all')
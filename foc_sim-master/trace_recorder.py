@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Trace recording for motor simulator and FOC controller.
+
+Originally MotorSim and FOC_Controller kept every recorded value in a Python
+list, which means every sample is a boxed float and long simulations run out
+of memory.  TraceRecorder stores samples as rows of a preallocated NumPy
+structured array instead.  Writing a single row into a structured array costs
+more than a list append, so record() only appends the row tuple to a short
+list and every `buffer_rows` rows they are packed into bytes with struct and
+copied into the array at once (commit()).  Everything that reads the array commits first.
+
+The recorder supports three ways of bounding memory:
+  * capacity : initial number of rows, usually sized from runtime/dt
+  * decimation : only record every N-th sample (0 disables recording)
+  * ring : keep only the most recent `capacity` samples
+
+When ring is False and the buffer fills up, it grows by `chunk` rows.
+
+For very long runs StreamingTraceRecorder writes rows to a .npy file in
+chunks instead, so only one chunk is kept in memory.  The file is a normal
+.npy file and can be opened again with TraceFile, which memory maps it.
+window() copies out just the samples of a time range, so any millisecond of
+a 60 second run can be plotted without loading the whole file.
+"""
+
+import bisect
+import os
+import struct
+from itertools import starmap
+
+import numpy
+
+
+class TraceRecorder:
+    """ Records rows of named float values into a preallocated structured array.
+    Recorded fields can be read back as attributes (trace.ia) or items (trace['ia'])
+    and are returned as NumPy arrays in time order.
+    If shape is given, each field holds an array of that shape per sample
+    (used by batch simulator to record N scenarios at once).
+    Those traces copy every row immediately, since their values are arrays that the
+    caller may change in place after recording.
+    """
+    # rows buffered by record() before they are copied into data
+    buffer_rows = 256
+
+    def __init__(self, fields, capacity=1024, decimation=1, ring=False, chunk=None, shape=()):
+        self.fields = tuple(fields)
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype([(name, numpy.float64, self.shape) for name in self.fields])
+        self.capacity = max(int(capacity), 1)
+        self.decimation = int(decimation)
+        self.ring = ring
+        self.chunk = self.capacity if chunk is None else max(int(chunk), 1)
+        self.data = numpy.zeros(self.capacity, self.dtype)
+        self.row_struct = struct.Struct('=%dd' % len(self.fields))  # one row of float64 fields
+        self.count = 0   # total number of rows recorded (may exceed capacity in ring mode)
+        self.pending = []  # last rows of count, not yet copied into data
+        self.skip = 0 if self.decimation > 0 else -1  # samples left to skip before next recorded sample
+        if self.shape:
+            self.buffer_rows = 1
+
+    def record(self, *values):
+        """ Records one sample, values must be in same order as fields """
+        # only one test per sample : skip is negative (never reaches 0) when decimation <= 0
+        if self.skip:
+            self.skip -= 1
+            return
+        self.skip = self.decimation - 1
+
+        pending = self.pending
+        pending.append(values)
+        self.count += 1
+        if len(pending) >= self.buffer_rows:
+            self.commit()
+
+    def commit(self):
+        """ Copies rows buffered by record() into data """
+        pending = self.pending
+        if not pending:
+            return
+        self.pending = []
+        end = self.count
+        if self.ring:
+            capacity = self.capacity
+            if len(pending) > capacity:
+                pending = pending[-capacity:]
+            n = (end - len(pending)) % capacity
+            first = min(len(pending), capacity - n)
+            self.put_rows(n, pending[:first])
+            if first < len(pending):
+                self.put_rows(0, pending[first:])
+        else:
+            while end > self.capacity:
+                self.grow()
+            self.put_rows(end - len(pending), pending)
+
+    def put_rows(self, start, rows):
+        """ Writes list of row tuples into data starting at row index start """
+        if self.shape:
+            self.data[start:start + len(rows)] = rows
+        else:
+            # rows of float64 fields are packed doubles, much faster than letting NumPy convert each tuple
+            packed = b''.join(starmap(self.row_struct.pack, rows))
+            offset = start * self.dtype.itemsize
+            self.data.view(numpy.uint8)[offset:offset + len(packed)] = numpy.frombuffer(packed, numpy.uint8)
+
+    def grow(self, rows=None):
+        """ Extends buffer by rows (default is chunk size) """
+        if rows is None:
+            rows = self.chunk
+        data = numpy.zeros(self.capacity + rows, self.dtype)
+        data[:self.capacity] = self.data
+        self.data = data
+        self.capacity += rows
+
+    def flush(self):
+        """ Writes buffered rows to storage (into data for in-memory traces) """
+        self.commit()
+
+    def clear(self):
+        self.count = 0
+        self.skip = 0 if self.decimation > 0 else -1
+        self.pending = []
+
+    def __len__(self):
+        # buffer grows in commit(), so count can be ahead of capacity when not a ring buffer
+        return min(self.count, self.capacity) if self.ring else self.count
+
+    def rows(self):
+        """ Returns recorded rows in time order.
+        Result is a view of internal buffer, except for a wrapped ring buffer
+        """
+        self.commit()
+        n = self.count
+        if n <= self.capacity:
+            return self.data[:n]
+        start = n % self.capacity
+        return numpy.concatenate((self.data[start:], self.data[:start]))
+
+    def __getitem__(self, name):
+        return numpy.ascontiguousarray(self.rows()[name])
+
+    def __getattr__(self, name):
+        # only called when normal attribute lookup fails
+        fields = self.__dict__.get('fields', ())
+        if name in fields:
+            return self[name]
+        raise AttributeError(name)
+
+    def last(self, name):
+        """ Returns most recently recorded value of field """
+        n = self.count
+        if n == 0:
+            raise IndexError("trace is empty")
+        if self.pending:
+            value = self.pending[-1][self.fields.index(name)]
+            return value.copy() if self.shape else float(value)
+        value = self.data[(n - 1) % self.capacity][name]
+        if self.shape:
+            return value.copy()
+        return float(value)
+
+    def as_dict(self):
+        rows = self.rows()
+        return dict((name, numpy.ascontiguousarray(rows[name])) for name in self.fields)
+
+    def window(self, t_start, t_end, time_field='t'):
+        """ Returns new in-memory TraceRecorder with samples where t_start <= t < t_end.
+        Samples are found by binary search on time field, so only rows inside
+        window are read from a file backed trace
+        """
+        rows = self.rows()
+        times = rows[time_field]
+        start = bisect.bisect_left(times, t_start)
+        end = bisect.bisect_left(times, t_end, start)
+        return TraceRecorder.from_rows(rows[start:end])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """ Returns TraceRecorder holding copy of structured array rows """
+        fields = rows.dtype.names
+        trace = TraceRecorder(fields, len(rows), shape=rows.dtype[fields[0]].shape)
+        trace.data[:len(rows)] = rows
+        trace.count = len(rows)
+        return trace
+
+
+# .npy header is written with room for largest possible row count, so it can be
+# rewritten in place after every chunk without moving the data that follows it
+NPY_MAX_ROWS = 10**18
+
+
+def npy_header(dtype, rows, size=None):
+    """ Returns .npy file header for 1-D array of rows, padded to size bytes """
+    header = repr({'descr': numpy.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (rows,)})
+    version = (1, 0) if len(header) < 65000 else (2, 0)
+    prefix = len(numpy.lib.format.magic(*version)) + (2 if version == (1, 0) else 4)
+    if size is None:
+        size = (prefix + len(header) + 1 + 63) // 64 * 64
+    header = header.ljust(size - prefix - 1) + '\n'
+    length = len(header).to_bytes(prefix - 8, 'little')
+    return numpy.lib.format.magic(*version) + length + header.encode('latin1')
+
+
+class StreamingTraceRecorder(TraceRecorder):
+    """ TraceRecorder that streams rows to a .npy file at path.
+    Rows are collected in memory and written out `chunk` rows at a time.
+    Reading a field flushes buffer and reads it back through a memory map.
+    capacity is accepted for compatibility with sized_trace_options() and ignored,
+    ring buffer mode is not supported.
+    """
+    def __init__(self, fields, path, chunk=65536, decimation=1, shape=(), capacity=None, ring=False):
+        if ring:
+            raise ValueError("streaming trace can not be a ring buffer")
+        TraceRecorder.__init__(self, fields, chunk, decimation, shape=shape)
+        self.path = path
+        self.header_size = len(npy_header(self.dtype, NPY_MAX_ROWS))
+        self.stored = 0      # rows already written to file
+        self.mapped = None   # memory map of stored rows, reopened when file grows
+        self.file = open(path, 'w+b')
+        self.file.write(npy_header(self.dtype, 0, self.header_size))
+        self.file.flush()
+
+    def commit(self):
+        """ Copies rows buffered by record() into chunk buffer, writes every full chunk to file """
+        pending = self.pending
+        if not pending:
+            return
+        self.pending = []
+        n = self.count - len(pending) - self.stored  # rows already in chunk buffer
+        i = 0
+        while i < len(pending):
+            rows = min(len(pending) - i, self.capacity - n)
+            self.put_rows(n, pending[i:i + rows])
+            n += rows
+            i += rows
+            if n == self.capacity:
+                self.write_rows(n)
+                n = 0
+
+    def flush(self):
+        """ Appends buffered rows to file and updates row count in file header """
+        self.commit()
+        self.write_rows(self.count - self.stored)
+
+    def write_rows(self, n):
+        """ Appends first n rows of chunk buffer to file and updates row count in file header """
+        if n == 0:
+            return
+        self.file.seek(0, os.SEEK_END)
+        self.data[:n].tofile(self.file)
+        self.stored += n
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, self.stored, self.header_size))
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.mapped = None
+        self.file.close()
+
+    def clear(self):
+        TraceRecorder.clear(self)
+        self.stored = 0
+        self.mapped = None
+        self.file.truncate(self.header_size)
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, 0, self.header_size))
+        self.file.flush()
+
+    def __len__(self):
+        return self.count
+
+    def rows(self):
+        """ Returns all recorded rows as read-only memory map of file """
+        self.flush()
+        if self.stored == 0:
+            return self.data[:0]
+        if self.mapped is None or len(self.mapped) != self.stored:
+            self.mapped = numpy.memmap(self.path, self.dtype, 'r', self.header_size, (self.stored,))
+        return self.mapped
+
+    def last(self, name):
+        """ Returns most recently recorded value of field """
+        if self.count == 0:
+            raise IndexError("trace is empty")
+        self.commit()
+        n = self.count - self.stored
+        value = self.data[n - 1][name] if n else self.rows()[-1][name]
+        if self.shape:
+            return value.copy()
+        return float(value)
+
+
+class TraceFile(TraceRecorder):
+    """ Read-only trace backed by memory map of .npy file written by StreamingTraceRecorder """
+    def __init__(self, path):
+        rows = numpy.load(path, mmap_mode='r')
+        self.path = path
+        self.fields = rows.dtype.names
+        self.shape = rows.dtype[self.fields[0]].shape
+        self.dtype = rows.dtype
+        self.data = rows
+        self.capacity = self.count = len(rows)
+        self.decimation = 1
+        self.ring = False
+        self.chunk = 0
+        self.skip = 0
+        self.pending = []
+
+    def record(self, *values):
+        raise TypeError("TraceFile is read-only")
+
+
+def create_trace(fields, **options):
+    """ Returns StreamingTraceRecorder if options contain a file path, otherwise TraceRecorder """
+    if options.get('path'):
+        return StreamingTraceRecorder(fields, **options)
+    options.pop('path', None)
+    return TraceRecorder(fields, **options)
+
+
+def sub_trace_options(options, name):
+    """ Returns trace options for trace of a sub-component.
+    Streamed traces get their own file next to parent file (foc.npy -> foc_d_ctrl.npy)
+    """
+    if not options or not options.get('path'):
+        return options
+    options = dict(options)
+    root, ext = os.path.splitext(options['path'])
+    options['path'] = root + '_' + name + ext
+    return options
+
+
+def sized_trace_options(runtime, dt, decimation=1, ring=False, margin=2):
+    """ Returns TraceRecorder keyword options with enough capacity
+    to hold runtime/dt samples, taking decimation into account
+    """
+    samples = int(runtime / dt) + margin
+    if decimation > 1:
+        samples = samples // decimation + margin
+    return dict(capacity=samples, decimation=decimation, ring=ring)
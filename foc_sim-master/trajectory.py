@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2013, Unbounded Robotics Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+#  are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Setpoint trajectories, load-torque profiles and outer control loops.
+
+Without a trajectory the FOC controller gets the constant config.target_torque
+for the whole simulation.  Set config.trajectory to a Trajectory to drive the
+simulation with a time-varying command instead :
+  mode='torque' : setpoint profile is passed to FOC as target torque
+  mode='velocity' : PI velocity loop turns velocity setpoint (rad/s) into target torque
+  mode='position' : P position loop with velocity feed-forward turns position
+                    setpoint (rad) into velocity setpoint for the velocity loop
+A load profile adds external load torque (Nm, opposes positive motor torque).
+
+Profiles are piecewise functions of time, given as breakpoints or as a sampled
+array, and can repeat with a period to build duty cycles.  Before simulation
+starts every profile is evaluated once with NumPy at the time of every FOC
+update, so the simulation loop only indexes precomputed lists, there is no
+per-tick breakpoint search or interpolation.
+
+The outer loops see the simulated rotor position and velocity, a sensors
+pipeline (config.sensors) is only applied to FOC controller inputs.
+
+Example, 2 turn move and a load torque step at 150ms:
+  move = Profile.move(0.0, 4*pi, max_velocity=150.0, acceleration=4000.0, t_start=5e-3)
+  load = Profile.steps([0.0, 150e-3], [0.0, 0.01])
+  result = run_simulation(SimConfig(runtime=200e-3, trajectory=Trajectory(move, 'position', load)))
+"""
+
+from math import ceil, pi, sqrt
+import numpy
+
+from trace_recorder import create_trace
+
+
+class Profile:
+    """ Function of time given by breakpoints (times must be increasing).
+    interpolation 'linear' interpolates between breakpoints, 'step' holds value of last breakpoint.
+    Before first and after last breakpoint the end values are held.
+    If period is set, profile repeats every period seconds
+    """
+    interpolations = ('linear', 'step')
+
+    def __init__(self, times, values, interpolation='linear', period=None):
+        times = numpy.array(times, dtype=float).ravel()
+        values = numpy.array(values, dtype=float).ravel()
+        if len(times) == 0 or len(times) != len(values):
+            raise ValueError("profile needs same, non-zero number of times and values")
+        if numpy.any(numpy.diff(times) < 0.0):
+            raise ValueError("profile times must be increasing")
+        if interpolation not in self.interpolations:
+            raise ValueError("unknown interpolation %r, use one of %s" % (interpolation, self.interpolations))
+        if period is not None and period <= 0.0:
+            raise ValueError("profile period must be positive")
+        self.times = times
+        self.values = values
+        self.interpolation = interpolation
+        self.period = period
+
+    @classmethod
+    def constant(cls, value):
+        return cls([0.0], [value])
+
+    @classmethod
+    def steps(cls, times, values, period=None):
+        """ Returns piecewise-constant profile, value changes at every time """
+        return cls(times, values, 'step', period)
+
+    @classmethod
+    def sampled(cls, values, dt, t0=0.0, interpolation='linear', period=None):
+        """ Returns profile from array of values sampled every dt seconds starting at t0 """
+        values = numpy.asarray(values, dtype=float).ravel()
+        return cls(t0 + dt*numpy.arange(len(values)), values, interpolation, period)
+
+    @classmethod
+    def move(cls, start, end, max_velocity, acceleration, t_start=0.0, samples=300):
+        """ Returns position profile of point-to-point move from start to end (rad) with
+        trapezoidal velocity (triangular if max_velocity is not reached), sampled at samples points
+        """
+        distance = abs(end - start)
+        direction = 1.0 if end >= start else -1.0
+        t_accel = max_velocity / acceleration
+        if acceleration*t_accel*t_accel > distance:
+            t_accel = sqrt(distance / acceleration)
+        velocity = acceleration * t_accel
+        t_cruise = (distance - velocity*t_accel) / velocity if velocity > 0.0 else 0.0
+        t_total = 2.0*t_accel + t_cruise
+        t = numpy.linspace(0.0, t_total, samples)
+        t_decel = numpy.maximum(t - t_accel - t_cruise, 0.0)
+        position = (0.5*acceleration*numpy.minimum(t, t_accel)**2
+                    + velocity*numpy.clip(t - t_accel, 0.0, t_cruise)
+                    + velocity*t_decel - 0.5*acceleration*t_decel**2)
+        return cls(t_start + t, start + direction*position)
+
+    def sample(self, t):
+        """ Returns profile values at times t (array) """
+        t = numpy.asarray(t, dtype=float)
+        if self.period is not None:
+            t = numpy.mod(t, self.period)
+        if self.interpolation == 'linear':
+            return numpy.interp(t, self.times, self.values)
+        idx = numpy.searchsorted(self.times, t, side='right') - 1
+        return self.values[numpy.maximum(idx, 0)]
+
+    def __call__(self, t):
+        return self.sample(t)
+
+
+def as_profile(value):
+    """ Returns value as Profile, numbers become constant profiles, None stays None """
+    if value is None or isinstance(value, Profile):
+        return value
+    return Profile.constant(value)
+
+
+class Trajectory:
+    """ Drives target torque and load torque of a simulation from profiles.
+    setpoint : Profile (or constant) of torque (Nm), velocity (rad/s) or position (rad) depending on mode
+    load : Profile (or constant) of external load torque (Nm), None means no load
+    velocity_gains : (p, i) gains of velocity loop, Nm/(rad/s) and Nm/rad.
+        None tunes loop for velocity_bandwidth (rad/s) with motor + load inertia
+    position_gain : position loop gain (1/s), None means velocity_bandwidth/4
+    torque_limit : limit of velocity loop output (Nm), None means motor.max_torque
+    max_velocity : limit of position loop output (rad/s), None means no limit
+    reset() must be called before every simulation (build_simulation() does this)
+    """
+    modes = ('torque', 'velocity', 'position')
+    trace_fields = ('t', 'setpoint', 'velocity_setpoint', 'target_torque', 'load_torque')
+
+    def __init__(self, setpoint=0.0, mode='torque', load=None, velocity_gains=None, position_gain=None,
+                 velocity_bandwidth=2*pi*50, torque_limit=None, max_velocity=None):
+        if mode not in self.modes:
+            raise ValueError("unknown trajectory mode %r, use one of %s" % (mode, self.modes))
+        self.setpoint = as_profile(setpoint)
+        self.mode = mode
+        self.load = as_profile(load)
+        self.velocity_gains = velocity_gains
+        self.position_gain = position_gain
+        self.velocity_bandwidth = velocity_bandwidth
+        self.torque_limit = torque_limit
+        self.max_velocity = max_velocity
+        self.update = getattr(self, 'update_' + mode)
+
+    def reset(self, config):
+        """ Precomputes profile values for every FOC update of config and clears loop state """
+        foc_dt = config.foc_dt
+        motor = config.motor
+        # one value per FOC update, FOC update n runs at time n*foc_dt.
+        # Extra entries cover updates that float rounding of sim time or FOC jitter adds at end
+        ticks = int(ceil(config.runtime / foc_dt)) + 3
+        times = foc_dt * numpy.arange(ticks)
+        setpoints = self.setpoint.sample(times)
+        self.setpoints = setpoints.tolist()
+        if self.load is not None:
+            self.loads = self.load.sample(times).tolist()
+        else:
+            self.loads = [0.0] * ticks
+        # velocity feed-forward of position loop is slope of position setpoint
+        if self.mode == 'position':
+            self.feedforward = (numpy.gradient(setpoints, foc_dt) if ticks > 1 else numpy.zeros(ticks)).tolist()
+        self.tick = 0
+        self.dt = foc_dt
+
+        inertia = motor.rotor_inertia + config.load_inertia
+        bandwidth = self.velocity_bandwidth
+        if self.velocity_gains is None:
+            # PI zero at a quarter of the crossover frequency
+            self.p_gain = inertia * bandwidth
+            self.i_gain = self.p_gain * bandwidth / 4.0
+        else:
+            self.p_gain, self.i_gain = self.velocity_gains
+        self.k_position = bandwidth / 4.0 if self.position_gain is None else self.position_gain
+        self.limit = motor.max_torque if self.torque_limit is None else self.torque_limit
+        self.i_term = 0.0
+        self.velocity_setpoint = 0.0
+
+        self.trace = create_trace(self.trace_fields, **config.trace_options(foc_dt, 'trajectory'))
+        self.trace.record(0.0, self.setpoints[0], 0.0, 0.0, self.loads[0])
+
+    def get_state(self):
+        """ Returns outer loop state, (velocity loop i_term, velocity setpoint) """
+        return (self.i_term, self.velocity_setpoint)
+
+    def set_state(self, state, tick):
+        """ Restores outer loop state (None keeps reset state), next update is FOC update tick+1 """
+        if state is not None:
+            self.i_term, self.velocity_setpoint = state
+        self.tick = tick
+
+    def initial_load(self):
+        """ Load torque applied from start of simulation until first FOC update """
+        return self.loads[0]
+
+    def next_tick(self):
+        self.tick += 1
+        return self.tick
+
+    # update(t, position, velocity) runs outer loops of next FOC update,
+    # returns (target torque, load torque).  It is bound to one of the methods below in __init__
+    def update_torque(self, t, position, velocity):
+        n = self.next_tick()
+        torque = self.setpoints[n]
+        load = self.loads[n]
+        self.trace.record(t, torque, 0.0, torque, load)
+        return torque, load
+
+    def update_velocity(self, t, position, velocity):
+        n = self.next_tick()
+        setpoint = self.setpoints[n]
+        load = self.loads[n]
+        torque = self.velocity_loop(setpoint, velocity)
+        self.trace.record(t, setpoint, setpoint, torque, load)
+        return torque, load
+
+    def update_position(self, t, position, velocity):
+        n = self.next_tick()
+        setpoint = self.setpoints[n]
+        load = self.loads[n]
+        velocity_setpoint = self.feedforward[n] + self.k_position*(setpoint - position)
+        if self.max_velocity is not None:
+            velocity_setpoint = min(max(velocity_setpoint, -self.max_velocity), self.max_velocity)
+        torque = self.velocity_loop(velocity_setpoint, velocity)
+        self.trace.record(t, setpoint, velocity_setpoint, torque, load)
+        return torque, load
+
+    def velocity_loop(self, velocity_setpoint, velocity):
+        """ PI velocity controller, integrator is clamped to torque limit to prevent windup """
+        limit = self.limit
+        error = velocity_setpoint - velocity
+        i_term = self.i_term + self.i_gain*error*self.dt
+        i_term = min(max(i_term, -limit), limit)
+        self.i_term = i_term
+        self.velocity_setpoint = velocity_setpoint
+        torque = self.p_gain*error + i_term
+        return min(max(torque, -limit), limit)
+
+
+def demo():
+    """ Position move with load step, prints tracking error and plots result """
+    from motor_sim_cleaned import SimConfig, run_simulation
+    move = Profile.move(0.0, 4*pi, max_velocity=150.0, acceleration=4000.0, t_start=5e-3)
+    load = Profile.steps([0.0, 150e-3], [0.0, 0.01])
+    config = SimConfig(runtime=200e-3, trajectory=Trajectory(move, 'position', load))
+    result = run_simulation(config)
+    trace = result.trajectory
+    motor_trace = result.motor
+    error = trace.setpoint - numpy.interp(trace.t, motor_trace.t, motor_trace.position)
+    print("largest position error %.4f rad, final error %.5f rad" % (abs(error).max(), error[-1]))
+    import sim_plots
+    sim_plots.plot_result(result, angle_offset=False)
+    sim_plots.show()
+
+
+if __name__ == "__main__":
+    demo()
@@ -9,6 +9,8 @@ from pygame.math import Vector2 # Pygame's Vector2 ist sehr praktisch
 import subprocess # Für wmctrl Aufruf unter Linux
 import sys # Für sys.platform benötigt
 import time # Für wanderndes Verhalten
+try: import numpy as np # Für die Array-Engine (FlockEngine), ohne NumPy laufen die Boid-Objekte
+except ImportError: np = None
 
 # --- Pygame Fenster Setup ---
 SCREEN_WIDTH = 0
@@ -25,112 +27,185 @@ BLACK = (0, 0, 0)
 GRAY = (100, 100, 100) # Farbe für den Hai
 DARK_GRAY = (50, 50, 50) # Dunkleres Grau
 
+# --- Spatial Hash (Zellgitter) für Nachbarschaftsabfragen ---
+class SpatialGrid:
+    # Gleichmäßiges Zellgitter, wird EINMAL pro Frame mit allen Entities (Boids + Haie) gefüllt.
+    # Statt jede Entity gegen alle anderen zu prüfen (N² Abstände), liefert query() nur die
+    # Entities aus den Zellen rund um eine Position. Der genaue Abstandstest bleibt in den
+    # Steuerungsregeln, query() liefert also eine Obermenge der echten Nachbarn.
+    #
+    # Toroidal: Boids springen in wrap_borders() vom einen Rand zum anderen, die Welt läuft
+    # also von -buffer bis width+buffer und wiederholt sich. Die Zellindizes werden modulo
+    # Spalten/Zeilen gerechnet und die Zellgröße so gewählt, dass die Periode ein ganzes
+    # Vielfaches davon ist - ein gesprungener Boid landet so in (fast) derselben Zelle.
+    #
+    # slack: maximale Strecke, die sich eine Entity nach build() noch bewegt (Haie und die
+    # vorherigen Schwärme bewegen sich im Frame, bevor alle Boids ihre Nachbarn abfragen).
+    # Das Suchfenster wird darum vergrößert, damit kein Nachbar verloren geht.
+    def __init__(self, cell_size, width, height, buffer=0.0, slack=0.0):
+        self.origin = -buffer
+        period_x = max(1.0, width + 2 * buffer); period_y = max(1.0, height + 2 * buffer)
+        cell_size = max(1.0, cell_size)
+        self.cols = max(1, int(period_x // cell_size)); self.rows = max(1, int(period_y // cell_size))
+        # Zellen werden etwas größer als cell_size, damit sie die Periode genau aufteilen
+        self.cell_w = period_x / self.cols; self.cell_h = period_y / self.rows
+        self.slack = slack
+        self.cells = {}
+
+    def _cell(self, position):
+        # Ungewrappter Zellindex, wirft ValueError/OverflowError für nan/inf Positionen
+        return (int(math.floor((position.x - self.origin) / self.cell_w)),
+                int(math.floor((position.y - self.origin) / self.cell_h)))
+
+    def build(self, entities):
+        cells = {}; cols = self.cols; rows = self.rows
+        for entity in entities:
+            try: cx, cy = self._cell(entity.position)
+            except (ValueError, OverflowError): continue # Kaputte Position ist niemandes Nachbar
+            key = (cx % cols, cy % rows)
+            cell = cells.get(key)
+            if cell is None: cells[key] = [entity]
+            else: cell.append(entity)
+        self.cells = cells
+
+    def discard(self, entities):
+        # Entfernt z.B. gefressene Boids, ohne das Gitter neu aufzubauen
+        if not entities: return
+        for key, cell in list(self.cells.items()):
+            self.cells[key] = [e for e in cell if e not in entities]
+
+    def query(self, position, radius):
+        # Alle Entities in Zellen, die den Kreis (radius + slack) um position berühren
+        try: cx, cy = self._cell(position)
+        except (ValueError, OverflowError): return []
+        reach = radius + self.slack
+        kx = int(math.ceil(reach / self.cell_w)); ky = int(math.ceil(reach / self.cell_h))
+        # Bei kleinen Fenstern würde das Suchfenster um den Torus herum doppelt zählen
+        if 2 * kx + 1 >= self.cols: xs = range(self.cols)
+        else: xs = [(cx + i) % self.cols for i in range(-kx, kx + 1)]
+        if 2 * ky + 1 >= self.rows: ys = range(self.rows)
+        else: ys = [(cy + j) % self.rows for j in range(-ky, ky + 1)]
+        cells = self.cells; found = []
+        for x in xs:
+            for y in ys:
+                cell = cells.get((x, y))
+                if cell: found.extend(cell)
+        return found
+
+# --- Parameter: Schnappschuss und Store ---
+class Settings:
+    # Unveränderlicher Schnappschuss der Parameter-Werte (nur Zahlen/bool, kein Tk).
+    # Wird an alle Simulations- und Zeichenmethoden übergeben, Zugriff mit settings['key'],
+    # settings.get('key', default) oder settings.key
+    __slots__ = ('_values',)
+    def __init__(self, values=None, **more):
+        values = dict(values or {}); values.update(more)
+        object.__setattr__(self, '_values', values)
+    def __getitem__(self, key): return self._values[key]
+    def __getattr__(self, key):
+        if key.startswith('_'): raise AttributeError(key) # _values fehlt bei copy/pickle ohne __init__, sonst Endlosrekursion
+        try: return self._values[key]
+        except KeyError: raise AttributeError(key)
+    def __setattr__(self, key, value): raise AttributeError("Settings sind unveränderlich")
+    def __contains__(self, key): return key in self._values
+    def __iter__(self): return iter(self._values)
+    def __repr__(self): return f"Settings({self._values!r})"
+    def __reduce__(self): return (Settings, (self._values,)) # copy/pickle über __init__, __slots__ ohne __dict__
+    def get(self, key, default=None): return self._values.get(key, default)
+    def replace(self, **changes): return Settings(self._values, **changes) # Kopie mit geänderten Werten
+    def as_dict(self): return dict(self._values)
+
+class ParamStore:
+    # Verbindet ein Parameter-Dict (Tk-Variablen der Slider oder feste Zahlen) mit der Simulation.
+    # snapshot() liefert ein Settings-Objekt. Tk-Variablen werden per trace_add beobachtet und nur
+    # nach einer Änderung neu gelesen, sonst kostet snapshot() pro Frame keinen einzigen Tcl-Aufruf.
+    # Ohne Tk-Variablen (z.B. ParamStore(default_values_swarm1)) läuft alles headless.
+    def __init__(self, params):
+        self.params = params; self._snapshot = None
+        for var in params.values():
+            if isinstance(var, tk.Variable): var.trace_add('write', self._changed)
+    def _changed(self, *args): self._snapshot = None
+    def snapshot(self):
+        # Wirft tk.TclError, wenn Tk schon beendet ist (wie var.get())
+        if self._snapshot is None:
+            values = {}
+            for key, var in self.params.items():
+                if isinstance(var, tk.Variable): values[key] = var.get()
+                elif isinstance(var, (int, float, bool)): values[key] = var
+                # Andere Einträge (z.B. '*_actual_label' Labels) gehören nicht zur Simulation
+            self._snapshot = Settings(values)
+        return self._snapshot
+
 # --- Boid Klasse ---
 class Boid:
-    # NIMMT JETZT EIN EINZIGES PARAMETER-DICT ENTGEGEN
-    def __init__(self, x, y, color, params):
+    # Alle Methoden bekommen die Parameter als Settings-Schnappschuss, kein Tk im Boid
+    def __init__(self, x, y, color, settings):
         self.position = Vector2(x, y)
-        max_speed_init = params.get('max_speed', tk.DoubleVar(value=4.0)).get()
+        max_speed_init = settings.get('max_speed', 4.0)
         angle = random.uniform(0, 2 * math.pi)
         initial_speed = random.uniform(1, max(1.1, max_speed_init / 2))
         self.velocity = Vector2(math.cos(angle), math.sin(angle)) * initial_speed
         self.acceleration = Vector2(0, 0)
         self.color = color
-        self.params = params # Speichert das kombinierte Parameter-Dict
         self.size = 6
 
     def apply_force(self, force):
         if force and math.isfinite(force.x) and math.isfinite(force.y): self.acceleration += force
-    def seek(self, target):
-        max_speed=self.params['max_speed'].get(); max_force=self.params['max_force'].get()
+    def seek(self, target, settings):
+        max_speed=settings['max_speed']; max_force=settings['max_force']
         desired = (target - self.position); dist = desired.length()
         if dist > 0:
             desired = desired.normalize() * max_speed; steer = (desired - self.velocity)
             if steer.length() > max_force: steer.scale_to_length(max_force)
             return steer
         return Vector2(0, 0)
-    def separate(self, boids):
-        steering = Vector2(0, 0); total = 0
-        sep_dist = self.params['separation_distance'].get(); max_speed = self.params['max_speed'].get(); max_force = self.params['max_force'].get()
-        for other in boids:
-            # Nur von Boids der GLEICHEN Farbe trennen
-            if self != other and other.color == self.color:
-                try: dist_sq = self.position.distance_squared_to(other.position)
-                except OverflowError: dist_sq = float('inf')
-                if 0 < dist_sq < sep_dist * sep_dist:
-                    distance = math.sqrt(dist_sq); diff = self.position - other.position
-                    diff /= (distance * distance) if distance > 1 else 1
-                    steering += diff; total += 1
-        if total > 0:
-            steering /= total
-            if steering.length() > 0: steering = steering.normalize() * max_speed
-            steer = steering - self.velocity
-            if steer.length() > max_force: steer.scale_to_length(max_force)
-            return steer
-        return Vector2(0, 0)
-    def align(self, boids):
-        steering = Vector2(0, 0); total = 0
-        vis_range = self.params['visual_range'].get(); max_speed = self.params['max_speed'].get(); max_force = self.params['max_force'].get()
-        for other in boids:
-             # Nur an Boids der GLEICHEN Farbe ausrichten
-            if self != other and other.color == self.color:
-                try: dist_sq = self.position.distance_squared_to(other.position)
-                except OverflowError: dist_sq = float('inf')
-                if 0 < dist_sq < vis_range * vis_range:
-                    if other.velocity and other.velocity.length_squared() > 0: steering += other.velocity; total += 1
-        if total > 0:
-            steering /= total
-            if steering.length() > 0: steering = steering.normalize() * max_speed
-            steer = steering - self.velocity
-            if steer.length() > max_force: steer.scale_to_length(max_force)
-            return steer
-        return Vector2(0, 0)
-    def cohere(self, boids):
-        center_of_mass = Vector2(0, 0); total = 0
-        vis_range = self.params['visual_range'].get()
-        for other in boids:
-             # Nur mit Boids der GLEICHEN Farbe zusammenrotten
-            if self != other and other.color == self.color:
-                try: dist_sq = self.position.distance_squared_to(other.position)
-                except OverflowError: dist_sq = float('inf')
-                if 0 < dist_sq < vis_range * vis_range:
-                    center_of_mass += other.position; total += 1
-        if total > 0: center_of_mass /= total; return self.seek(center_of_mass)
-        return Vector2(0, 0)
-    def avoid(self, all_entities): # Renamed parameter for clarity
-        steering = Vector2(0, 0); total = 0
-        avoid_range = self.params['avoidance_range'].get(); max_speed = self.params['max_speed'].get(); max_force = self.params['max_force'].get()
+    def _steer_towards(self, steering, max_speed, max_force):
+        # Gemeinsames Ende von Separation/Alignment/Abneigung: Richtung auf max_speed, minus Geschwindigkeit, begrenzt
+        if steering.length() > 0: steering = steering.normalize() * max_speed
+        steer = steering - self.velocity
+        if steer.length() > max_force: steer.scale_to_length(max_force)
+        return steer
+
+    # Nimmt jetzt all_entities (Boids + Haie), Parameter des Frames und optional das Zellgitter
+    def flock(self, all_entities, settings, grid=None):
+        # Separation, Alignment, Kohäsion (gleiche Farbe) und Abneigung (andere Farben + Haie) werden
+        # in EINEM Durchlauf über die Nachbarn aufsummiert, statt viermal dieselbe Liste zu prüfen.
+        # Separation/Abneigung: Mittel von diff / Abstand² (ab Abstand 1), Alignment: mittlere
+        # Geschwindigkeit, Kohäsion: seek() zum Schwerpunkt
+        sep_dist = settings['separation_distance']; vis_range = settings['visual_range']; avoid_range = settings['avoidance_range']
+        max_speed = settings['max_speed']; max_force = settings['max_force']
+        if grid is not None:
+            # Nur Kandidaten aus den umliegenden Zellen statt aller Entities prüfen
+            all_entities = grid.query(self.position, max(vis_range, sep_dist, avoid_range))
+        sep_dist_sq = sep_dist * sep_dist; vis_range_sq = vis_range * vis_range; avoid_range_sq = avoid_range * avoid_range
+        x = self.position.x; y = self.position.y; color = self.color
+        sep_x = sep_y = ali_x = ali_y = coh_x = coh_y = avo_x = avo_y = 0.0
+        sep_total = ali_total = coh_total = avo_total = 0
         for other in all_entities:
-             # Allen ANDEREN Farben (andere Schwärme + Haie) ausweichen
-            if self != other and other.color != self.color:
-                try: dist_sq = self.position.distance_squared_to(other.position)
-                except OverflowError: dist_sq = float('inf')
-                # Check if the other entity has a position attribute (might be a non-boid)
-                if hasattr(other, 'position') and 0 < dist_sq < avoid_range * avoid_range:
-                    distance = math.sqrt(dist_sq); diff = self.position - other.position
-                    diff /= (distance * distance) if distance > 1 else 1
-                    steering += diff; total += 1
-        if total > 0:
-            steering /= total
-            if steering.length() > 0: steering = steering.normalize() * max_speed
-            steer = steering - self.velocity
-            if steer.length() > max_force: steer.scale_to_length(max_force)
-            return steer
-        return Vector2(0, 0)
-
-    # Nimmt jetzt all_entities (Boids + Haie)
-    def flock(self, all_entities):
-        # Separate, Align, Cohere only consider boids of the same color (handled within methods)
-        # Avoid considers all entities of different colors (boids + sharks)
-        same_color_boids = [b for b in all_entities if isinstance(b, Boid) and b.color == self.color]
-        sep = self.separate(same_color_boids) * self.params['separation_factor'].get()
-        ali = self.align(same_color_boids) * self.params['alignment_factor'].get()
-        coh = self.cohere(same_color_boids) * self.params['cohesion_factor'].get()
-        # Avoidance considers ALL other entities (different color boids + sharks)
-        avo = self.avoid(all_entities) * self.params['avoidance_factor'].get()
-        self.apply_force(sep); self.apply_force(ali); self.apply_force(coh); self.apply_force(avo)
-    def update(self):
-        max_speed = self.params['max_speed'].get(); self.velocity += self.acceleration
+            if other is self: continue
+            other_position = other.position
+            dx = x - other_position.x; dy = y - other_position.y; dist_sq = dx * dx + dy * dy
+            if not dist_sq > 0: continue # Gleiche Position (oder nan) zählt nicht
+            if other.color == color:
+                if not isinstance(other, Boid): continue
+                if dist_sq < sep_dist_sq:
+                    distance = math.sqrt(dist_sq)
+                    if distance > 1: dx /= distance * distance; dy /= distance * distance
+                    sep_x += dx; sep_y += dy; sep_total += 1
+                if dist_sq < vis_range_sq:
+                    coh_x += other_position.x; coh_y += other_position.y; coh_total += 1
+                    velocity = other.velocity
+                    if velocity.length_squared() > 0: ali_x += velocity.x; ali_y += velocity.y; ali_total += 1
+            elif dist_sq < avoid_range_sq:
+                distance = math.sqrt(dist_sq)
+                if distance > 1: dx /= distance * distance; dy /= distance * distance
+                avo_x += dx; avo_y += dy; avo_total += 1
+        if sep_total: self.apply_force(self._steer_towards(Vector2(sep_x, sep_y) / sep_total, max_speed, max_force) * settings['separation_factor'])
+        if ali_total: self.apply_force(self._steer_towards(Vector2(ali_x, ali_y) / ali_total, max_speed, max_force) * settings['alignment_factor'])
+        if coh_total: self.apply_force(self.seek(Vector2(coh_x, coh_y) / coh_total, settings) * settings['cohesion_factor'])
+        if avo_total: self.apply_force(self._steer_towards(Vector2(avo_x, avo_y) / avo_total, max_speed, max_force) * settings['avoidance_factor'])
+    def update(self, settings):
+        max_speed = settings['max_speed']; self.velocity += self.acceleration
         vel_len_sq = self.velocity.length_squared()
         if vel_len_sq < 0.001:
             angle = random.uniform(0, 2 * math.pi); self.velocity = Vector2(math.cos(angle), math.sin(angle)) * 0.1
@@ -142,18 +217,18 @@ class Boid:
         if self.position.y < -buffer: self.position.y = height + buffer
         if self.position.x > width + buffer: self.position.x = -buffer
         if self.position.y > height + buffer: self.position.y = -buffer
-    def draw(self, screen):
-        # NUTZT JETZT self.params für Geometrie
+    def draw(self, screen, settings):
+        # NUTZT JETZT settings für Geometrie
         if self.velocity.length_squared() < 0.01:
             try: pygame.draw.circle(screen, self.color, (int(self.position.x), int(self.position.y)), int(self.size * 0.8))
             except OverflowError: pass; return
         try: heading = self.velocity.normalize()
         except ValueError: heading = Vector2(1, 0)
         try:
-            # Holt Geometrie-Parameter direkt aus self.params
-            tip_factor = self.params['geom_tip_factor'].get(); mid_offset_factor = self.params['geom_mid_offset_factor'].get()
-            width_factor = self.params['geom_width_factor'].get(); tail_offset_factor = self.params['geom_tail_offset_factor'].get()
-            tail_width_factor = self.params['geom_tail_width_factor'].get()
+            # Holt Geometrie-Parameter aus dem Schnappschuss
+            tip_factor = settings['geom_tip_factor']; mid_offset_factor = settings['geom_mid_offset_factor']
+            width_factor = settings['geom_width_factor']; tail_offset_factor = settings['geom_tail_offset_factor']
+            tail_width_factor = settings['geom_tail_width_factor']
             tip = self.position + heading * self.size * tip_factor; perp = Vector2(-heading.y, heading.x)
             mid_base = self.position + heading * self.size * mid_offset_factor; mid_left = mid_base + perp * self.size * width_factor; mid_right = mid_base - perp * self.size * width_factor
             tail_base = self.position - heading * self.size * tail_offset_factor; tail_left = tail_base + perp * self.size * tail_width_factor; tail_right = tail_base - perp * self.size * tail_width_factor
@@ -174,45 +249,47 @@ class Boid:
 
 # --- Shark Klasse ---
 class Shark:
-    def __init__(self, x, y, params): # Nimmt params entgegen
+    def __init__(self, x, y, settings): # Nimmt Settings-Schnappschuss entgegen, wie Boid kein Tk
         self.position = Vector2(x, y); self.velocity = Vector2(random.uniform(-1, 1), random.uniform(-1, 1)).normalize() * 2
         self.acceleration = Vector2(0, 0); self.color = DARK_GRAY; self.outline_color = GRAY; self.size = 12
-        self.params = params; self.wander_angle = random.uniform(0, 2 * math.pi)
-        try:
-            current_eat_radius = self.params['shark_eat_radius'].get(); self.eat_radius_sq = current_eat_radius * current_eat_radius
-        except KeyError: eat_radius_fallback = 13.0; self.eat_radius_sq = eat_radius_fallback * eat_radius_fallback
+        self.wander_angle = random.uniform(0, 2 * math.pi)
+        current_eat_radius = settings.get('shark_eat_radius', 13.0); self.eat_radius_sq = current_eat_radius * current_eat_radius
     def apply_force(self, force):
          if force and math.isfinite(force.x) and math.isfinite(force.y): self.acceleration += force
-    def seek(self, target_pos):
-        max_speed=self.params['shark_max_speed'].get(); max_force=self.params['shark_max_force'].get()
+    def seek(self, target_pos, settings):
+        max_speed=settings['shark_max_speed']; max_force=settings['shark_max_force']
         desired = (target_pos - self.position); dist = desired.length()
         if dist > 0:
             desired = desired.normalize() * max_speed; steer = (desired - self.velocity)
             if steer.length() > max_force: steer.scale_to_length(max_force)
             return steer
         return Vector2(0, 0)
-    def hunt(self, all_boids): # Nimmt nur Boids entgegen zum Jagen
-        closest_boid = None; perception_radius = self.params['shark_perception_radius'].get()
+    def hunt(self, all_boids, settings, grid=None): # Nimmt nur Boids entgegen zum Jagen
+        closest_boid = None; perception_radius = settings['shark_perception_radius']
         min_dist_sq = perception_radius * perception_radius
+        if grid is not None: # Nur Boids aus Zellen in Sichtweite (Gitter enthält auch Haie)
+            all_boids = [b for b in grid.query(self.position, perception_radius) if isinstance(b, Boid)]
         for boid in all_boids:
             try:
                 dist_sq = self.position.distance_squared_to(boid.position)
                 if dist_sq < min_dist_sq: min_dist_sq = dist_sq; closest_boid = boid
             except OverflowError: continue
             except AttributeError: continue
-        if closest_boid: seek_force = self.seek(closest_boid.position); self.apply_force(seek_force); return True
-        else: self.wander(); return False
-    def wander(self):
-        max_force = self.params['shark_max_force'].get(); self.wander_angle += random.uniform(-0.3, 0.3)
+        return self.chase(closest_boid.position if closest_boid else None, settings)
+    def chase(self, target_pos, settings): # Verfolgt target_pos, ohne Ziel (None) wandert der Hai
+        if target_pos is not None: seek_force = self.seek(target_pos, settings); self.apply_force(seek_force); return True
+        else: self.wander(settings); return False
+    def wander(self, settings):
+        max_force = settings['shark_max_force']; self.wander_angle += random.uniform(-0.3, 0.3)
         wander_target_direction = Vector2(math.cos(self.wander_angle), math.sin(self.wander_angle))
         wander_force = wander_target_direction * max_force * 0.5; self.apply_force(wander_force)
-    def update(self):
-        max_speed = self.params['shark_max_speed'].get(); self.velocity += self.acceleration
+    def update(self, settings):
+        max_speed = settings['shark_max_speed']; self.velocity += self.acceleration
         vel_len_sq = self.velocity.length_squared(); max_speed_sq = max_speed * max_speed
         if vel_len_sq > max_speed_sq: self.velocity.scale_to_length(max_speed)
         self.position += self.velocity; self.acceleration *= 0
-    def wrap_borders(self, width, height):
-        max_speed=self.params['shark_max_speed'].get(); max_force=self.params['shark_max_force'].get()
+    def wrap_borders(self, width, height, settings):
+        max_speed=settings['shark_max_speed']; max_force=settings['shark_max_force']
         buffer = self.size * 2; steer = Vector2()
         if self.position.x < buffer: desired = Vector2(max_speed, self.velocity.y); steer = desired - self.velocity
         elif self.position.x > width - buffer: desired = Vector2(-max_speed, self.velocity.y); steer = desired - self.velocity
@@ -237,29 +314,278 @@ class Shark:
             pygame.draw.polygon(screen, self.outline_color, points, 2)
         except OverflowError: pass
 
+# --- Array-Engine (Structure of Arrays) ---
+class FlockEngine:
+    # Hält Position, Geschwindigkeit und Schwarm-Nummer ALLER Boids in NumPy-Arrays ((N,2) bzw. (N,))
+    # statt in einzelnen Boid-Objekten mit Vector2. Separation, Alignment, Kohäsion und Abneigung
+    # werden für alle Boids gleichzeitig berechnet: Die Kandidatenpaare (i, j) kommen aus einer
+    # sortierten Zellliste (gleiches toroidales Gitter wie SpatialGrid), alle Summen über Nachbarn
+    # sind np.bincount über diese Paare. Die Regeln selbst entsprechen Boid.flock
+    # Unterschied zu den Boid-Objekten: Alle Schwärme werden gleichzeitig bewegt, nicht Schwarm für
+    # Schwarm (dort sieht Schwarm 2 schon die neuen Positionen von Schwarm 1).
+    BUFFER = 12 # Wie Boid.wrap_borders (size * 2)
+    SIZE = 6 # Wie Boid.size
+
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.position = np.zeros((0, 2)); self.velocity = np.zeros((0, 2))
+        self.group = np.zeros(0, dtype=np.intp) # Index in colors/stores, einer pro Schwarm
+        self.colors = []; self.stores = []
+
+    def add_group(self, color, store):
+        # store: ParamStore des Schwarms, die Engine liest nur dessen Settings-Schnappschüsse
+        self.colors.append(color); self.stores.append(store)
+        return len(self.colors) - 1
+
+    def count(self, group=None):
+        if group is None: return len(self.group)
+        return int(np.count_nonzero(self.group == group))
+
+    def resize_group(self, group, target_count, width, height):
+        # Wie Swarm.update_boid_count: neue Boids zufällig verteilen, beim Kürzen die ältesten behalten
+        rows = np.flatnonzero(self.group == group); delta = int(target_count) - len(rows)
+        if delta > 0:
+            max_speed_init = self.stores[group].snapshot().get('max_speed', 4.0)
+            x = self.rng.uniform(0, width, delta) if width > 0 else np.full(delta, 100.0)
+            y = self.rng.uniform(0, height, delta) if height > 0 else np.full(delta, 100.0)
+            angle = self.rng.uniform(0, 2 * math.pi, delta)
+            speed = self.rng.uniform(1, max(1.1, max_speed_init / 2), delta)
+            self.position = np.concatenate((self.position, np.column_stack((x, y))))
+            self.velocity = np.concatenate((self.velocity, np.column_stack((np.cos(angle), np.sin(angle))) * speed[:, None]))
+            self.group = np.concatenate((self.group, np.full(delta, group, dtype=np.intp)))
+        elif delta < 0:
+            keep = np.ones(len(self.group), dtype=bool); keep[rows[int(target_count):]] = False
+            self._keep(keep)
+        return delta != 0
+
+    def _keep(self, keep):
+        self.position = self.position[keep]; self.velocity = self.velocity[keep]; self.group = self.group[keep]
+
+    def snapshot(self):
+        # Settings aller Schwärme für diesen Frame
+        return [store.snapshot() for store in self.stores]
+
+    def neighbor_pairs(self, radius, width, height):
+        # Zellliste (toroidal, Zellgröße >= radius), gibt (order, i, j) zurück:
+        # order sortiert die Boids nach Zelle, (i, j) mit i != j sind Kandidatenpaare aus den 3x3
+        # Nachbarzellen als Indizes in die SORTIERTEN Arrays. Nachbarn liegen so im Speicher nah
+        # beieinander, das macht die Gather-Zugriffe bei vielen Boids deutlich schneller.
+        pos = self.position; n = len(pos); buffer = self.BUFFER
+        empty = np.zeros(0, dtype=np.int32)
+        if n < 2: return np.arange(n), empty, empty
+        period_x = max(1.0, width + 2 * buffer); period_y = max(1.0, height + 2 * buffer)
+        cols = max(1, int(period_x // max(1.0, radius))); rows = max(1, int(period_y // max(1.0, radius)))
+        finite = np.isfinite(pos).all(axis=1)
+        safe = np.where(finite[:, None], pos, 0.0) # Kaputte Positionen fallen beim Abstandstest raus
+        cx = np.floor((safe[:, 0] + buffer) / (period_x / cols)).astype(np.intp) % cols
+        cy = np.floor((safe[:, 1] + buffer) / (period_y / rows)).astype(np.intp) % rows
+        cell = cx * rows + cy
+        order = np.argsort(cell, kind='stable')
+        cx = cx[order]; cy = cy[order]
+        counts = np.bincount(cell, minlength=cols * rows); starts = np.cumsum(counts) - counts
+        # Bei weniger als 3 Spalten/Zeilen fallen Nachbarzellen zusammen, nur einmal zählen
+        offsets = set(((dx % cols), (dy % rows)) for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+        index = np.arange(n, dtype=np.int32); all_i = []; all_j = []
+        for ox, oy in offsets:
+            neighbor = ((cx + ox) % cols) * rows + (cy + oy) % rows
+            c = counts[neighbor]; first = np.cumsum(c) - c
+            # Für Boid i alle Einträge starts[neighbor[i]] .. starts[neighbor[i]] + c[i]
+            all_i.append(np.repeat(index, c))
+            all_j.append(np.arange(c.sum(), dtype=np.int32) + np.repeat((starts[neighbor] - first).astype(np.int32), c))
+        i = np.concatenate(all_i); j = np.concatenate(all_j); other = i != j
+        return order, i[other], j[other]
+
+    @staticmethod
+    def _limit(vec, limit):
+        # Wie Vector2.scale_to_length, wenn Länge > limit
+        length = np.hypot(vec[:, 0], vec[:, 1])
+        scale = np.where(length > limit, limit / np.where(length > 0, length, 1.0), 1.0)
+        return vec * scale[:, None]
+
+    @staticmethod
+    def _steer(vel, total, count, max_speed, max_force):
+        # Wie Boid._steer_towards: Mittelwert auf max_speed, minus Geschwindigkeit, begrenzt
+        active = count > 0
+        mean = total / np.maximum(count, 1)[:, None]; length = np.hypot(mean[:, 0], mean[:, 1])
+        mean = np.where((length > 0)[:, None], mean / np.where(length > 0, length, 1.0)[:, None] * max_speed[:, None], mean)
+        steer = FlockEngine._limit(mean - vel, max_force)
+        steer[~active] = 0.0
+        return steer
+
+    @staticmethod
+    def _seek(pos, vel, target, active, max_speed, max_force):
+        # Wie Boid.seek für alle Boids, active = Boids mit Ziel
+        desired = target - pos; dist = np.hypot(desired[:, 0], desired[:, 1])
+        active = active & (dist > 0)
+        desired = desired / np.where(active, dist, 1.0)[:, None] * max_speed[:, None]
+        steer = FlockEngine._limit(desired - vel, max_force)
+        steer[~active] = 0.0
+        return steer
+
+    def accelerations(self, width, height, shark_positions=(), snapshot=None):
+        # Summe der gewichteten Steuerkräfte aller Boids, (N,2)
+        if snapshot is None: snapshot = self.snapshot()
+        n = len(self.position)
+        if n == 0: return np.zeros((0, 2))
+        reach = max(max(s['visual_range'], s['separation_distance'], s['avoidance_range']) for s in snapshot)
+        # Ab hier alles in Zell-Reihenfolge, am Ende wird zurücksortiert
+        order, i, j = self.neighbor_pairs(reach, width, height)
+        pos = self.position[order]; vel = self.velocity[order]; group = self.group[order]
+        def value(key): return np.array([s[key] for s in snapshot], dtype=float)[group]
+        max_speed = value('max_speed'); max_force = value('max_force')
+        sep_dist = value('separation_distance'); vis_range = value('visual_range'); avoid_range = value('avoidance_range')
+        # Paare außerhalb jeder Reichweite von i gleich verwerfen, das spart alle weiteren Rechnungen
+        # (np.take mit x/y getrennt ist deutlich schneller als pos[i] auf (N,2))
+        x = pos[:, 0].copy(); y = pos[:, 1].copy()
+        dx = np.take(x, i) - np.take(x, j); dy = np.take(y, i) - np.take(y, j); dist_sq = dx * dx + dy * dy
+        own_reach = np.maximum(np.maximum(sep_dist, vis_range), avoid_range)
+        close = (dist_sq > 0) & (dist_sq < np.take(own_reach, i) ** 2)
+        i = i[close]; j = j[close]; dist_sq = dist_sq[close]
+        diff = np.take(pos, i, axis=0) - np.take(pos, j, axis=0)
+        # diff / Abstand² ab Abstand 1 (wie in Boid.flock)
+        weighted = diff / np.maximum(dist_sq, 1.0)[:, None]
+        same = group[i] == group[j]
+
+        def total(mask, vec):
+            rows = i[mask]
+            return (np.column_stack((np.bincount(rows, weights=vec[mask, 0], minlength=n),
+                                     np.bincount(rows, weights=vec[mask, 1], minlength=n))),
+                    np.bincount(rows, minlength=n))
+        sep_sum, sep_count = total(same & (dist_sq < sep_dist[i] ** 2), weighted)
+        near = same & (dist_sq < vis_range[i] ** 2)
+        other_vel = np.take(vel, j, axis=0)
+        ali_sum, ali_count = total(near & ((other_vel ** 2).sum(axis=1) > 0), other_vel)
+        coh_sum, coh_count = total(near, np.take(pos, j, axis=0))
+        avo_sum, avo_count = total(~same & (dist_sq < avoid_range[i] ** 2), weighted)
+
+        # Haie sind wenige, die werden direkt gegen alle Boids geprüft (andere Farbe = Abneigung)
+        if len(shark_positions):
+            sharks = np.array([(p.x, p.y) for p in shark_positions], dtype=float)
+            diff = pos[:, None, :] - sharks[None, :, :]; dist_sq = (diff ** 2).sum(axis=2)
+            mask = (dist_sq > 0) & (dist_sq < avoid_range[:, None] ** 2)
+            weighted = diff / np.maximum(dist_sq, 1.0)[:, :, None]
+            avo_sum = avo_sum + (weighted * mask[:, :, None]).sum(axis=1); avo_count = avo_count + mask.sum(axis=1)
+
+        forces = (self._steer(vel, sep_sum, sep_count, max_speed, max_force) * value('separation_factor')[:, None],
+                  self._steer(vel, ali_sum, ali_count, max_speed, max_force) * value('alignment_factor')[:, None],
+                  self._seek(pos, vel, coh_sum / np.maximum(coh_count, 1)[:, None], coh_count > 0, max_speed, max_force) * value('cohesion_factor')[:, None],
+                  self._steer(vel, avo_sum, avo_count, max_speed, max_force) * value('avoidance_factor')[:, None])
+        sorted_acceleration = np.zeros((n, 2))
+        for force in forces: # Wie Boid.apply_force: nicht-endliche Kräfte ignorieren
+            sorted_acceleration += np.where(np.isfinite(force).all(axis=1)[:, None], force, 0.0)
+        acceleration = np.empty((n, 2)); acceleration[order] = sorted_acceleration
+        return acceleration
+
+    def integrate(self, acceleration, width, height, snapshot=None):
+        # Wie Boid.update + Boid.wrap_borders für alle Boids
+        if snapshot is None: snapshot = self.snapshot()
+        max_speed = np.array([s['max_speed'] for s in snapshot], dtype=float)[self.group]
+        vel = self.velocity + acceleration; speed_sq = (vel ** 2).sum(axis=1)
+        slow = speed_sq < 0.001; fast = ~slow & (speed_sq > max_speed ** 2)
+        vel[fast] *= (max_speed[fast] / np.sqrt(speed_sq[fast]))[:, None]
+        angle = self.rng.uniform(0, 2 * math.pi, int(slow.sum()))
+        vel[slow] = np.column_stack((np.cos(angle), np.sin(angle))) * 0.1
+        pos = self.position + vel; buffer = self.BUFFER
+        x = pos[:, 0]; y = pos[:, 1]
+        x[x < -buffer] = width + buffer; y[y < -buffer] = height + buffer
+        x[x > width + buffer] = -buffer; y[y > height + buffer] = -buffer
+        self.position = pos; self.velocity = vel
+
+    def step(self, width, height, shark_positions=()):
+        # Ein Frame für alle Schwärme
+        snapshot = self.snapshot()
+        self.integrate(self.accelerations(width, height, shark_positions, snapshot), width, height, snapshot)
+
+    def eat(self, shark_positions, eat_radius):
+        # Entfernt alle Boids im Fressradius eines Hais, gibt Anzahl gefressener Boids zurück
+        if not len(shark_positions) or not len(self.group): return 0
+        sharks = np.array([(p.x, p.y) for p in shark_positions], dtype=float)
+        dist_sq = ((self.position[:, None, :] - sharks[None, :, :]) ** 2).sum(axis=2)
+        eaten = (dist_sq < eat_radius * eat_radius).any(axis=1)
+        if eaten.any(): self._keep(~eaten)
+        return int(eaten.sum())
+
+    def nearest(self, position, radius):
+        # Position (Vector2) des nächsten Boids innerhalb radius oder None, wie in Shark.hunt
+        if not len(self.group): return None
+        dist_sq = ((self.position - (position.x, position.y)) ** 2).sum(axis=1)
+        best = int(np.argmin(dist_sq))
+        if not dist_sq[best] < radius * radius: return None
+        return Vector2(*self.position[best])
+
+    def draw(self, screen, group):
+        # Wie Boid.draw, Eckpunkte aller Boids eines Schwarms auf einmal berechnet
+        rows = np.flatnonzero(self.group == group)
+        pos = self.position[rows]; vel = self.velocity[rows]; color = self.colors[group]; size = self.SIZE
+        ok = np.isfinite(pos).all(axis=1) & np.isfinite(vel).all(axis=1)
+        pos = pos[ok]; vel = vel[ok]; speed_sq = (vel ** 2).sum(axis=1)
+        still = speed_sq < 0.01
+        for x, y in pos[still].astype(int).tolist(): pygame.draw.circle(screen, color, (x, y), int(size * 0.8))
+        pos = pos[~still]; heading = vel[~still] / np.sqrt(speed_sq[~still])[:, None]
+        settings = self.stores[group].snapshot()
+        geometry = dict((key, settings.get(key, value)) for key, value in default_geometry.items())
+        perp = np.column_stack((-heading[:, 1], heading[:, 0]))
+        tip = pos + heading * size * geometry['geom_tip_factor']
+        mid_base = pos + heading * size * geometry['geom_mid_offset_factor']; mid = perp * size * geometry['geom_width_factor']
+        tail_base = pos - heading * size * geometry['geom_tail_offset_factor']; tail = perp * size * geometry['geom_tail_width_factor']
+        points = np.stack((tip, mid_base + mid, tail_base + tail, tail_base - tail, mid_base - mid), axis=1).astype(int)
+        for polygon in points.tolist(): pygame.draw.polygon(screen, color, polygon)
+
+# Leichte Ansicht eines Boids der FlockEngine (Kopie, für Code der Boid-Objekte erwartet)
+class BoidView:
+    def __init__(self, position, velocity, color):
+        self.position = Vector2(*position); self.velocity = Vector2(*velocity); self.color = color
+
+# Listen-Ansicht der Boids eines Schwarms (group=None: aller Schwärme) in der FlockEngine
+class EngineBoids:
+    def __init__(self, engine, group=None): self.engine = engine; self.group = group
+    def __len__(self): return self.engine.count(self.group)
+    def __iter__(self):
+        engine = self.engine
+        rows = range(engine.count()) if self.group is None else np.flatnonzero(engine.group == self.group)
+        for row in rows: yield BoidView(engine.position[row], engine.velocity[row], engine.colors[engine.group[row]])
+    def __add__(self, other): return list(self) + list(other)
+    def __radd__(self, other): return list(other) + list(self)
+
 # --- Schwarm Klasse ---
 class Swarm:
     # NIMMT JETZT EIN EINZIGES PARAMETER-DICT ENTGEGEN
-    def __init__(self, initial_count, color, params):
+    # Mit engine (FlockEngine) ist der Schwarm nur eine Ansicht auf seine Zeilen in den Arrays
+    # params: Dict mit Tk-Variablen (GUI) oder Zahlen (headless), oder ein fertiger ParamStore
+    def __init__(self, initial_count, color, params, engine=None):
         self.color = color
-        self.params = params # Speichert das kombinierte Parameter-Dict
-        self.boids = []
+        self.store = params if isinstance(params, ParamStore) else ParamStore(params)
+        self.params = self.store.params # Speichert das kombinierte Parameter-Dict (für die GUI)
+        self.engine = engine
+        self._boids = []
+        if engine is not None: self.group = engine.add_group(color, self.store)
+
+    @property
+    def boids(self):
+        if self.engine is not None: return EngineBoids(self.engine, self.group)
+        return self._boids
+    @boids.setter
+    def boids(self, boids):
+        if self.engine is not None: raise AttributeError("Boids der FlockEngine über update_boid_count/eat ändern")
+        self._boids = boids
 
     def initialize_boids(self, initial_count):
          self.update_boid_count(initial_count)
 
     def update_boid_count(self, target_count):
+        global SCREEN_WIDTH, SCREEN_HEIGHT
+        if self.engine is not None:
+            return self.engine.resize_group(self.group, target_count, SCREEN_WIDTH, SCREEN_HEIGHT)
         target_count = int(target_count)
         current_count = len(self.boids)
         delta = target_count - current_count
-        global SCREEN_WIDTH, SCREEN_HEIGHT
         list_changed = False
         if delta > 0:
             for _ in range(delta):
                 start_x = random.uniform(0, SCREEN_WIDTH) if SCREEN_WIDTH > 0 else 100
                 start_y = random.uniform(0, SCREEN_HEIGHT) if SCREEN_HEIGHT > 0 else 100
                 # Übergibt das kombinierte Parameter-Dict an Boid
-                new_boid = Boid(start_x, start_y, self.color, self.params)
+                new_boid = Boid(start_x, start_y, self.color, self.store.snapshot())
                 self.boids.append(new_boid)
             list_changed = True
         elif delta < 0:
@@ -268,22 +594,34 @@ class Swarm:
                  list_changed = True
         return list_changed
 
-    # Nimmt jetzt all_entities (Boids + Haie)
-    def run(self, screen, all_entities):
-        for boid in self.boids: boid.flock(all_entities) # Übergibt alle Entities für Avoidance
+    # Nimmt jetzt all_entities (Boids + Haie) und optional das Zellgitter des Frames
+    # Engine-Modus: Bewegung macht FlockEngine.step() für alle Schwärme gemeinsam, run() zeichnet nur
+    # screen=None (headless): nur simulieren, nichts zeichnen
+    def run(self, screen, all_entities, grid=None):
+        if self.engine is not None:
+            if screen is not None: self.engine.draw(screen, self.group)
+            return
+        settings = self.store.snapshot() # Ein Schnappschuss pro Frame für alle Boids
+        for boid in self.boids: boid.flock(all_entities, settings, grid) # Übergibt alle Entities für Avoidance
         for boid in self.boids:
-            boid.update()
+            boid.update(settings)
             boid.wrap_borders(SCREEN_WIDTH, SCREEN_HEIGHT)
-            boid.draw(screen)
+            if screen is not None: boid.draw(screen, settings)
 
 
 # --- Globale Variablen und Definitionen ---
 running = True
 screen = None
+engine = None # FlockEngine, falls NumPy vorhanden (sonst Boid-Objekte)
+
+# Alle Boids aller Schwärme (Liste der Boid-Objekte bzw. Ansicht auf die FlockEngine)
+def collect_all_boids():
+    if engine is not None: return EngineBoids(engine)
+    return swarm1.boids + swarm2.boids + swarm3.boids + swarm4.boids
 
 # Parameter Definitionen für ALLE Slider
 slider_definitions = {
-    'boid_count': ("Anzahl", 1, 250, 1), # Gekürzt für mehr Platz
+    'boid_count': ("Anzahl", 1, 2000, 1), # Gekürzt für mehr Platz (Zellgitter erlaubt mehr Boids)
     'separation_factor': ("Separation", 0.0, 5.0, 0.1), # Gekürzt
     'alignment_factor': ("Alignment", 0.0, 5.0, 0.1), # Gekürzt
     'cohesion_factor': ("Kohäsion", 0.0, 5.0, 0.1), # Gekürzt
@@ -350,6 +688,185 @@ default_values_shark = {
 }
 
 
+# --- Simulationsschritt (GUI und headless) ---
+def simulate_frame(swarms, sharks, shark_settings, engine=None, screen=None):
+    # Ein Frame wie in simulation_update: Haie fressen und jagen, dann bewegen sich alle Schwärme
+    # (und werden gezeichnet, falls screen). Gibt (alle Boids, Anzahl gefressener Boids) zurück
+    def boids_of_all_swarms():
+        if engine is not None: return EngineBoids(engine)
+        return [boid for swarm in swarms for boid in swarm.boids]
+    all_boids = boids_of_all_swarms()
+    # (FlockEngine bekommt nur die Hai-Positionen, Boids stecken in ihren Arrays)
+    all_entities = all_boids + sharks if engine is None else sharks
+
+    # === Zellgitter für Nachbarschaftsabfragen (einmal pro Frame, nur für Boid-Objekte) ===
+    grid = None
+    if engine is None:
+        try:
+            swarm_settings = [swarm.store.snapshot() for swarm in swarms]
+            # Zellgröße = größte Reichweite aller Schwärme, dazu die größte Strecke pro Frame
+            neighbor_range = max(st[key] for st in swarm_settings
+                                 for key in ('visual_range', 'separation_distance', 'avoidance_range'))
+            max_step = max([st['max_speed'] for st in swarm_settings] + [shark_settings['shark_max_speed']])
+            # buffer wie in Boid.wrap_borders (size * 2)
+            grid = SpatialGrid(neighbor_range + max_step, SCREEN_WIDTH, SCREEN_HEIGHT, buffer=12, slack=max_step)
+            grid.build(all_entities)
+        except Exception as e:
+            print(f"Fehler beim Aufbau des Zellgitters: {e}"); grid = None # Fallback: alle gegen alle
+
+    eaten_count = 0
+    # === Hai Logik (nur ausführen, wenn aktiv und Haie vorhanden) ===
+    if shark_settings.get('shark_enabled', False) and sharks:
+        # === Hai Fressradius aktualisieren (nur einmal, da alle Haie dieselben Params haben) ===
+        eat_radius_sq = sharks[0].eat_radius_sq # Standardwert holen
+        if 'shark_eat_radius' in shark_settings:
+            current_eat_radius = shark_settings['shark_eat_radius']
+            eat_radius_sq = current_eat_radius * current_eat_radius
+            # Radius für alle Hai-Objekte aktualisieren
+            for s in sharks: s.eat_radius_sq = eat_radius_sq
+
+        # === Haie fressen Fische (FlockEngine: alle Boids gegen alle Haie auf einmal) ===
+        if engine is not None:
+            eaten_count = engine.eat([s.position for s in sharks], math.sqrt(eat_radius_sq))
+        else:
+            eaten_this_frame = set()
+            # Wichtig: Iteriere über eine Kopie der Boids zum Prüfen!
+            boids_to_check = list(all_boids)
+            # Iteriere durch jeden aktiven Hai
+            for shark_instance in sharks:
+                 # Mit Zellgitter nur Boids in der Nähe des Hais prüfen
+                 if grid is not None:
+                     boids_to_check = [b for b in grid.query(shark_instance.position, math.sqrt(eat_radius_sq)) if isinstance(b, Boid)]
+                 # Iteriere durch jeden Boid
+                 for boid in boids_to_check:
+                    # Ignoriere bereits gefressene Boids in dieser Runde
+                    if boid in eaten_this_frame: continue
+                    try:
+                        dist_sq = shark_instance.position.distance_squared_to(boid.position)
+                        if dist_sq < eat_radius_sq: # Verwende den aktualisierten Radius
+                            eaten_this_frame.add(boid)
+                    except OverflowError: continue
+                    except AttributeError: continue
+                    except Exception as e: continue
+
+            # === Listen neu aufbauen, wenn etwas gefressen wurde ===
+            if eaten_this_frame:
+                for swarm in swarms: swarm.boids = [b for b in swarm.boids if b not in eaten_this_frame]
+                if grid is not None: grid.discard(eaten_this_frame) # Zellgitter auch aktualisieren
+            eaten_count = len(eaten_this_frame)
+        # Boid-Liste und Entity-Liste müssen aktualisiert werden!
+        if eaten_count:
+            all_boids = boids_of_all_swarms()
+            if engine is None: all_entities = all_boids + sharks
+
+        # === Hai Simulation (Update, Grenzen, Jagen für jeden Hai) ===
+        try:
+            for shark_instance in sharks:
+                # Haie jagen nur Boids, nicht andere Haie
+                if engine is not None:
+                    perception_radius = shark_settings['shark_perception_radius']
+                    shark_instance.chase(engine.nearest(shark_instance.position, perception_radius), shark_settings)
+                else: shark_instance.hunt(all_boids, shark_settings, grid)
+                shark_instance.update(shark_settings)
+                shark_instance.wrap_borders(SCREEN_WIDTH, SCREEN_HEIGHT, shark_settings)
+        except Exception as e:
+            print(f"Fehler in Hai Simulation: {e}")
+
+    # === Schwärme simulieren (und zeichnen, übergeben all_entities) ===
+    if len(all_boids) > 0:
+        # FlockEngine bewegt alle Schwärme in einem Schritt, Swarm.run() zeichnet dann nur
+        if engine is not None: engine.step(SCREEN_WIDTH, SCREEN_HEIGHT, [s.position for s in sharks])
+        for swarm in swarms: swarm.run(screen, all_entities, grid)
+    return all_boids, eaten_count
+
+
+# --- Headless Betrieb und Benchmark (ohne Tkinter/Pygame-Fenster) ---
+def run_headless(frames, swarm_values=None, shark_values=None, seed=None, width=1280, height=720, use_engine=True):
+    # Simuliert frames Frames mit festen Parametern (Dicts wie default_values_swarm1..4 / default_values_shark)
+    # so schnell wie möglich, ohne Fenster und ohne clock.tick(FPS). Mit seed ist der Lauf reproduzierbar.
+    # Gibt pro Frame ein Dict zurück: Rechenzeit (ms), Boids pro Schwarm, gefressene Boids, Anzahl Haie
+    global SCREEN_WIDTH, SCREEN_HEIGHT
+    SCREEN_WIDTH, SCREEN_HEIGHT = width, height
+    if swarm_values is None: swarm_values = [default_values_swarm1, default_values_swarm2, default_values_swarm3, default_values_swarm4]
+    if shark_values is None: shark_values = default_values_shark
+    random.seed(seed)
+    flock_engine = FlockEngine(seed) if use_engine and np is not None else None
+
+    colors = [BLUE, RED, PURPLE, GREEN]
+    swarms = [Swarm(0, colors[n % len(colors)], dict(values), flock_engine) for n, values in enumerate(swarm_values)]
+    for swarm, values in zip(swarms, swarm_values): swarm.initialize_boids(int(values['boid_count']))
+    shark_settings = ParamStore(dict(shark_values)).snapshot()
+    sharks = [Shark(random.uniform(0, width), random.uniform(0, height), shark_settings)
+              for _ in range(int(shark_settings.get('shark_count', 1)))]
+
+    records = []
+    for frame in range(frames):
+        start = time.perf_counter()
+        all_boids, eaten = simulate_frame(swarms, sharks, shark_settings, flock_engine)
+        elapsed = time.perf_counter() - start
+        record = {'frame': frame, 'time_ms': elapsed * 1000.0, 'boids': len(all_boids), 'eaten': eaten, 'sharks': len(sharks)}
+        for n, swarm in enumerate(swarms): record[f'swarm{n + 1}'] = len(swarm.boids)
+        records.append(record)
+    return records
+
+def split_boid_count(total, swarm_values):
+    # Verteilt total Boids im Verhältnis der boid_count-Werte auf die Schwärme (Kopien der Dicts)
+    weights = [max(0, values['boid_count']) for values in swarm_values]
+    if not sum(weights): weights = [1] * len(weights) # Alle 0: gleichmäßig verteilen
+    counts = [int(total * w / sum(weights)) for w in weights]
+    counts[0] += total - sum(counts) # Rundungsrest an Schwarm 1
+    return [dict(values, boid_count=count) for values, count in zip(swarm_values, counts)]
+
+def run_benchmark(boid_counts=(100, 300, 1000, 3000, 10000), shark_counts=(0, 1, 5, 10), frames=100, warmup=10,
+                  seed=1, swarm_values=None, shark_values=None, use_engine=True):
+    # Benchmark-Matrix: Boid-Anzahl (gesamt, auf die Schwärme verteilt) x Hai-Anzahl.
+    # Die ersten warmup Frames zählen nicht zur Zeit. Gibt eine Zeile (Dict) pro Kombination zurück
+    if swarm_values is None: swarm_values = [default_values_swarm1, default_values_swarm2, default_values_swarm3, default_values_swarm4]
+    if shark_values is None: shark_values = default_values_shark
+    rows = []
+    for boid_count in boid_counts:
+        for shark_count in shark_counts:
+            records = run_headless(warmup + frames, split_boid_count(boid_count, swarm_values),
+                                   dict(shark_values, shark_count=shark_count), seed, use_engine=use_engine)
+            times = sorted(r['time_ms'] for r in records[warmup:])
+            rows.append({'boids': boid_count, 'sharks': shark_count, 'frames': len(times),
+                         'mean_ms': sum(times) / len(times), 'median_ms': times[len(times) // 2],
+                         'p95_ms': times[min(len(times) - 1, int(0.95 * len(times)))], 'max_ms': times[-1],
+                         'eaten': sum(r['eaten'] for r in records), 'boids_left': records[-1]['boids']})
+            row = rows[-1]
+            print(f"{boid_count:6d} Boids {shark_count:3d} Haie: {row['mean_ms']:8.2f} ms/Frame (Median {row['median_ms']:.2f}, "
+                  f"p95 {row['p95_ms']:.2f}, {1000.0 / row['mean_ms']:6.1f} FPS), gefressen {row['eaten']}, übrig {row['boids_left']}")
+    return rows
+
+def write_csv(path, rows):
+    import csv
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys())); writer.writeheader(); writer.writerows(rows)
+
+def headless_main(args):
+    # Aufruf über die Kommandozeile (--headless / --benchmark), siehe Hauptteil
+    import json
+    swarm_values = [default_values_swarm1, default_values_swarm2, default_values_swarm3, default_values_swarm4]
+    shark_values = default_values_shark
+    if args.params: # JSON: {"swarm1": {...}, ..., "shark": {...}} überschreibt die Default-Werte
+        with open(args.params) as f: overrides = json.load(f)
+        swarm_values = [dict(values, **overrides.get(f'swarm{n + 1}', {})) for n, values in enumerate(swarm_values)]
+        shark_values = dict(shark_values, **overrides.get('shark', {}))
+    use_engine = not args.objects
+    if np is None and use_engine: print("NumPy fehlt, nutze Boid-Objekte.")
+    if args.benchmark:
+        rows = run_benchmark([int(n) for n in args.boids.split(',')], [int(n) for n in args.sharks.split(',')],
+                             args.frames, args.warmup, args.seed, swarm_values, shark_values, use_engine)
+    else:
+        if args.boids: swarm_values = split_boid_count(int(args.boids.split(',')[0]), swarm_values)
+        if args.sharks: shark_values = dict(shark_values, shark_count=int(args.sharks.split(',')[0]))
+        rows = run_headless(args.frames, swarm_values, shark_values, args.seed, args.width, args.height, use_engine)
+        times = [r['time_ms'] for r in rows]
+        print(f"{len(rows)} Frames: {sum(times) / len(times):.2f} ms/Frame, gefressen {sum(r['eaten'] for r in rows)}, "
+              f"übrig {rows[-1]['boids']} Boids, {rows[-1]['sharks']} Haie")
+    if args.csv: write_csv(args.csv, rows); print(f"Ergebnisse in {args.csv} geschrieben.")
+
+
 # --- Tkinter Hilfsfunktionen ---
 def close_app(root):
     global running
@@ -446,7 +963,7 @@ def replenish_swarm(params_dict):
             if target_count > current_count:
                 if target_swarm.update_boid_count(target_count): # True wenn hinzugefügt wurde
                     # Globale Liste aller Boids neu bauen!
-                    all_boids = swarm1.boids + swarm2.boids + swarm3.boids + swarm4.boids
+                    all_boids = collect_all_boids()
                     print(f"{swarm_name} aufgefüllt auf {len(target_swarm.boids)}. Gesamt Boids: {len(all_boids)}")
                     # Update Actual Label (verwende den neuen Key)
                     if 'boid_count_actual_label' in params_dict:
@@ -521,6 +1038,28 @@ def setup_tkinter_controls():
 
 # --- Hauptteil ---
 if __name__ == "__main__":
+    # Kommandozeile: ohne Optionen startet die GUI, --headless/--benchmark laufen ohne Fenster
+    import argparse
+    parser = argparse.ArgumentParser(description="Boids Simulation mit Haien")
+    parser.add_argument('--headless', action='store_true', help="ohne Fenster simulieren, Zeiten und Population pro Frame")
+    parser.add_argument('--benchmark', action='store_true', help="Benchmark-Matrix über Boid- und Hai-Anzahl")
+    parser.add_argument('--frames', type=int, default=None, help="Frames pro Lauf (headless 600, Benchmark 100)")
+    parser.add_argument('--warmup', type=int, default=10, help="Frames ohne Zeitmessung vor dem Benchmark")
+    parser.add_argument('--boids', default=None, help="Boids gesamt, beim Benchmark Liste (Default 100,300,1000,3000,10000)")
+    parser.add_argument('--sharks', default=None, help="Anzahl Haie, beim Benchmark Liste (Default 0,1,5,10)")
+    parser.add_argument('--seed', type=int, default=1, help="Zufallszahl-Seed für reproduzierbare Läufe")
+    parser.add_argument('--width', type=int, default=1280); parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--params', default=None, help='JSON-Datei {"swarm1": {...}, ..., "shark": {...}} mit Parametern')
+    parser.add_argument('--objects', action='store_true', help="Boid-Objekte statt FlockEngine (NumPy)")
+    parser.add_argument('--csv', default=None, help="Ergebnisse als CSV speichern")
+    args = parser.parse_args()
+    if args.headless or args.benchmark:
+        if args.frames is None: args.frames = 100 if args.benchmark else 600
+        if args.benchmark:
+            if args.boids is None: args.boids = '100,300,1000,3000,10000'
+            if args.sharks is None: args.sharks = '0,1,5,10'
+        headless_main(args); sys.exit(0)
+
     # Hole alle Parameter-Dictionaries
     root, params1, params2, params3, params4, params_shark = setup_tkinter_controls() # << Angepasst
     pygame.init()
@@ -598,19 +1137,23 @@ if __name__ == "__main__":
 
     # Schwärme erstellen
     try:
-        global swarm1, swarm2, swarm3, swarm4 # Für Callbacks
+        global swarm1, swarm2, swarm3, swarm4 # Für Callbacks (engine ist schon global)
+        # Mit NumPy liegen alle Boids in den Arrays der FlockEngine, die Schwärme sind nur Ansichten
+        engine = FlockEngine() if np is not None else None
+        print("Array-Engine (NumPy) aktiv." if engine is not None else "NumPy fehlt, nutze Boid-Objekte.")
         # Übergibt die kombinierten Param-Dicts an Swarm Konstruktor
-        swarm1 = Swarm(0, BLUE, params1); swarm2 = Swarm(0, RED, params2)
-        swarm3 = Swarm(0, PURPLE, params3); swarm4 = Swarm(0, GREEN, params4) # NEU
+        swarm1 = Swarm(0, BLUE, params1, engine); swarm2 = Swarm(0, RED, params2, engine)
+        swarm3 = Swarm(0, PURPLE, params3, engine); swarm4 = Swarm(0, GREEN, params4, engine) # NEU
         swarm1.initialize_boids(int(default_values_swarm1['boid_count']))
         swarm2.initialize_boids(int(default_values_swarm2['boid_count']))
         swarm3.initialize_boids(int(default_values_swarm3['boid_count'])) # NEU
         swarm4.initialize_boids(int(default_values_swarm4['boid_count'])) # NEU
-        all_boids = swarm1.boids + swarm2.boids + swarm3.boids + swarm4.boids # NEU
+        all_boids = collect_all_boids() # NEU
 
         # Haie als Liste erstellen (initial leer, wird in Schleife gefüllt)
         global sharks # Globale Liste für Haie
         sharks = []
+        shark_store = ParamStore(params_shark) # Hai-Parameter als Schnappschuss für die Simulation
 
         print(f"Init: S1={len(swarm1.boids)}, S2={len(swarm2.boids)}, S3={len(swarm3.boids)}, S4={len(swarm4.boids)}. Haie initial: {len(sharks)}")
     except Exception as e: print(f"Fehler Erstellung: {e}"); close_app(root); exit()
@@ -620,7 +1163,7 @@ if __name__ == "__main__":
     def simulation_update():
         global running, all_boids, screen, app_font, sharks # Globale Variablen
         global swarm1, swarm2, swarm3, swarm4
-        global params1, params2, params3, params4, params_shark
+        global params1, params2, params3, params4, params_shark, shark_store
 
         if not running or screen is None: return
 
@@ -635,23 +1178,31 @@ if __name__ == "__main__":
                  try: screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.RESIZABLE | pygame.DOUBLEBUF)
                  except pygame.error as e: print(f"Fehler Resize: {e}")
 
+        # === Parameter-Schnappschüsse für diesen Frame (Tk wird nur nach Slider-Änderungen gelesen) ===
+        try:
+            settings1 = swarm1.store.snapshot(); settings2 = swarm2.store.snapshot()
+            settings3 = swarm3.store.snapshot(); settings4 = swarm4.store.snapshot()
+            shark_settings = shark_store.snapshot()
+        except tk.TclError:
+            if running: close_app(root); return
+
         # === Boid Anzahl anpassen (Slider reduziert) ===
         rebuild_all_boids_due_to_slider = False
         try:
             # Schwarm 1
-            target_count1 = params1['boid_count'].get(); current_count1 = len(swarm1.boids)
+            target_count1 = settings1['boid_count']; current_count1 = len(swarm1.boids)
             if target_count1 < current_count1:
                 if swarm1.update_boid_count(target_count1): rebuild_all_boids_due_to_slider = True
             # Schwarm 2
-            target_count2 = params2['boid_count'].get(); current_count2 = len(swarm2.boids)
+            target_count2 = settings2['boid_count']; current_count2 = len(swarm2.boids)
             if target_count2 < current_count2:
                  if swarm2.update_boid_count(target_count2): rebuild_all_boids_due_to_slider = True
             # Schwarm 3 NEU
-            target_count3 = params3['boid_count'].get(); current_count3 = len(swarm3.boids)
+            target_count3 = settings3['boid_count']; current_count3 = len(swarm3.boids)
             if target_count3 < current_count3:
                  if swarm3.update_boid_count(target_count3): rebuild_all_boids_due_to_slider = True
             # Schwarm 4 NEU
-            target_count4 = params4['boid_count'].get(); current_count4 = len(swarm4.boids)
+            target_count4 = settings4['boid_count']; current_count4 = len(swarm4.boids)
             if target_count4 < current_count4:
                  if swarm4.update_boid_count(target_count4): rebuild_all_boids_due_to_slider = True
 
@@ -664,7 +1215,7 @@ if __name__ == "__main__":
         # === Hai Anzahl anpassen (Slider) === NEU
         shark_list_changed = False
         try:
-            target_shark_count = params_shark['shark_count'].get()
+            target_shark_count = shark_settings['shark_count']
             current_shark_count = len(sharks)
             delta_sharks = target_shark_count - current_shark_count
 
@@ -672,7 +1223,7 @@ if __name__ == "__main__":
                 for _ in range(delta_sharks):
                     start_x = random.uniform(0, SCREEN_WIDTH) if SCREEN_WIDTH > 0 else 200
                     start_y = random.uniform(0, SCREEN_HEIGHT) if SCREEN_HEIGHT > 0 else 200
-                    new_shark = Shark(start_x, start_y, params_shark)
+                    new_shark = Shark(start_x, start_y, shark_settings)
                     sharks.append(new_shark)
                 shark_list_changed = True
                 # print(f"Haie hinzugefügt. Neu: {len(sharks)}") # Debug
@@ -689,97 +1240,25 @@ if __name__ == "__main__":
 
         # === Globale Boid-Liste neu bauen, falls nötig ===
         if rebuild_all_boids_due_to_slider:
-            all_boids = swarm1.boids + swarm2.boids + swarm3.boids + swarm4.boids
-
-        # === Alle Entities für Kollisionsprüfung/Sichtbarkeit ===
-        # Fügt die aktuelle Liste der Haie hinzu (wichtig für Boid Avoidance)
-        all_entities = all_boids + sharks
-
+            all_boids = collect_all_boids()
 
         # === Prüfen, ob Haie aktiv sind ===
-        shark_is_active = False
-        try:
-            if 'shark_enabled' in params_shark:
-                 shark_is_active = params_shark['shark_enabled'].get()
-        except (tk.TclError, KeyError):
-             pass # Tkinter oder Variable könnte weg sein, wenn App schließt
-
-        # === Hai Logik (nur ausführen, wenn aktiv und Haie vorhanden) ===
-        if shark_is_active and sharks:
-            # === Hai Fressradius aktualisieren (nur einmal, da alle Haie dieselben Params haben) ===
-            eat_radius_sq = sharks[0].eat_radius_sq # Standardwert holen
-            try:
-                 if 'shark_eat_radius' in params_shark:
-                    current_eat_radius = params_shark['shark_eat_radius'].get()
-                    eat_radius_sq = current_eat_radius * current_eat_radius
-                    # Radius für alle Hai-Objekte aktualisieren
-                    for s in sharks: s.eat_radius_sq = eat_radius_sq
-            except tk.TclError: pass
-            except KeyError: pass
-            except Exception as e: print(f"Fehler Update Hai Radius: {e}")
-
-            # === Haie fressen Fische ===
-            eaten_this_frame = set()
-            # Wichtig: Iteriere über eine Kopie der Boids zum Prüfen!
-            boids_to_check = list(all_boids)
-            # Iteriere durch jeden aktiven Hai
-            for shark_instance in sharks:
-                 # Iteriere durch jeden Boid
-                 for boid in boids_to_check:
-                    # Ignoriere bereits gefressene Boids in dieser Runde
-                    if boid in eaten_this_frame: continue
-                    try:
-                        dist_sq = shark_instance.position.distance_squared_to(boid.position)
-                        if dist_sq < eat_radius_sq: # Verwende den aktualisierten Radius
-                            eaten_this_frame.add(boid)
-                    except OverflowError: continue
-                    except AttributeError: continue
-                    except Exception as e: continue
-
-            # === Listen neu aufbauen, wenn etwas gefressen wurde ===
-            if eaten_this_frame:
-                # print(f"{len(sharks)} Hai(e) haben {len(eaten_this_frame)} Fisch(e) gefressen!") # Debug
-                old_s1_count = len(swarm1.boids)
-                swarm1.boids = [b for b in swarm1.boids if b not in eaten_this_frame]
-                old_s2_count = len(swarm2.boids)
-                swarm2.boids = [b for b in swarm2.boids if b not in eaten_this_frame]
-                old_s3_count = len(swarm3.boids) # NEU
-                swarm3.boids = [b for b in swarm3.boids if b not in eaten_this_frame]
-                old_s4_count = len(swarm4.boids) # NEU
-                swarm4.boids = [b for b in swarm4.boids if b not in eaten_this_frame]
-
-                # Globale Boid-Liste und Entity-Liste müssen aktualisiert werden!
-                all_boids = swarm1.boids + swarm2.boids + swarm3.boids + swarm4.boids
-                all_entities = all_boids + sharks # Entity Liste auch!
-                # print(f"  Verbleibend all: {len(all_boids)}") # Debug
-
-            # === Hai Simulation (Update, Grenzen, Jagen für jeden Hai) ===
-            try:
-                for shark_instance in sharks:
-                    # Haie jagen nur Boids, nicht andere Haie
-                    shark_instance.hunt(all_boids)
-                    shark_instance.update()
-                    shark_instance.wrap_borders(SCREEN_WIDTH, SCREEN_HEIGHT)
-            except Exception as e:
-                print(f"Fehler in Hai Simulation: {e}")
+        shark_is_active = bool(shark_settings.get('shark_enabled', False))
 
         # === Simulation & Rendering ===
         try:
             screen.fill(BLACK) # Hintergrund
 
-            # Schwärme simulieren und zeichnen (übergeben all_entities)
-            if len(all_boids) > 0:
-                 swarm1.run(screen, all_entities)
-                 swarm2.run(screen, all_entities)
-                 swarm3.run(screen, all_entities) # NEU
-                 swarm4.run(screen, all_entities) # NEU
-            elif app_font: # Nachricht wenn alle Fische weg sind
+            # Haie fressen und jagen, Schwärme werden simuliert und gezeichnet (gleicher Schritt wie headless)
+            all_boids, eaten_count = simulate_frame([swarm1, swarm2, swarm3, swarm4], sharks, shark_settings, engine, screen)
+
+            if len(all_boids) == 0 and app_font: # Nachricht wenn alle Fische weg sind
                  # Nachricht nur anzeigen, wenn auch keine Haie (mehr) da sind
                  if not sharks:
                      text = app_font.render("Alles leer!", True, WHITE)
                      text_rect = text.get_rect(center=(SCREEN_WIDTH/2, SCREEN_HEIGHT/2))
                      screen.blit(text, text_rect)
-                 elif not all_boids:
+                 else:
                      text = app_font.render("Alle Fische gefressen!", True, WHITE)
                      text_rect = text.get_rect(center=(SCREEN_WIDTH/2, SCREEN_HEIGHT/2))
                      screen.blit(text, text_rect)